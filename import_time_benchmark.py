@@ -0,0 +1,77 @@
+import re
+import sys
+import argparse
+import subprocess
+
+# Modules which must not be imported by the production capture path (they are imported only when used)
+DEFERRED_MODULES = ["matplotlib", "scipy", "zmq", "numba", "h5py", "pandas"]
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+parser = argparse.ArgumentParser(description="Measures the cold import time of a module ('python -X importtime') "
+                                             "and checks that heavy modules are not imported.")
+parser.add_argument(
+    "-m", "--module", default="main", help="Module to import (default: 'main', production capture hooks)"
+)
+parser.add_argument(
+    "-r", "--runs", type=int, default=5, help="Number of runs. The fastest run is reported (less noise)"
+)
+parser.add_argument(
+    "-t", "--max-time", type=float, default=None, help="Maximum import time [ms]. Fails if exceeded"
+)
+parser.add_argument(
+    "-n", "--top", type=int, default=15, help="Number of slowest top-level imports to show"
+)
+
+
+def measure_import_time(module):
+    """
+    Import the module in a new interpreter with '-X importtime'.
+    :return: Total import time [us] and cumulative time [us] of each imported module
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Module '{module}' could not be imported:\n{result.stderr}")
+
+    cumulative_times = {}
+    top_level_times = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        _, cumulative_time, indent, name = match.groups()
+        cumulative_times[name] = int(cumulative_time)
+        if len(indent) == 1:  # Imported directly by the interpreter (not by another module)
+            top_level_times[name] = int(cumulative_time)
+
+    return cumulative_times.get(module, sum(top_level_times.values())), cumulative_times
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+
+    runs = [measure_import_time(args.module) for _ in range(args.runs)]
+    total_time, cumulative_times = min(runs, key=lambda run: run[0])
+
+    print(f"Import time of '{args.module}': {total_time / 1000:.1f} ms (fastest of {args.runs} runs)")
+    print("Slowest imports (cumulative):")
+    for name, cumulative_time in sorted(cumulative_times.items(), key=lambda item: item[1],
+                                        reverse=True)[:args.top]:
+        print(f"  {cumulative_time / 1000:8.1f} ms  {name}")
+
+    failures = []
+    imported_deferred_modules = [module for module in DEFERRED_MODULES if module in cumulative_times]
+    if imported_deferred_modules:
+        failures.append(f"Deferred modules imported at startup: {imported_deferred_modules}")
+
+    if args.max_time is not None and total_time / 1000 > args.max_time:
+        failures.append(f"Import time {total_time / 1000:.1f} ms exceeds the maximum {args.max_time} ms")
+
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,34 +1,47 @@
 import os
+import copy
 import argparse
-from dotenv import load_dotenv
+import multiprocessing
 
-from src.data_plotter import DataPlotter
-from src.batch_data_generator import BatchDataGenerator
-from src.buffer_manager import BufferManager
+# Only the capture path is imported here (production hooks: 'get_buffer_manager' and 'capture_train').
+# Plotting (matplotlib), file loading and filtering (scipy) and the other running modes are imported when used.
 from src.buffer_manager_rt import BufferManagerRT
 from src.json_file_manager_rt import JsonFileManagerRT
-from src.config import get_config
-from src.logger import load_logger
+from src.stream_file_manager_rt import StreamFileManagerRT
+from src.memory_governor import MemoryGovernor
+from src.load_shedder import LoadShedder
+from src.profiler import PipelineProfiler, profile_stage, profile_iterator
+from src.config import get_config, validate_config
+from src.logger import load_logger, shutdown_logging
 
-load_dotenv()
 logger = load_logger(__name__)
-config = get_config()
+config = get_config(validate=False)  # Validated when the pipeline is built
 
 logger.info(f"ENVIRONMENT: {os.environ['ENVIRONMENT']}")
 
 if not os.environ['ENVIRONMENT'] == 'dev':
     # ----- Production Path -----
+    data_path = config['path']['data-prod']
     output_path = config['path']['output-prod']
     # ----------------------------
 else:
     # ----- Development Path -----
-    # TODO: Development environment
-    #  data_path: "..data/{project_name}/{file_extension}"
-    #  day_path: "..data/{project_name}/{file_extension}/{year}/{month}/{day}"
+    # Follow mode ('-w') expects the day-structured tree: "{data_path}/{year}/{month}/{day}/{file}"
     data_path = config['path']['data-dev']
     output_path = config['path']['output-dev']
     # ----------------------------
 
+# Append mode's file manager (keeps capture files open between batches)
+stream_file_manager = None
+
+# Pipeline profiler ('profiling' configuration, '-P' and '-T' arguments). None when profiling is disabled
+profiler = None
+
+# Production hooks' checkpoints ('checkpoint' configuration) and timestamp of the last batch processed before the
+# restored checkpoint. None when checkpoints are disabled
+checkpoint_manager = None
+resume_timestamp = None
+
 # Set Argument Parser
 parser = argparse.ArgumentParser(description="Tool to detect Trains in multiple sections and store the data.")
 parser.add_argument(
@@ -41,14 +54,59 @@ parser.add_argument(
     "-b", "--binary", action="store_true",
     help="Put's binary flag to True, in order to save data as binary format (.bin)", required=False
 )
+parser.add_argument(
+    "-a", "--append", action="store_true",
+    help="Append each ACTIVE batch to a single open file per capture, instead of saving file-chunks", required=False
+)
 parser.add_argument(
     "-f", "--files", type=int, help="Defines the number of files to be loaded"
 )
+parser.add_argument(
+    "-g", "--render", action="store_true",
+    help="Render Detected Train's Waterfall as PNG files in background (non-blocking)", required=False
+)
+parser.add_argument(
+    "-m", "--shared-memory", action="store_true",
+    help="Hand batches to a separate pipeline process through a shared-memory ring", required=False
+)
+parser.add_argument(
+    "-r", "--replay", action="store_true",
+    help="Replay files as fast as possible (no waiting-time between batches)", required=False
+)
+parser.add_argument(
+    "-w", "--follow", action="store_true",
+    help="Walk the '{year}/{month}/{day}' data tree in timestamp order and keep watching for new files",
+    required=False
+)
+parser.add_argument(
+    "-c", "--resume", action="store_true",
+    help="Resume the processing from the last checkpoint (see 'checkpoint' configuration)", required=False
+)
+parser.add_argument(
+    "-z", "--zmq", action="store_true",
+    help="Receive batches and publish chunks over ZMQ sockets (network service mode)", required=False
+)
+parser.add_argument(
+    "-M", "--multi-stream", action="store_true",
+    help="Process several streams (fibers / interrogators) in one process, sharing the worker and writer pools "
+         "(see 'multi-stream' configuration). Chunks are always saved", required=False
+)
+parser.add_argument(
+    "-P", "--profile", nargs="*", choices=PipelineProfiler.STAGES, default=None, metavar="STAGE",
+    help="Profile the pipeline's stages with cProfile (all stages if none is given). A summary report is written at "
+         "exit (see 'profiling' configuration)", required=False
+)
+parser.add_argument(
+    "-T", "--tracemalloc", type=int, default=None, metavar="N",
+    help="Take a tracemalloc snapshot every N batches, and report the top allocation sites", required=False
+)
 
 
 # TODO: Development Environment
 def main(args=None):
+    global stream_file_manager, profiler
     args = parser.parse_args(args)
+    validate_config()
 
     if args.files:
         config['batch-data-generator']['max-files'] = args.files
@@ -56,22 +114,86 @@ def main(args=None):
     if args.binary:
         config['client']['save-binary'] = True
 
-    buffer_manager_rt = BufferManagerRT(**config)
+    if args.replay:
+        config['batch-data-generator']['replay'] = True
+
+    if args.append:
+        config['client']['append-capture'] = True
+
+    if args.follow:
+        config['batch-data-generator']['follow'] = True
+
+    if args.profile is not None:
+        config['profiling']['cprofile'] = True
+        if args.profile:
+            config['profiling']['stages'] = args.profile
+
+    if args.tracemalloc:
+        config['profiling']['tracemalloc-interval'] = args.tracemalloc
+
+    if args.shared_memory:
+        run_shared_memory_producer(binary=args.binary)
+        return
+
+    if args.multi_stream:
+        run_multi_stream()
+        return
+
+    if args.zmq:
+        from src.zmq_capture_service import ZmqCaptureService
+
+        config['zmq']['save'] = args.save
+        ZmqCaptureService(output_path, **config).run()
+        return
 
-    for batch in BatchDataGenerator(data_path, **config):
+    from src.batch_data_generator import BatchDataGenerator
+    from src.checkpoint_manager import CheckpointManager
+    if args.plot:
+        from src.data_plotter import DataPlotter
+    if args.render:
+        from src.plot_renderer import PlotRenderer
+
+    memory_governor = get_memory_governor()
+    profiler = get_profiler()
+    buffer_manager_rt = BufferManagerRT(memory_governor=memory_governor, profiler=profiler, **config)
+    plot_renderer = PlotRenderer(**config) if args.render else None
+    load_shedder = get_load_shedder()
+
+    # Checkpoints
+    checkpoint_manager = CheckpointManager(**config) if config['checkpoint']['enabled'] or args.resume else None
+    resume_timestamp = None
+    if args.resume:
+        if checkpoint_manager.exists():
+            if config['client']['append-capture']:
+                stream_file_manager = StreamFileManagerRT(output_path, **config)
+            resume_timestamp = checkpoint_manager.restore(buffer_manager_rt, stream_file_manager, output_path)
+        else:
+            logger.warning("There isn't any checkpoint to resume from. Starting from the beginning.")
+
+    batch_data_generator = BatchDataGenerator(data_path, memory_governor=memory_governor,
+                                              resume_timestamp=resume_timestamp, profiler=profiler, **config)
+    for batch, initial_timestamp in profile_iterator(profiler, batch_data_generator, 'loader'):
         logger.info(f"batch.shape: {batch.shape}")
         logger.debug("BUFFER INFO :: ================================================================================")
-        for chunk in buffer_manager_rt.generate_train_capture(batch):
+        for chunk in profile_iterator(profiler, buffer_manager_rt.generate_train_capture(batch, initial_timestamp),
+                                      'buffer-manager'):
             # Debug
             logger.info(
                 f" --------> CHUNK GENERATED :: uuid: {chunk['uuid']} file-chunk: {chunk['file-chunk']}")
 
+            # Load Shedding
+            skip_plot = False
+            if load_shedder is not None:
+                chunk = load_shedder.reduce_chunk(chunk)
+                skip_plot = load_shedder.is_active('skip-plot')
+
             # Save Chunk
             if args.save:
-                JsonFileManagerRT(output_path, chunk, **config)
+                save_chunk(chunk)
+            buffer_manager_rt.release_pending_write(chunk)
 
             # Plot data
-            if args.plot:
+            if args.plot and not skip_plot:
                 section_id = chunk['section-id']
                 uuid = chunk['uuid']
                 file_chunk = chunk['file-chunk']
@@ -79,21 +201,202 @@ def main(args=None):
                 data_plotter.set_title(f"New Train: section {section_id}. Chunk num: {file_chunk}.\nchunk-id: {uuid}")
                 data_plotter.plot_matrix()
 
+            # Render data (background)
+            if args.render and not skip_plot:
+                plot_renderer.submit(chunk)
+
+        if checkpoint_manager is not None:
+            checkpoint_manager.update(buffer_manager_rt, initial_timestamp, stream_file_manager)
+
+        if load_shedder is not None:
+            load_shedder.update(batch.shape[0], initial_timestamp, buffer_manager_rt)
+            logger.debug(f"LOAD SHEDDING :: {load_shedder.get_metrics()}")
+
+        if profiler is not None:
+            profiler.update()
+
         logger.debug("===========================================================================================\n\n")
 
+    if args.render:
+        plot_renderer.close()
+
+    if stream_file_manager is not None:
+        stream_file_manager.close()
+
+    if memory_governor is not None:
+        logger.info(f"MEMORY ACCOUNTING :: {memory_governor.get_accounting()}")
+
+    if load_shedder is not None:
+        logger.info(f"LOAD SHEDDING :: {load_shedder.get_metrics()}")
+
+    if profiler is not None:
+        profiler.report()
+
+
+def save_chunk(chunk):
+    global stream_file_manager
+
+    with profile_stage(profiler, 'writer'):
+        if config['client']['append-capture']:
+            if stream_file_manager is None:
+                stream_file_manager = StreamFileManagerRT(output_path, **config)
+            stream_file_manager.write(chunk)
+        else:
+            JsonFileManagerRT(output_path, chunk, **config)
+
+
+def get_memory_governor():
+    return MemoryGovernor(**config) if config['memory-governor']['enabled'] else None
+
+
+def get_load_shedder():
+    return LoadShedder(**config) if config['load-shedding']['enabled'] else None
+
+
+def get_profiler():
+    profiling_enabled = config['profiling']['cprofile'] or config['profiling']['tracemalloc-interval']
+    return PipelineProfiler(**config) if profiling_enabled else None
+
+
+def get_checkpoint_manager(buffer_manager_rt):
+    """Checkpoints of the production hooks. The last checkpoint is restored into the buffer manager ('resume')."""
+    global stream_file_manager, resume_timestamp
+    from src.checkpoint_manager import CheckpointManager
+
+    checkpoint_manager = CheckpointManager(**config)
+    if config['checkpoint']['resume'] and checkpoint_manager.exists():
+        if config['client']['append-capture'] and stream_file_manager is None:
+            stream_file_manager = StreamFileManagerRT(output_path, **config)
+        resume_timestamp = checkpoint_manager.restore(buffer_manager_rt, stream_file_manager, output_path)
+    return checkpoint_manager
+
 
 # TODO: Production Environment.
 def get_buffer_manager():
-    buffer_manager_rt = BufferManagerRT(**config)
+    global profiler, checkpoint_manager
+    validate_config()
+    profiler = get_profiler() if profiler is None else profiler
+    buffer_manager_rt = BufferManagerRT(memory_governor=get_memory_governor(), profiler=profiler, **config)
+    if config['checkpoint']['enabled']:
+        checkpoint_manager = get_checkpoint_manager(buffer_manager_rt)
     return buffer_manager_rt
 
 
-def capture_train(batch, buffer_manager_rt, binary=True):
+def capture_train(batch, buffer_manager_rt, binary=True, initial_timestamp=None, load_shedder=None):
     if binary:
         config['client']['save-binary'] = True
 
-    for chunk in buffer_manager_rt.generate_train_capture(batch):
-        JsonFileManagerRT(output_path, chunk, **config)
+    if None not in (initial_timestamp, resume_timestamp) and initial_timestamp <= resume_timestamp:
+        logger.debug(f"Skipping batch processed before the checkpoint (initial_timestamp: {initial_timestamp})")
+        return
+
+    for chunk in profile_iterator(profiler, buffer_manager_rt.generate_train_capture(batch, initial_timestamp),
+                                  'buffer-manager'):
+        if load_shedder is not None:
+            chunk = load_shedder.reduce_chunk(chunk)
+        save_chunk(chunk)
+        buffer_manager_rt.release_pending_write(chunk)
+
+    if checkpoint_manager is not None:
+        checkpoint_manager.update(buffer_manager_rt, initial_timestamp, stream_file_manager)
+
+    if load_shedder is not None and initial_timestamp is not None:
+        load_shedder.update(batch.shape[0], initial_timestamp, buffer_manager_rt)
+
+    if profiler is not None:
+        profiler.update()
+
+
+# Shared-memory ingestion
+def start_shared_memory_pipeline(slot_shape, binary=True):
+    """
+    Acquisition side: Creates a shared-memory ring of batch slots and starts the pipeline process which consumes
+    it. Batches are handed with 'ring.put(batch, initial_timestamp)'.
+    :param slot_shape: Maximum batch shape (temporal, spatial samples)
+    :return: ring and pipeline process (to be stopped with 'stop_shared_memory_pipeline')
+    """
+    from src.shared_batch_ring import SharedBatchRing
+
+    ring = SharedBatchRing(slot_shape, config['shared-memory']['slots'])
+    # The configuration (with the CLI's and host's changes) is handed to the process: with the 'spawn' start method
+    # (Windows), it re-imports this module and would get the default configuration
+    process = multiprocessing.Process(target=shared_memory_pipeline,
+                                      args=(ring.get_handle(), binary, copy.deepcopy(config)),
+                                      name="shared-memory-pipeline")
+    process.start()
+    return ring, process
+
+
+def stop_shared_memory_pipeline(ring, process):
+    ring.close_producer()
+    process.join()
+    ring.close()
+
+
+def shared_memory_pipeline(ring_handle, binary=True, pipeline_config=None):
+    """Pipeline process: Consumes batches from the shared-memory ring. Detection runs on the slot (zero-copy), and
+    only the sections' data is copied into the buffers before the slot is released.
+    :param pipeline_config: Configuration of the acquisition side, applied to this process' configuration
+    """
+    from src.shared_batch_ring import SharedBatchRing
+
+    if pipeline_config is not None:
+        config.clear()
+        config.update(pipeline_config)
+
+    ring = SharedBatchRing.attach(ring_handle)
+    config['params']['copy-section-batches'] = True
+    buffer_manager_rt = get_buffer_manager()
+    load_shedder = get_load_shedder()
+
+    while True:
+        item = ring.get()
+        if item is None:
+            break
+
+        slot, batch, initial_timestamp = item
+        capture_train(batch, buffer_manager_rt, binary, initial_timestamp, load_shedder)
+        del item, batch  # Views of the slot must not be referenced once released
+        ring.release(slot)
+
+    if stream_file_manager is not None:
+        stream_file_manager.close()
+    ring.close()
+
+    # Exit handlers are not run by 'multiprocessing' children
+    if profiler is not None:
+        profiler.report()
+    shutdown_logging()
+
+
+def run_shared_memory_producer(binary=True):
+    """Local stand-in of the acquisition process: Feeds the files' batches to the shared-memory pipeline."""
+    from src.batch_data_generator import BatchDataGenerator
+
+    config['batch-data-generator']['fixed-batch-shape'] = True  # Constant batch shape for the ring's slots
+    ring, process = None, None
+
+    for batch, initial_timestamp in BatchDataGenerator(data_path, **config):
+        if ring is None:
+            ring, process = start_shared_memory_pipeline(batch.shape, binary)
+        ring.put(batch, initial_timestamp)
+
+    if ring is not None:
+        stop_shared_memory_pipeline(ring, process)
+
+
+# Multi-stream mode
+def run_multi_stream():
+    """Loads each stream's files from its 'data-path' (the environment's data path if None) in its own thread, and
+    processes the streams with a shared 'MultiStreamPipeline'. Output: '{output_path}/{stream-id}'.
+    """
+    from src.batch_data_generator import BatchDataGenerator
+    from src.multi_stream_pipeline import MultiStreamPipeline
+
+    multi_stream_pipeline = MultiStreamPipeline(output_path, **config)
+    sources = {stream_id: BatchDataGenerator(stream['data-path'] or data_path, **config) for stream_id, stream in
+               config['multi-stream']['streams'].items()}
+    return multi_stream_pipeline.run(sources)
 
 
 if __name__ == "__main__":
@@ -1,39 +1,59 @@
 import os
+import re
 import json
 import base64
 import numpy as np
 import struct
 
-from dotenv import load_dotenv
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from src.logger import load_logger
 from src.config import get_config
 from src.data_plotter import DataPlotter
+from src.preview_pyramid import PreviewPyramid
+from src.decode_cache import DecodeCache
 
-load_dotenv()
 logger = load_logger(__name__)
 config = get_config()
 
+# Decoded file-chunks shared by all the OutputDataLoader instances of the process
+decode_cache = DecodeCache(**config)
+
 
 class OutputDataLoader:
     def __init__(self, **kwargs):
+        """
+        Loads the captures stored in 'output_path'.
+        If 'datetime_obj' is given, all the file-chunks of the captures of 'section_id' which started at that second
+        are loaded into 'full_matrix' (and plotted, unless 'plot' is False).
+        Otherwise, nothing is loaded, and windows of data can be queried with 'read'.
+        """
         self.output_path = kwargs['output_path']
-        self.datetime_obj = kwargs['datetime_obj']
-        self.section_id = kwargs['section_id']
-        self.extension = kwargs['extension']
+        self.datetime_obj = kwargs.get('datetime_obj')
+        self.section_id = kwargs.get('section_id')
+        self.extension = kwargs.get('extension', '.bin')
+        self.preview_size = kwargs.get('preview_size')  # Display size (width, height) [pixels] for preview mode
+        self.plot = kwargs.get('plot', True)
         self.config = config
 
-        self.datetime_str = datetime.strftime(self.datetime_obj, "%Y/%m/%d %H:%M:%S")
+        # Signal
+        self.dt = config['signal']['N'] * (1 / config['signal']['fs'])  # Time [s]
+        self.lookback_time = config['params']['total-time-max-limit']  # Maximum duration of a capture [s]
+
+        self.datetime_str = datetime.strftime(self.datetime_obj, "%Y/%m/%d %H:%M:%S") if self.datetime_obj else None
         self.items = {}
         self.output_day_path = None
         self.filenames = []
         self.npy_data_list = []
         self.full_matrix = None
+        self.preview_level = None
 
-        self.load_data()
-        self.get_full_matrix()
-        self.plot_matrix()
+        if self.datetime_obj is not None:
+            self.load_data()
+            self.get_full_matrix()
+
+            if self.plot:
+                self.plot_matrix()
 
     def get_output_day_path(self):
         output_day_path = os.path.join(self.output_path, str(self.datetime_obj.year),
@@ -51,6 +71,7 @@ class OutputDataLoader:
                      and f"{self.datetime_obj.minute:02d}" in filename
                      and f"{self.datetime_obj.second:02d}" in filename
                      and self.extension in filename]
+        filenames.sort()
         logger.info(f"filenames: {filenames}")
         return filenames
 
@@ -64,17 +85,15 @@ class OutputDataLoader:
 
     @staticmethod
     def base64_string_to_matrix(my_bytearray_base64_encoded_string, num_rows, num_cols):
-
-        float_encoding = 'e'
         my_bytearray_reconstructed = base64.b64decode(my_bytearray_base64_encoded_string.encode('ascii'))
+        my_array = np.frombuffer(my_bytearray_reconstructed, dtype='<f2', count=num_rows * num_cols).astype(float)
+        return my_array.reshape((num_rows, num_cols))
 
-        my_value_reconstructed = struct.unpack("<%d%s" % (num_rows * num_cols, float_encoding),
-                                               my_bytearray_reconstructed)
-
-        my_array = np.array(my_value_reconstructed, dtype=float)
-        my_matrix = my_array.reshape((num_rows, num_cols))
-
-        return my_matrix
+    def decode_json(self, fullpath):
+        json_data = self.deserialize_json(fullpath)
+        num_rows = json_data['info'].get('temporal_samples')
+        num_cols = json_data['info'].get('spatial_samples')
+        return self.base64_string_to_matrix(json_data.get('strain'), num_rows, num_cols)
 
     @staticmethod
     def deserialize_binary(fullpath):
@@ -84,30 +103,71 @@ class OutputDataLoader:
             npy_data = np.load(f)
             return json_dict, npy_data
 
+    @staticmethod
+    def get_hdf5_captures(fullpath):
+        """Returns the header attributes of each capture stored in an HDF5 container, by uuid."""
+        import h5py
+
+        with h5py.File(fullpath, "r") as file:
+            return {uuid: dict(group.attrs) for uuid, group in file.items()}
+
+    @staticmethod
+    def read_hdf5_window(fullpath, uuid, rows=slice(None), channels=slice(None)):
+        """Reads a window (rows: temporal samples, channels: spatial samples) of a capture stored in an HDF5
+        container. Only the HDF5 chunks which overlap the window are read from disk.
+        """
+        import h5py
+
+        with h5py.File(fullpath, "r") as file:
+            return file[uuid]["strain"][rows, channels].astype(float)
+
+    def load_hdf5_data(self):
+        fullpath = os.path.join(self.output_day_path, f"{self.section_id}.h5")
+        if not os.path.exists(fullpath):
+            raise ValueError(f'File "{fullpath}" does not exist. Exiting...')
+
+        captures = self.get_hdf5_captures(fullpath)
+        self.filenames = [uuid for uuid, info in captures.items()
+                          if datetime.fromtimestamp(info['initial_timestamp']).replace(microsecond=0)
+                          == self.datetime_obj]
+
+        assert not len(self.filenames) == 0, \
+            f"Captures not found in section {self.section_id} for the given date {self.datetime_str}"
+
+        for uuid in self.filenames:
+            logger.info(f"reading HDF5 capture {uuid}...")
+            self.items = {'info': captures[uuid]}
+            self.npy_data_list.append(self.read_hdf5_window(fullpath, uuid))
+            logger.info(f"Capture {uuid} 'info': {self.items['info']}")
+
     def load_data(self):
         self.output_day_path = self.get_output_day_path()
+
+        if self.extension == '.h5':
+            self.load_hdf5_data()
+            return
+
         self.filenames = self.get_filenames()
 
         assert not len(self.filenames) == 0, \
             f"Files not found in section {self.section_id} for the given date {self.datetime_str}"
 
+        if self.preview_size is not None and self.load_previews():
+            return
+
         for filename in self.filenames:
             fullpath = os.path.join(self.output_day_path, filename)
             if self.extension == '.bin':
-                # do something
                 logger.info(f"deserializing binary data...")
-                self.items, npy_data = self.deserialize_binary(fullpath)
+                self.items = self.read_binary_header(fullpath)[0]
+                npy_data = decode_cache.get(fullpath, lambda: self.deserialize_binary(fullpath)[1])
                 self.npy_data_list.append(npy_data)
                 logger.info(f"File {filename} 'info': {self.items['info']}")
 
             elif self.extension == '.json':
-                # do something
                 logger.info(f"deserializing JSON data...")
-                self.items = self.deserialize_json(fullpath)
-                num_rows = self.items['info'].get('temporal_samples')
-                num_cols = self.items['info'].get('spatial_samples')
-                strain_data = self.items.get('strain')
-                npy_data = self.base64_string_to_matrix(strain_data, num_rows, num_cols)
+                self.items = self.read_json_header(fullpath)[0]
+                npy_data = decode_cache.get(fullpath, lambda: self.decode_json(fullpath))
                 self.npy_data_list.append(npy_data)
                 logger.info(f"File {filename} 'info': {self.items['info']}")
 
@@ -115,30 +175,275 @@ class OutputDataLoader:
                 logger.warning(
                     f"file extension '{self.extension}' is not implemented. It should have '.' at the beginning.")
 
+    def load_previews(self):
+        """Preview mode: Load only the preview level needed for 'preview_size'.
+        Returns False if any preview file is missing or the full resolution data is needed.
+        """
+        preview_fullpaths = [os.path.join(self.output_day_path, f"{os.path.splitext(filename)[0]}_preview.npz")
+                             for filename in self.filenames]
+
+        if not all([os.path.exists(fullpath) for fullpath in preview_fullpaths]):
+            logger.warning("Preview files not found. Loading full resolution data...")
+            return False
+
+        self.preview_level = PreviewPyramid.select_level(preview_fullpaths, self.preview_size)
+        if self.preview_level is None:
+            logger.info("Display size is higher than any preview. Loading full resolution data...")
+            return False
+
+        logger.info(f"Loading previews at level 1/{self.preview_level}...")
+        self.npy_data_list = [
+            decode_cache.get(fullpath, lambda: PreviewPyramid.load_level(fullpath, self.preview_level),
+                             variant=f"level_{self.preview_level}")
+            for fullpath in preview_fullpaths]
+        return True
+
+    @staticmethod
+    def get_cache_stats():
+        """Hit/miss statistics of the decoded file-chunks' cache."""
+        return decode_cache.get_stats()
+
     def get_full_matrix(self):
+        self.full_matrix = np.concatenate(self.npy_data_list, axis=0)
 
-        total_number_rows = 0
-        for i, element in enumerate(self.npy_data_list[:-1]):
-            total_number_rows += element.shape[0]
+    # WINDOWED READS
+    @staticmethod
+    def read_binary_header(fullpath):
+        """Reads the JSON header and the npy header of a binary file, without reading the strain data.
+        :return: JSON header, data shape, data type and file offset of the data
+        """
+        with open(fullpath, 'rb') as f:
+            header_len = struct.unpack('<H', f.read(2))[0]
+            json_dict = json.loads(f.read(header_len).decode('ascii'))
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+            return json_dict, shape, dtype, f.tell()
 
-        self.full_matrix = np.reshape(self.npy_data_list[:-1], (
-            total_number_rows, self.npy_data_list[0].shape[1]))
+    @staticmethod
+    def read_json_header(fullpath, read_size=pow(2, 16)):
+        """Reads the "info" header of a JSON file, without reading the base64 strain data ("info" key is written
+        before "strain" key).
+        :return: JSON header (without "strain") and the file offset of the base64 strain string
+        """
+        # Read in binary mode: the match's position is the byte offset used by 'read_json_rows' (text mode would
+        # translate the line endings, e.g. CRLF)
+        data = b""
+        with open(fullpath, "rb") as reader:
+            while True:
+                block = reader.read(read_size)
+                data += block
+                strain_match = re.search(rb'"strain"\s*:\s*"', data)
+                if strain_match:
+                    break
+                if not block:
+                    raise ValueError(f'"strain" key not found in file "{fullpath}"')
 
-        self.full_matrix = np.concatenate((self.full_matrix, self.npy_data_list[-1:][0]), axis=0)
+        json_dict = json.loads(data[:strain_match.start()].decode('ascii').rstrip().rstrip(',') + "}")
+        return json_dict, strain_match.end()
+
+    @staticmethod
+    def read_json_rows(fullpath, data_offset, shape, rows, channels):
+        """Decodes only the base64 characters which contain the given rows of the strain matrix."""
+        row_size = 2 * shape[1]  # float16
+        start_byte, end_byte = rows.start * row_size, rows.stop * row_size
+
+        # Base64 encodes groups of 3 bytes in 4 characters
+        start_group, end_group = start_byte // 3, -(-end_byte // 3)
+        with open(fullpath, "rb") as reader:
+            reader.seek(data_offset + 4 * start_group)
+            decoded_bytes = base64.b64decode(reader.read(4 * (end_group - start_group)))
+
+        decoded_offset = start_byte - 3 * start_group
+        matrix = np.frombuffer(decoded_bytes[decoded_offset: decoded_offset + end_byte - start_byte], dtype='<f2')
+        return matrix.reshape((rows.stop - rows.start, shape[1]))[:, channels]
+
+    def get_section_parts(self, section_id, extension, t0, t1):
+        """
+        Get the file-chunks (parts) of a section's captures which started between 't0 - lookback_time' and 't1'.
+        Each part is a dictionary with its fullpath, "info" header, timestamp of its first row and the data needed
+        to read its rows.
+        """
+        parts = []
+        filename_pattern = re.compile(r"^(\d{2})_(\d{2})_(\d{2})_" + re.escape(section_id) + r"_part_\d{2}" +
+                                      re.escape(extension) + "$")
+
+        first_day = datetime.fromtimestamp(t0 - self.lookback_time).replace(hour=0, minute=0, second=0, microsecond=0)
+        days = [first_day + timedelta(days=i) for i in range((datetime.fromtimestamp(t1) - first_day).days + 1)]
+
+        for day in days:
+            output_day_path = os.path.join(self.output_path, str(day.year), f"{day.month:02d}", f"{day.day:02d}")
+            if not os.path.isdir(output_day_path):
+                continue
+
+            if extension == '.h5':
+                fullpath = os.path.join(output_day_path, f"{section_id}.h5")
+                if os.path.exists(fullpath):
+                    parts += self.get_hdf5_parts(fullpath)
+                continue
+
+            for filename in sorted(os.listdir(output_day_path)):
+                filename_match = filename_pattern.match(filename)
+                if not filename_match:
+                    continue
+
+                # Discard captures by the filename's initial time, before reading any header
+                hour, minute, second = [int(value) for value in filename_match.groups()]
+                capture_start = day.replace(hour=hour, minute=minute, second=second).timestamp()
+                if not (t0 - self.lookback_time <= capture_start <= t1):
+                    continue
+
+                fullpath = os.path.join(output_day_path, filename)
+                if extension == '.bin':
+                    json_dict, shape, dtype, data_offset = self.read_binary_header(fullpath)
+                else:
+                    json_dict, data_offset = self.read_json_header(fullpath)
+                    shape, dtype = (json_dict['info']['temporal_samples'], json_dict['info']['spatial_samples']), '<f2'
+
+                parts.append({
+                    "fullpath": fullpath,
+                    "info": json_dict['info'],
+                    "start-timestamp": json_dict['info']['initial_timestamp'] +
+                    json_dict['info'].get('sample_offset', 0) * self.dt,
+                    "shape": tuple(shape),
+                    "dtype": dtype,
+                    "data-offset": data_offset
+                })
+
+        return parts
+
+    def get_hdf5_parts(self, fullpath):
+        import h5py
+
+        parts = []
+        with h5py.File(fullpath, "r") as file:
+            for uuid, group in file.items():
+                info = dict(group.attrs)
+                if isinstance(info.get('statistics'), str):  # Stored as a JSON string
+                    info['statistics'] = json.loads(info['statistics'])
+                for file_chunk, first_row, temporal_samples, sample_offset in group["parts"][:]:
+                    parts.append({
+                        "fullpath": fullpath,
+                        "info": dict(info, file_chunk=int(file_chunk), temporal_samples=int(temporal_samples),
+                                     sample_offset=int(sample_offset)),
+                        "start-timestamp": info['initial_timestamp'] + sample_offset * self.dt,
+                        "shape": (int(temporal_samples), int(info['spatial_samples'])),
+                        "dtype": '<f2',
+                        "data-offset": int(first_row)
+                    })
+        return parts
+
+    def read_part_rows(self, part, rows, channels):
+        """Reads only the given rows and channels of a part, seeking into its payload."""
+        extension = os.path.splitext(part['fullpath'])[1]
+
+        if extension == '.bin':
+            matrix = np.memmap(part['fullpath'], dtype=part['dtype'], mode='r', offset=part['data-offset'],
+                               shape=part['shape'])
+            return np.array(matrix[rows, channels])
+
+        if extension == '.h5':
+            rows = slice(part['data-offset'] + rows.start, part['data-offset'] + rows.stop)
+            return self.read_hdf5_window(part['fullpath'], part['info']['uuid'], rows, channels)
+
+        return self.read_json_rows(part['fullpath'], part['data-offset'], part['shape'], rows, channels)
+
+    def read(self, section_id, t0, t1, channels=slice(None), extension=None):
+        """
+        Reads the strain data of a section between two timestamps, across capture parts.
+        :param section_id: Section ID
+        :param t0: Initial time (timestamp [s] or datetime)
+        :param t1: End time (timestamp [s] or datetime)
+        :param channels: slice of spatial samples (columns)
+        :param extension: Files' extension ('.bin', '.json' or '.h5'). Defaults to the loader's extension
+        :return: Matrix (temporal samples, spatial samples) of the window. Samples without data are NaN.
+        """
+        t0 = t0.timestamp() if isinstance(t0, datetime) else t0
+        t1 = t1.timestamp() if isinstance(t1, datetime) else t1
+        extension = self.extension if extension is None else extension
+
+        # Parts which overlap the window
+        parts = [part for part in self.get_section_parts(section_id, extension, t0, t1)
+                 if part['start-timestamp'] < t1 and part['start-timestamp'] + part['shape'][0] * self.dt > t0]
+
+        if not parts:
+            raise ValueError(f"Data not found in section {section_id} between {datetime.fromtimestamp(t0)} and "
+                             f"{datetime.fromtimestamp(t1)}")
+
+        temporal_samples = int(round((t1 - t0) / self.dt))
+        spatial_samples = len(range(*channels.indices(parts[0]['shape'][1])))
+        window = np.full((temporal_samples, spatial_samples), np.nan)
+
+        for part in parts:
+            part_first_row = int(round((part['start-timestamp'] - t0) / self.dt))  # Row of the window
+            start_row = max(0, -part_first_row)
+            end_row = min(part['shape'][0], temporal_samples - part_first_row)
+            if end_row <= start_row:
+                continue
+
+            logger.debug(f"Reading rows ({start_row}, {end_row}) of {part['fullpath']}")
+            window[part_first_row + start_row: part_first_row + end_row, :] = \
+                self.read_part_rows(part, slice(start_row, end_row), channels)
+
+        return window
+
+    # CAPTURE STATISTICS
+    def get_capture_statistics(self, section_id, t0, t1, extension=None):
+        """
+        Statistics of a section's captures which overlap the time window, read from the parts' headers only (the
+        strain data is neither read nor decoded). The last part's header contains the whole capture's statistics.
+        :param section_id: Section ID
+        :param t0: Initial time (timestamp [s] or datetime)
+        :param t1: End time (timestamp [s] or datetime)
+        :param extension: Files' extension ('.bin', '.json' or '.h5'). Defaults to the loader's extension
+        :return: List of captures (by start time). Each capture is a dictionary with its "uuid", "start-timestamp",
+        "end-timestamp", number of "parts" and "statistics" (None if it was stored without statistics)
+        """
+        t0 = t0.timestamp() if isinstance(t0, datetime) else t0
+        t1 = t1.timestamp() if isinstance(t1, datetime) else t1
+        extension = self.extension if extension is None else extension
+
+        captures = {}
+        last_file_chunks = {}
+        for part in self.get_section_parts(section_id, extension, t0, t1):
+            uuid = part['info']['uuid']
+            end_timestamp = part['start-timestamp'] + part['shape'][0] * self.dt
+            capture = captures.setdefault(uuid, {"uuid": uuid, "start-timestamp": part['start-timestamp'],
+                                                 "end-timestamp": end_timestamp, "parts": 0, "statistics": None})
+            capture['start-timestamp'] = min(capture['start-timestamp'], part['start-timestamp'])
+            capture['end-timestamp'] = max(capture['end-timestamp'], end_timestamp)
+            capture['parts'] += 1
+
+            if part['info']['file_chunk'] >= last_file_chunks.get(uuid, -1):
+                last_file_chunks[uuid] = part['info']['file_chunk']
+                capture['statistics'] = part['info'].get('statistics')
+
+        return sorted([capture for capture in captures.values()
+                       if capture['start-timestamp'] < t1 and capture['end-timestamp'] > t0],
+                      key=lambda capture: capture['start-timestamp'])
 
     def plot_matrix(self):
         data_plotter = DataPlotter(self.full_matrix, **self.config['plot-matrix'])
-        data_plotter.set_title(f"Loaded files: {self.filenames}")
+        data_plotter.set_title(f"Loaded files: {self.filenames}" if self.preview_level is None
+                               else f"Loaded previews (1/{self.preview_level}): {self.filenames}")
         data_plotter.plot_matrix()
 
 
 if __name__ == "__main__":
     kwargs = dict(
         output_path="./test/output",
-        # datetime_obj=datetime(2024, 8, 22, 9, 32, 54),  # .bin
+        # datetime_obj=datetime(2024, 8, 22, 9, 32, 54),  # .bin or .h5
         datetime_obj=datetime(2024, 9, 24, 13, 56, 23),  # .json
         section_id="S03",
-        extension=".bin"
+        extension=".bin",
+        # preview_size=(1920, 983),  # Preview mode
     )
 
     OutputDataLoader(**kwargs)
+
+    # Windowed read (e.g. 5 seconds of the first 100 channels):
+    # output_data_loader = OutputDataLoader(output_path="./test/output", extension=".bin")
+    # window = output_data_loader.read("S03", datetime(2024, 8, 22, 9, 33, 0), datetime(2024, 8, 22, 9, 33, 5),
+    #                                  channels=slice(0, 100))
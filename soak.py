@@ -0,0 +1,249 @@
+import os
+import gc
+import sys
+import copy
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime
+
+# Production path: 'prod-batch-shape' batches (set before the pipeline's modules are imported)
+os.environ['ENVIRONMENT'] = 'prod'
+os.environ.setdefault('LEVEL', 'info')
+
+import numpy as np
+
+from src.buffer_manager_rt import BufferManagerRT
+from src.json_file_manager_rt import JsonFileManagerRT
+from src.stream_file_manager_rt import StreamFileManagerRT
+from src.config import get_config
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+parser = argparse.ArgumentParser(description="Soak test: Drives 'BufferManagerRT' and the file writers with a "
+                                             "synthetic DAS stream for hours of simulated time, sampling the process' "
+                                             "memory, and fails when it trends upward.")
+parser.add_argument(
+    "-H", "--hours", type=float, default=4, help="Simulated time [h] (default: 4)"
+)
+parser.add_argument(
+    "-s", "--sections", type=int, default=10, help="Number of sections (default: 10)"
+)
+parser.add_argument(
+    "-i", "--train-interval", type=float, default=300,
+    help="Mean time [s] between trains in each section (simulated time, default: 300)"
+)
+parser.add_argument(
+    "-d", "--train-duration", type=float, default=20, help="Time [s] of each train in a section (default: 20)"
+)
+parser.add_argument(
+    "-w", "--writer", choices=["json", "binary", "append", "none"], default="binary",
+    help="Writer of the generated chunks (default: 'binary')"
+)
+parser.add_argument(
+    "-n", "--samples", type=int, default=40, help="Number of memory samples (default: 40)"
+)
+parser.add_argument(
+    "-t", "--tolerance", type=float, default=10,
+    help="Maximum memory growth [MB per simulated hour] after the warm-up (default: 10)"
+)
+parser.add_argument(
+    "-u", "--warm-up", type=float, default=0.25,
+    help="Fraction of the simulated time excluded from the trend (buffers filling, first captures; default: 0.25)"
+)
+parser.add_argument(
+    "-c", "--copy-section-batches", action="store_true",
+    help="Buffer a copy of each section's data (instead of views of the whole batch)"
+)
+parser.add_argument(
+    "--no-tracemalloc", action="store_true", help="Only sample the resident memory (RSS), without tracemalloc"
+)
+parser.add_argument(
+    "--keep-output", action="store_true", help="Keep the written files (removed while running by default)"
+)
+parser.add_argument(
+    "--seed", type=int, default=0, help="Random seed of the synthetic stream"
+)
+
+
+def get_rss():
+    """Resident memory [Bytes] of the process (psutil, or '/proc' when it is not installed). None if not available."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def get_soak_config(args, output_path):
+    """Configuration of the soak test: 'sections' adjacent sections (within the sections' index limit)."""
+    config = copy.deepcopy(get_config(validate=False))
+    section_width = (config['params']['section-index-limit'] - 1) // args.sections
+    config['section-map'] = {f"S{i + 1:02d}": (i * section_width, (i + 1) * section_width)
+                             for i in range(args.sections)}
+    config['params']['copy-section-batches'] = args.copy_section_batches
+    config['client']['save-binary'] = args.writer != "json"
+    config['client']['append-capture'] = args.writer == "append"
+
+    # File size of 12 batches of each section (the buffer manager's lower limit is 4)
+    batch_shape = config['params']['prod-batch-shape']
+    section_batch_mb = config['params']['bytes-pixel-ratio'] * batch_shape[0] * section_width / pow(2, 20)
+    config['client']['file-size-mb-list'] = [12 * section_batch_mb] * args.sections
+    config['path']['output-prod'] = output_path
+    return config
+
+
+class SyntheticStream:
+    def __init__(self, args, **config):
+        """
+        Noise batches of 'prod-batch-shape' (a new array per batch, as acquired batches), where each section has a
+        train every 'train-interval' seconds on average (random start times), of 'train-duration' seconds.
+        Amplitudes are set relative to the train detector's threshold.
+        """
+        self.section_map = config['section-map']
+        self.batch_shape = config['params']['prod-batch-shape']
+        self.dt = config['signal']['N'] * (1 / config['signal']['fs'])  # Time [s]
+        self.batch_time = self.batch_shape[0] * self.dt  # Time [s]
+        self.train_interval = args.train_interval  # Time [s]
+        self.train_duration = args.train_duration  # Time [s]
+        self.rng = np.random.default_rng(args.seed)
+
+        threshold = config['train-detector']['detection-threshold']
+        self.noise_pool = [self.rng.normal(scale=threshold / 4, size=self.batch_shape) for _ in range(2)]
+        self.train_gain = 8  # Train's RMS is twice the detection threshold
+
+        self.timestamp = datetime(2024, 1, 1).timestamp()
+        self.next_trains = {section_id: self.timestamp + self.rng.uniform(0, self.train_interval)
+                            for section_id in self.section_map}
+        self.batches = 0
+
+    def __iter__(self):
+        while True:
+            batch = self.noise_pool[self.batches % len(self.noise_pool)].copy()
+            batch_end = self.timestamp + self.batch_time
+            for section_id, (start, end) in self.section_map.items():
+                train_start = self.next_trains[section_id]
+                train_end = train_start + self.train_duration
+                if train_start < batch_end and train_end > self.timestamp:
+                    first_row = max(0, int((train_start - self.timestamp) / self.dt))
+                    last_row = min(self.batch_shape[0], int((train_end - self.timestamp) / self.dt))
+                    batch[first_row:last_row, start:end] *= self.train_gain
+                if train_end <= batch_end:
+                    self.next_trains[section_id] = train_end + self.rng.exponential(self.train_interval)
+
+            yield batch, self.timestamp
+            self.timestamp = batch_end
+            self.batches += 1
+
+
+def purge_output(output_path):
+    for entry in os.scandir(output_path):
+        if entry.is_dir():
+            shutil.rmtree(entry.path, ignore_errors=True)
+        else:
+            os.remove(entry.path)
+
+
+def get_trend(hours, values):
+    """Median of the slopes between every pair of samples [Bytes per hour] (Theil-Sen). Unlike a least-squares
+    line, isolated jumps (e.g. the allocator's arenas, or captures in progress when sampled) do not dominate it.
+    """
+    hours, values = np.asarray(hours, dtype=float), np.asarray(values, dtype=float)
+    i, j = np.triu_indices(len(values), k=1)
+    valid = hours[j] > hours[i]
+    if not np.any(valid):
+        return 0.0
+    return float(np.median((values[j] - values[i])[valid] / (hours[j] - hours[i])[valid]))
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    output_path = tempfile.mkdtemp(prefix="soak_")
+    config = get_soak_config(args, output_path)
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+
+    buffer_manager_rt = BufferManagerRT(**config)
+    stream = SyntheticStream(args, **config)
+    stream_file_manager = StreamFileManagerRT(output_path, **config) if args.writer == "append" else None
+
+    total_batches = int(args.hours * 3600 / stream.batch_time)
+    sample_interval = max(1, total_batches // args.samples)
+    warm_up_batches = int(args.warm_up * total_batches)
+    logger.info(f"SOAK TEST :: {args.hours} h ({total_batches} batches of {stream.batch_shape}), "
+                f"{args.sections} sections, '{args.writer}' writer. Output path: '{output_path}'")
+
+    samples = []  # (simulated hours, rss, traced bytes)
+    warm_up_snapshot = None
+    chunks = 0
+    started = time.perf_counter()
+
+    for batch, initial_timestamp in stream:
+        for chunk in buffer_manager_rt.generate_train_capture(batch, initial_timestamp):
+            chunks += 1
+            if args.writer == "append":
+                stream_file_manager.write(chunk)
+            elif args.writer != "none":
+                JsonFileManagerRT(output_path, chunk, **config)
+        del batch
+
+        batches = stream.batches + 1
+        if batches % sample_interval == 0 or batches == total_batches:
+            if not args.keep_output and stream_file_manager is None:
+                purge_output(output_path)
+            gc.collect()
+            hours = batches * stream.batch_time / 3600
+            traced_bytes = tracemalloc.get_traced_memory()[0] if not args.no_tracemalloc else None
+            samples.append((hours, get_rss(), traced_bytes))
+            if batches >= warm_up_batches and warm_up_snapshot is None and not args.no_tracemalloc:
+                warm_up_snapshot = tracemalloc.take_snapshot()
+            logger.info(f"SOAK TEST :: {round(hours, 2)} h simulated ({round(time.perf_counter() - started, 1)} s). "
+                        f"RSS: {samples[-1][1]} Bytes. Traced: {traced_bytes} Bytes. Chunks: {chunks}")
+
+        if batches == total_batches:
+            break
+
+    if stream_file_manager is not None:
+        stream_file_manager.close()
+
+    # Trends after the warm-up
+    failures = []
+    measured_samples = [sample for sample in samples if sample[0] >= args.warm_up * args.hours]
+    hours = [sample[0] for sample in measured_samples]
+    for name, index in (("RSS", 1), ("Traced memory", 2)):
+        values = [sample[index] for sample in measured_samples]
+        if not values or values[0] is None:
+            continue
+        trend = get_trend(hours, values) / pow(2, 20)  # MB per hour
+        print(f"{name}: {round(values[0] / pow(2, 20), 1)} -> {round(values[-1] / pow(2, 20), 1)} MB. "
+              f"Trend: {round(trend, 3)} MB/h (tolerance: {args.tolerance} MB/h)")
+        if trend > args.tolerance:
+            failures.append(f"{name} grows {round(trend, 3)} MB per simulated hour")
+
+    if failures and warm_up_snapshot is not None:
+        print("Top allocation sites' growth since the warm-up:")
+        for statistic in tracemalloc.take_snapshot().compare_to(warm_up_snapshot, 'lineno')[:10]:
+            print(f"  {statistic}")
+
+    if not args.keep_output:
+        shutil.rmtree(output_path, ignore_errors=True)
+
+    print(f"{chunks} chunks generated in {round(time.perf_counter() - started, 1)} s "
+          f"({args.hours} h of simulated time)")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,43 @@
 import os
 import numpy as np
 import time
-from dotenv import load_dotenv
+from datetime import datetime
 
 from src.data_loader import DataLoader
+from src.batch_rebatcher import BatchRebatcher
 from src.signal_processor import SignalProcessor
+from src.profiler import profile_stage
 from src.logger import load_logger
 
-load_dotenv()
 logger = load_logger(__name__)
 
 
 class BatchDataGenerator:
-    def __init__(self, data_path, **config):
+    def __init__(self, data_path, memory_governor=None, resume_timestamp=None, profiler=None, **config):
+        """
+        :param memory_governor: Optional 'MemoryGovernor' which accounts the loaded file's data not yielded yet as
+        prefetched
+        :param resume_timestamp: Batches whose initial timestamp is not later than it (already processed before a
+        checkpoint) are skipped without waiting. Files which ended before it are skipped without being loaded
+        :param profiler: Optional 'PipelineProfiler' which profiles the filter stage
+        """
         self.data_path = data_path
         self.config = config
+        self.memory_governor = memory_governor
+        self.profiler = profiler
+        self.resume_timestamp = resume_timestamp
         self.max_files = config['batch-data-generator']['max-files']
         self.batch_waiting_time = config['batch-data-generator']['waiting-time']
+        self.replay = config['batch-data-generator']['replay']
+        self.filename_timestamp_format = config['batch-data-generator']['filename-timestamp-format']
+
+        # Follow mode (day-structured tree: '{data_path}/{year}/{month}/{day}/{file}')
+        self.follow = config['batch-data-generator']['follow']
+        self.poll_interval = config['batch-data-generator']['poll-interval']  # Time [s]
+        self.settle_time = config['batch-data-generator']['settle-time']  # Time [s]
+        self.stopped = False
 
-        self.filenames = [filename for filename in os.listdir(data_path)]
+        self.filenames = [] if self.follow else self.get_sorted_filenames()
         self.temporal_len = 0
         self.spatial_len = 0
 
@@ -28,19 +47,218 @@ class BatchDataGenerator:
 
         self.batch_temporal_length = config['params']['temporal-resolution']  # Time [s]
 
+        # Fixed-shape re-batching
+        self.fixed_batch_shape = config['batch-data-generator']['fixed-batch-shape']
+        self.batch_shape = config['params']['dev-batch-shape'] if os.environ['ENVIRONMENT'] == 'dev' \
+            else config['params']['prod-batch-shape']
+        self.rebatcher = BatchRebatcher(self.batch_shape[0], self.dt) if self.fixed_batch_shape else None
+
     def __iter__(self):
-        for sample in range(min(self.max_files, len(self.filenames))):
-            data = DataLoader(fullpath=os.path.join(self.data_path, self.filenames[sample])).get_data()
-            filtered_data = SignalProcessor(data=data, **self.config).get_filtered_data()
+        """Yields (batch, initial_timestamp) tuples, where the timestamp is the acquisition time of the batch's
+        first row.
+        """
+        fullpaths = self.iter_followed_files() if self.follow else \
+            [os.path.join(self.data_path, filename) for filename in self.filenames[:self.max_files]]
+        next_fullpaths = iter([]) if self.follow else iter(fullpaths[1:])
+
+        for fullpath in fullpaths:
+            if self.is_processed_file(fullpath, next(next_fullpaths, None)):
+                logger.debug(f"Skipping file processed before the checkpoint: {fullpath}")
+                continue
+
+            data = DataLoader(fullpath=fullpath).get_data()
+            with profile_stage(self.profiler, 'filter'):
+                filtered_data = SignalProcessor(data=data, **self.config).get_filtered_data()
             self.temporal_len = filtered_data.shape[0]
             self.spatial_len = filtered_data.shape[1]
+            file_timestamp = self.get_file_timestamp(fullpath, self.temporal_len)
+
+            if self.memory_governor is not None:
+                self.memory_governor.update('prefetch', 'batch-data-generator', filtered_data.nbytes)
+
+            for batch, initial_timestamp in self.generate_batches(filtered_data, file_timestamp):
+                if self.memory_governor is not None:
+                    self.update_prefetch(filtered_data, file_timestamp, batch, initial_timestamp)
+                if self.resume_timestamp is not None and initial_timestamp <= self.resume_timestamp:
+                    continue
+                if not (self.replay or self.follow):
+                    time.sleep(self.batch_waiting_time)
+                yield batch, initial_timestamp
+
+        if self.memory_governor is not None:
+            self.memory_governor.release('prefetch', 'batch-data-generator')
+
+        if self.fixed_batch_shape and self.rebatcher.get_leftover_length():
+            logger.debug(f"Discarding {self.rebatcher.get_leftover_length()} leftover rows of the last file.")
+
+    def update_prefetch(self, filtered_data, file_timestamp, batch, initial_timestamp):
+        """Only the file's rows which have not been yielded yet are accounted as prefetched."""
+        yielded_rows = int(round((initial_timestamp - file_timestamp) / self.dt)) + batch.shape[0]
+        remaining_rows = min(max(self.temporal_len - yielded_rows, 0), self.temporal_len)
+        self.memory_governor.update('prefetch', 'batch-data-generator',
+                                    filtered_data.nbytes * remaining_rows // self.temporal_len)
+
+    # Follow Mode
+    @staticmethod
+    def list_numeric_dirs(path):
+        """Sub-directories whose name is a number ('year', 'month' or 'day'), in numeric order."""
+        if not os.path.isdir(path):
+            return []
+        names = [entry.name for entry in os.scandir(path) if entry.is_dir() and entry.name.isdigit()]
+        return [os.path.join(path, name) for name in sorted(names, key=int)]
+
+    def get_day_paths(self):
+        return [day_path for year_path in self.list_numeric_dirs(self.data_path)
+                for month_path in self.list_numeric_dirs(year_path)
+                for day_path in self.list_numeric_dirs(month_path)]
+
+    def get_latest_day_path(self):
+        """Only the last year and month directories are listed (instead of the whole tree)."""
+        path = self.data_path
+        for _ in range(3):
+            paths = self.list_numeric_dirs(path)
+            if not paths:
+                return None
+            path = paths[-1]
+        return path
+
+    def get_file_sort_key(self, fullpath, stat):
+        """Files are ordered by the timestamp of their names when 'filename-timestamp-format' is given (otherwise by
+        modification time).
+        """
+        filename_timestamp = self.get_filename_timestamp(fullpath)
+        return filename_timestamp if filename_timestamp is not None else stat.st_mtime
+
+    def get_sorted_filenames(self):
+        """Files of 'data_path' in timestamp order (the order of the checkpoints' timestamps)."""
+        fullpaths = [entry.path for entry in os.scandir(self.data_path) if entry.is_file()]
+        fullpaths.sort(key=lambda fullpath: self.get_file_sort_key(fullpath, os.stat(fullpath)))
+        return [os.path.basename(fullpath) for fullpath in fullpaths]
+
+    def is_processed_file(self, fullpath, next_fullpath=None):
+        """
+        A file was processed before the checkpoint when its acquisition ended at or before 'resume_timestamp': its
+        modification time (written after its acquisition), or the timestamp of the next file's name, is not later than
+        it. It is checked without loading the file.
+        """
+        if self.resume_timestamp is None:
+            return False
+        if os.path.getmtime(fullpath) <= self.resume_timestamp:
+            return True
+        next_timestamp = self.get_filename_timestamp(next_fullpath) if next_fullpath is not None else None
+        return next_timestamp is not None and next_timestamp <= self.resume_timestamp
+
+    def scan_day_path(self, day_path, pending_files, yielded_files):
+        """
+        Stat-based completeness check of a day directory's files: A file is complete when its size has not changed
+        since the previous scan and it has not been modified for 'settle-time' seconds.
+        :param pending_files: Size of each incomplete file in the previous scan (updated)
+        :param yielded_files: Files already yielded (updated)
+        :return: Complete files, in timestamp order
+        """
+        now = time.time()
+        complete_files = []
+        for entry in os.scandir(day_path):
+            if not entry.is_file() or entry.path in yielded_files or \
+                    os.path.splitext(entry.name)[1] not in (".json", ".npy"):
+                continue
+
+            stat = entry.stat()
+            previous_size = pending_files.get(entry.path)
+            settled = now - stat.st_mtime >= self.settle_time
+            if stat.st_size > 0 and settled and (previous_size is None or previous_size == stat.st_size):
+                pending_files.pop(entry.path, None)
+                complete_files.append((self.get_file_sort_key(entry.path, stat), entry.path))
+            else:
+                pending_files[entry.path] = stat.st_size
+
+        complete_files.sort()
+        yielded_files.update([fullpath for _, fullpath in complete_files])
+        return [fullpath for _, fullpath in complete_files]
+
+    def iter_followed_files(self):
+        """
+        Yields the complete files of the day-structured tree in timestamp order, and then keeps watching for new
+        complete files (polling every 'poll-interval' seconds) until 'stop' is called.
+        Only the latest day directory (and previous days, until their pending files are complete) is scanned in each
+        poll, instead of the whole tree. 'max-files' and 'waiting-time' do not apply.
+        """
+        day_paths = self.get_day_paths()
+        if not day_paths:
+            logger.warning(f"There aren't day directories in '{self.data_path}' yet. Waiting for data...")
+
+        # Initial walk of the tree. Days with incomplete files (and the last day) are watched afterwards.
+        watched_files = {}
+        for day_path in day_paths:
+            watched_files[day_path] = ({}, set())
+            for fullpath in self.scan_day_path(day_path, *watched_files[day_path]):
+                yield fullpath
+
+            if day_path != day_paths[-1] and not watched_files[day_path][0]:
+                del watched_files[day_path]
+
+        # Watch
+        watched_day_paths = list(watched_files.keys())
+        while not self.stopped:
+            latest_day_path = self.get_latest_day_path()
+            if latest_day_path is not None and latest_day_path not in watched_files:
+                logger.info(f"New day directory: {latest_day_path}")
+                watched_day_paths.append(latest_day_path)
+                watched_files[latest_day_path] = ({}, set())
+
+            for day_path in list(watched_day_paths):
+                day_pending_files, day_yielded_files = watched_files[day_path]
+                for fullpath in self.scan_day_path(day_path, day_pending_files, day_yielded_files):
+                    logger.debug(f"New complete file: {fullpath}")
+                    yield fullpath
+
+                # Previous days are not watched anymore once their pending files are complete
+                if day_path != watched_day_paths[-1] and not day_pending_files:
+                    watched_day_paths.remove(day_path)
+                    del watched_files[day_path]
+
+            time.sleep(self.poll_interval)
+
+    def stop(self):
+        """Stop following the data tree (after the current poll)."""
+        self.stopped = True
+
+    def generate_batches(self, filtered_data, file_timestamp):
+        if self.fixed_batch_shape:
+            # Batches of exactly 'batch-shape' rows, carrying leftover rows across files
+            yield from self.rebatcher.push(filtered_data, file_timestamp)
+        else:
+            # Batches of (approximately) 'temporal-resolution' seconds which divide each file's length
             batch_idx = int(self.batch_temporal_length / self.dt)
             new_batch_idx = self.get_closest_divisor(self.temporal_len, batch_idx)
 
             for x in range(0, self.temporal_len, new_batch_idx):
-                batch = filtered_data[x: x + new_batch_idx, :]
-                time.sleep(self.batch_waiting_time)
-                yield batch
+                yield filtered_data[x: x + new_batch_idx, :], file_timestamp + x * self.dt
+
+    def get_filename_timestamp(self, fullpath):
+        """Timestamp of a file's name ('filename-timestamp-format'), or None."""
+        if self.filename_timestamp_format is None:
+            return None
+        filename = os.path.splitext(os.path.basename(fullpath))[0]
+        try:
+            return datetime.strptime(filename, self.filename_timestamp_format).timestamp()
+        except ValueError:
+            return None
+
+    def get_file_timestamp(self, fullpath, temporal_len):
+        """Get the acquisition timestamp of the first sample of a file.
+        It is parsed from the filename when 'filename-timestamp-format' is given, otherwise it is derived from the
+        file's modification time (end of acquisition) minus the file's duration.
+        """
+        if self.filename_timestamp_format is not None:
+            filename = os.path.splitext(os.path.basename(fullpath))[0]
+            try:
+                return datetime.strptime(filename, self.filename_timestamp_format).timestamp()
+            except ValueError:
+                logger.warning(f"Filename '{filename}' does not match format '{self.filename_timestamp_format}'. "
+                               f"Using file's modification time instead.")
+
+        return os.path.getmtime(fullpath) - temporal_len * self.dt
 
     @staticmethod
     def get_closest_divisor(n, m):
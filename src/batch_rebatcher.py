@@ -0,0 +1,77 @@
+import numpy as np
+
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class BatchRebatcher:
+    def __init__(self, batch_length: int, dt: float):
+        """
+        Re-batches a continuous stream of strain matrices (possibly coming from several files of different lengths)
+        into batches of exactly 'batch_length' rows. Leftover rows of a matrix are carried over to the next one.
+        :param batch_length: Number of temporal samples (rows) of each output batch
+        :param dt: Sampling time [s] of the rows
+        """
+        self.batch_length = batch_length
+        self.dt = dt
+
+        # Carry-over Buffer
+        self.buffer = None
+        self.buffer_len = 0
+        self.buffer_timestamp = None
+
+    def push(self, data: np.ndarray, initial_timestamp: float):
+        """Add a new matrix to the stream and yield (batch, initial_timestamp) for each completed batch.
+        Batches fully contained in 'data' are yielded as views, batches spanning two matrices are copied into a new
+        preallocated buffer.
+        """
+        self.validate_spatial_length(data)
+        self.check_continuity(initial_timestamp)
+
+        temporal_len = data.shape[0]
+        x = 0
+
+        # Complete carried-over batch
+        if self.buffer_len:
+            x = min(self.batch_length - self.buffer_len, temporal_len)
+            self.buffer[self.buffer_len: self.buffer_len + x, :] = data[:x, :]
+            self.buffer_len += x
+
+            if self.buffer_len == self.batch_length:
+                batch, batch_timestamp = self.buffer, self.buffer_timestamp
+                # Downstream stages keep references to yielded batches, so the buffer is not reused
+                self.buffer = np.empty_like(batch)
+                self.buffer_len = 0
+                yield batch, batch_timestamp
+
+        # Yield full batches
+        while temporal_len - x >= self.batch_length:
+            yield data[x: x + self.batch_length, :], initial_timestamp + x * self.dt
+            x += self.batch_length
+
+        # Carry leftover rows
+        if x < temporal_len:
+            leftover = temporal_len - x
+            self.buffer[:leftover, :] = data[x:, :]
+            self.buffer_len = leftover
+            self.buffer_timestamp = initial_timestamp + x * self.dt
+
+    def validate_spatial_length(self, data):
+        if self.buffer is None or self.buffer.shape[1] != data.shape[1] or self.buffer.dtype != data.dtype:
+            if self.buffer_len:
+                logger.warning(f"Spatial length changed from {self.buffer.shape[1]} to {data.shape[1]}. "
+                               f"Discarding {self.buffer_len} carried-over rows.")
+            self.buffer = np.empty((self.batch_length, data.shape[1]), dtype=data.dtype)
+            self.buffer_len = 0
+
+    def check_continuity(self, initial_timestamp):
+        if self.buffer_len:
+            expected_timestamp = self.buffer_timestamp + self.buffer_len * self.dt
+            if abs(initial_timestamp - expected_timestamp) > self.dt:
+                logger.warning(f"Time gap of {round(initial_timestamp - expected_timestamp, 3)} seconds between "
+                               f"consecutive files. Carried-over rows are concatenated anyway.")
+
+    # Getters
+    def get_leftover_length(self):
+        return self.buffer_len
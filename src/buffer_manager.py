@@ -1,10 +1,8 @@
 import numpy as np
-from dotenv import load_dotenv
 
 from src.train_detector import TrainDetector
 from src.logger import load_logger
 
-load_dotenv()
 logger = load_logger(__name__)
 
 
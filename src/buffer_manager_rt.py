@@ -1,19 +1,30 @@
 import os
+import logging
 from uuid import uuid4
 
 import numpy as np
-from dotenv import load_dotenv
 
 from src.logger import load_logger
 from src.train_detector import TrainDetector
+from src.capture_trimmer import CaptureTrimmer
+from src.capture_statistics import CaptureStatistics
+from src.speed_estimator import SpeedEstimator
+from src.memory_governor import MemoryGovernor
+from src.profiler import profile_stage
 
-load_dotenv()
 logger = load_logger(__name__)
 
 
 class BufferManagerRT:
-    def __init__(self, **config):
+    def __init__(self, memory_governor=None, profiler=None, **config):
+        """
+        :param memory_governor: Optional 'MemoryGovernor' which accounts the buffered batches and the generated chunks,
+        and enforces the global memory ceiling after each batch.
+        :param profiler: Optional 'PipelineProfiler' which profiles the detector stage
+        """
         self.config = config
+        self.memory_governor = memory_governor
+        self.profiler = profiler
 
         # Signal Config
         self.N = config['signal']['N']
@@ -36,6 +47,35 @@ class BufferManagerRT:
         self.batch_shape = config['params']['dev-batch-shape'] if os.environ['ENVIRONMENT'] == 'dev' \
             else config['params']['prod-batch-shape']
         self.buffer_size_lower_limit = config['params']['buffer-size-lower-limit']
+        self.spatial_resolution = config['params']['spatial-resolution']  # Space [m]
+        self.batch_time = self.batch_shape[0] * self.dt  # Time [s]
+
+        # Append Mode (each batch of an ACTIVE capture is yielded immediately)
+        self.append_capture = config['client']['append-capture']
+
+        # Capture Trimming
+        self.trim_capture = config['client']['trim-capture']
+        self.capture_trimmer = CaptureTrimmer(**config) if self.trim_capture else None
+
+        # Train Detector
+        self.sliding_window = config['train-detector']['sliding-window']
+
+        # Capture Statistics (accumulated from the batches of each capture's chunks)
+        self.capture_statistics = config['capture-statistics']['enabled']
+
+        # Adaptive Capture (each capture's length from the train's estimated speed)
+        self.adaptive_capture = config['adaptive-capture']['enabled']
+        self.train_length = config['adaptive-capture']['train-length']  # Space [m]
+        self.estimation_batches = max(2, int(np.ceil(config['adaptive-capture']['estimation-time'] / self.batch_time)))
+        self.speed_estimator = SpeedEstimator(**config) if self.adaptive_capture else None
+        self.max_capture_batches = int(self.total_time_max / self.batch_time)
+
+        # Load Shedding: INACTIVE sections without trains only buffer the start margin's batches
+        self.drop_idle_batches = False
+
+        # Buffer only a copy of each section's batch data (instead of a view which keeps the whole batch referenced).
+        # Forced with a memory governor: it only accounts (and spills) the memory owned by the buffers
+        self.copy_section_batches = config['params']['copy-section-batches'] or memory_governor is not None
 
         # Batch Buffer Config
         self.batch_buffer = {key: [] for key, _ in self.section_map.items()}
@@ -46,7 +86,12 @@ class BufferManagerRT:
         self.batch_buffer_sizes = {key: None for key, _ in self.section_map.items()}
         self.section_map_sizes = {key: (self.batch_shape[0], value[1] - value[0]) for key, value in
                                   self.section_map.items()}
-        self.initial_timestamp = None
+        self.section_initial_timestamp = {key: None for key, _ in self.section_map.items()}
+        self.section_statistics = {key: None for key, _ in self.section_map.items()}
+        self.section_speed = {key: None for key, _ in self.section_map.items()}  # Speed [Km / h]
+        self.section_capture_batches = {key: None for key, _ in self.section_map.items()}  # Estimated capture length
+        self.section_captured_batches = {key: 0 for key, _ in self.section_map.items()}  # Batches of yielded chunks
+        self.section_speed_data = {key: None for key, _ in self.section_map.items()}  # Append mode's train batches
 
         self.buffer_sizes = self.get_buffer_sizes()
         self.to_active_state_index_ref = {key: int(self.start_margin_time / (self.batch_shape[0] * self.dt) + 1) for
@@ -54,6 +99,9 @@ class BufferManagerRT:
 
         self.to_inactive_state_index_ref = {key: value - int(self.end_margin_time / (self.batch_shape[0] * self.dt) + 1)
                                             for key, value in self.buffer_sizes.items()}
+        self.end_margin_batch_number = {key: int(self.end_margin_time / (self.batch_shape[0] * self.dt) + 1) for
+                                        key, _ in self.section_map.items()}
+        self.section_idle_batches = {key: 0 for key, _ in self.section_map.items()}
 
         self.max_margin_times = {key: self.batch_shape[0] * self.dt * (value - 1) for key, value in
                                  self.buffer_sizes.items()}
@@ -136,23 +184,37 @@ class BufferManagerRT:
                                  f"size value for this section.")
 
     # Train Capture Generation
-    def generate_train_capture(self, batch):
-        train_detector = TrainDetector(batch, **self.config)
-        processed_batch = train_detector.get_section_status()
+    def generate_train_capture(self, batch, initial_timestamp=None):
+        """Process a new batch and yield the generated chunks.
+        :param batch: Strain data matrix (time samples, spatial indexes)
+        :param initial_timestamp: Acquisition timestamp of the batch's first row. If None, current time is used.
+        """
+        with profile_stage(self.profiler, 'detector'):
+            train_detector = TrainDetector(batch, initial_timestamp=initial_timestamp, **self.config)
+            processed_batch = train_detector.get_section_status()
+
+        if self.copy_section_batches:
+            for section_batch in processed_batch:
+                section_batch['batch-data'] = section_batch['batch-data'].copy()
 
         for section_id in self.section_ids:
             # Get processed batch of a particular section
             processed_batch_section_id = \
                 [section_batch for section_batch in processed_batch if section_batch['section-id'] == section_id][0]
 
+            if self.append_capture:
+                for chunk in self.generate_append_chunks(section_id, processed_batch_section_id):
+                    self.add_pending_write(chunk)
+                    yield chunk
+                continue
+
             if len(self.batch_buffer[section_id]) < self.buffer_sizes[section_id]:
                 # Fill Buffer if not rebased
                 self.batch_buffer[section_id].append(processed_batch_section_id)
 
                 # Debug
-                logger.debug(
-                    f"BATCH BUFFER STATE  (FILLING)         :: section-id:  {section_id}, "
-                    f"buffer-length: {len(self.batch_buffer[section_id])}/{self.buffer_sizes[section_id]}")
+                logger.debug("BATCH BUFFER STATE  (FILLING)         :: section-id:  %s, buffer-length: %s/%s",
+                             section_id, len(self.batch_buffer[section_id]), self.buffer_sizes[section_id])
 
             else:
                 self.batch_buffer_rebase_flags[section_id] = True
@@ -160,6 +222,7 @@ class BufferManagerRT:
             if self.batch_buffer_rebase_flags[section_id]:
 
                 for chunk in self.generate_chunks(section_id):
+                    self.add_pending_write(chunk)
                     yield chunk
 
                 if self.batch_buffer[section_id]:  # Roll Buffer when rebased
@@ -172,18 +235,336 @@ class BufferManagerRT:
                     #              f" section_status: {section_status}")
                     # ---------------------------------------------------------------------------------
 
+            if self.drop_idle_batches and self.is_idle(section_id):
+                self.drop_idle_section_batches(section_id)
+
+        if self.memory_governor is not None:
+            self.enforce_memory_budget()
+
+    # Memory Budget
+    def add_pending_write(self, chunk):
+        """Generated chunks are accounted as pending writes until their consumer has written them
+        ('release_pending_write').
+        """
+        if self.memory_governor is not None:
+            self.memory_governor.add_pending_write(chunk)
+
+    def release_pending_write(self, chunk):
+        if self.memory_governor is not None:
+            self.memory_governor.release_pending_write(chunk)
+
+    def update_memory_accounting(self):
+        for section_id in self.section_ids:
+            buffered_bytes = sum([MemoryGovernor.get_in_memory_bytes(batch['batch-data']) for batch in
+                                  self.batch_buffer[section_id]])
+            self.memory_governor.update('batch-buffer', section_id, buffered_bytes)
+
+    def enforce_memory_budget(self):
+        """Apply the memory governor's policies in order, until the accounted bytes are under the ceiling."""
+        self.update_memory_accounting()
+
+        for policy in self.memory_governor.policies:
+            excess_bytes = self.memory_governor.get_excess_bytes()
+            if excess_bytes <= 0:
+                break
+
+            logger.warning(f"MEMORY BUDGET EXCEEDED :: {excess_bytes} bytes over the ceiling. "
+                           f"Applying policy '{policy}'.")
+            if policy == 'reduce-margins':
+                self.reduce_margins()
+            elif policy == 'spill':
+                self.spill_buffers(excess_bytes)
+            elif policy == 'drop-oldest':
+                self.drop_oldest_batches(excess_bytes)
+            self.update_memory_accounting()
+
+    def get_inactive_section_ids(self):
+        return [section_id for section_id in self.section_ids if not self.batch_buffer_status_flags[section_id]]
+
+    def reduce_margins(self):
+        """INACTIVE sections (without trains in their buffers) only keep the batches needed to start a capture with
+        the start margin.
+        """
+        for section_id in filter(self.is_idle, self.section_ids):
+            self.memory_governor.reduced_batches += self.drop_idle_section_batches(section_id)
+
+    def is_idle(self, section_id):
+        """An INACTIVE section without any train in its buffer."""
+        return not self.batch_buffer_status_flags[section_id] and \
+            not any([batch['status'] for batch in self.batch_buffer[section_id]])
+
+    def drop_idle_section_batches(self, section_id):
+        """Keep only the batches needed to start a capture with the start margin. Returns the dropped batches."""
+        buffer = self.batch_buffer[section_id]
+        dropped_batches = max(0, len(buffer) - (self.to_active_state_index_ref[section_id] + 1))
+        del buffer[:dropped_batches]
+        # The buffer is filled again before rolling
+        self.batch_buffer_rebase_flags[section_id] = False
+        return dropped_batches
+
+    def spill_buffers(self, excess_bytes):
+        """Spill the buffered batches of the sections with the largest buffers first."""
+        section_bytes = self.memory_governor.usage['batch-buffer']
+        for section_id in sorted(self.section_ids, key=lambda key: section_bytes.get(key, 0), reverse=True):
+            for batch in self.batch_buffer[section_id]:
+                if excess_bytes <= 0:
+                    return
+                batch_bytes = MemoryGovernor.get_in_memory_bytes(batch['batch-data'])
+                if batch_bytes:
+                    batch['batch-data'] = self.memory_governor.spill(batch['batch-data'])
+                    excess_bytes -= batch_bytes
+
+    def drop_oldest_batches(self, excess_bytes):
+        """Drop the oldest buffered batches of INACTIVE sections first, and then of ACTIVE sections."""
+        inactive_section_ids = self.get_inactive_section_ids()
+        active_section_ids = [key for key in self.section_ids if key not in inactive_section_ids]
+
+        for section_ids in (inactive_section_ids, active_section_ids):
+            while excess_bytes > 0:
+                section_ids_with_data = [key for key in section_ids if self.batch_buffer[key]]
+                if not section_ids_with_data:
+                    break
+
+                section_id = min(section_ids_with_data,
+                                 key=lambda key: self.batch_buffer[key][0]['initial-timestamp'])
+                batch = self.batch_buffer[section_id].pop(0)
+                self.batch_buffer_rebase_flags[section_id] = False
+                excess_bytes -= MemoryGovernor.get_in_memory_bytes(batch['batch-data'])
+                self.memory_governor.dropped_batches += 1
+                logger.warning(f"Dropped the oldest buffered batch of section {section_id} "
+                               f"({'ACTIVE' if self.batch_buffer_status_flags[section_id] else 'INACTIVE'}).")
+
+    def is_capture_start(self, section_id, train_event_min_index):
+        """Checks whether an INACTIVE section's capture should start.
+        In sliding-window mode the train onset is known at row level, so the capture starts as soon as the buffered
+        rows before the onset cover the start margin, instead of waiting for the first train batch to reach the
+        'to_active_state_index_ref' position.
+        """
+        if not self.sliding_window:
+            return train_event_min_index == self.to_active_state_index_ref[section_id]
+
+        buffer = self.batch_buffer[section_id]
+        rows_before_onset = sum([batch['batch-data'].shape[0] for batch in buffer[:train_event_min_index]]) + \
+            buffer[train_event_min_index]['onset-index']
+        return rows_before_onset * self.dt >= self.start_margin_time
+
+    def get_chunk(self, section_id, complete, trim_start, batches=None):
+        """Builds a chunk with the section's buffered batches (or the first 'batches' of them).
+        "sample-offset" is the number of samples between the capture's initial timestamp and the chunk's first row.
+        """
+        buffer = self.batch_buffer[section_id] if batches is None else self.batch_buffer[section_id][:batches]
+        self.section_captured_batches[section_id] += len(buffer)
+        train_data = self.concat_matrix_list([batch['batch-data'] for batch in buffer])
+        sample_offset = int(round((buffer[0]['initial-timestamp'] - self.section_initial_timestamp[section_id]) /
+                                  self.dt))
+
+        if self.trim_capture:
+            train_data, trim_offset = self.capture_trimmer.trim(train_data, trim_start=trim_start, trim_end=complete)
+            sample_offset += trim_offset
+
+        chunk = {
+            "section-id": section_id,
+            "uuid": self.section_uuid_chunk[section_id],
+            "file-chunk": self.section_file_chunk[section_id],
+            "initial-timestamp": self.section_initial_timestamp[section_id],
+            "sample-offset": sample_offset,
+            "complete": complete,
+            "train-data": train_data
+        }
+
+        # Statistics of the capture up to this chunk (the complete chunk's statistics are the whole capture's)
+        statistics = self.section_statistics[section_id]
+        if statistics is not None:
+            for batch in buffer:
+                statistics.update(batch)
+            statistics.add_samples(train_data.shape[0])
+            chunk.update({"statistics": statistics.get_statistics()})
+
+        return chunk
+
+    @staticmethod
+    def get_chunk_info(chunk):
+        """Chunk's metadata for the debug logs (the train-data's shape instead of its values)."""
+        chunk_info = {key: value for key, value in chunk.items() if key != "train-data"}
+        chunk_info.update({"train-data-shape": chunk["train-data"].shape})
+        return chunk_info
+
+    def get_capture_statistics(self):
+        return CaptureStatistics(**self.config) if self.capture_statistics else None
+
+    # Adaptive Capture
+    def estimate_capture_batches(self, section_id, train_batches, onset_batch, train_length):
+        """Estimates the train's speed from the section's batches since the train's onset (the capture's batch
+        'onset_batch'), and the capture's length: the batches for a 'train_length' train to pass the whole section,
+        plus the end margin, bounded by 'total-time-max'. None if the speed cannot be estimated (static rules apply).
+        """
+        speed = self.speed_estimator.estimate(np.concatenate([batch['batch-data'] for batch in train_batches]))
+        self.section_speed[section_id] = speed
+        self.section_capture_batches[section_id] = None
+        if speed is None:
+            logger.debug(f"SPEED :: The train's speed in section {section_id} could not be estimated")
+            return None
+
+        section_length = self.section_map_sizes[section_id][1] * self.spatial_resolution  # Space [m]
+        passage_time = (section_length + train_length) / (speed / 3.6)  # Time [s]
+        capture_batches = onset_batch + int(np.ceil((passage_time + self.end_margin_time) / self.batch_time))
+        capture_batches = min(max(capture_batches, onset_batch + 1), self.max_capture_batches)
+        self.section_capture_batches[section_id] = capture_batches
+
+        statistics = self.section_statistics[section_id]
+        if statistics is not None:
+            statistics.speed = speed
+        logger.info(f"SPEED :: section {section_id}: {round(speed, 1)} Km/h "
+                    f"(direction: {self.speed_estimator.direction}, correlation: "
+                    f"{round(self.speed_estimator.correlation, 3)}). Capture length: {capture_batches} batches")
+        return capture_batches
+
+    def get_adaptive_cut(self, section_id):
+        """Number of buffered batches of the capture's next chunk, given its estimated length. None when the static
+        rules apply: the length is unknown, or a train is detected after the estimated end (the train is longer or
+        slower than estimated, so the estimate is discarded).
+        """
+        capture_batches = self.section_capture_batches[section_id]
+        if capture_batches is None:
+            return None
+
+        buffer = self.batch_buffer[section_id]
+        cut = capture_batches - self.section_captured_batches[section_id]
+        if cut > len(buffer):
+            return len(buffer)
+        if cut > 0 and not any([batch['status'] for batch in buffer[cut - 1 if cut == len(buffer) else cut:]]):
+            return cut
+
+        logger.debug(f"Train detected after the estimated end of the capture in section {section_id}")
+        self.section_capture_batches[section_id] = None
+        return None
+
+    def get_adaptive_chunk(self, section_id, cut, trim_start):
+        """Chunk with the first 'cut' buffered batches. The capture is complete when the chunk reaches its estimated
+        end (the rest of the buffer is kept, as the start margin of the next capture), otherwise it stays ACTIVE.
+        """
+        complete = self.section_captured_batches[section_id] + cut >= self.section_capture_batches[section_id]
+        chunk = self.get_chunk(section_id, complete, trim_start, batches=cut)
+
+        self.batch_buffer_status_flags[section_id] = not complete
+        if complete:
+            logger.debug(f"DE-ACTIVATING capture in section {section_id} (estimated end)")
+            self.section_capture_batches[section_id] = None
+
+        # Emptying the buffer's captured batches
+        del self.batch_buffer[section_id][:cut]
+        self.batch_buffer_rebase_flags[section_id] = False
+        return chunk
+
+    def start_adaptive_capture(self, section_id, train_event_min_index):
+        """Estimates the new capture's length from the buffered batches since the train's onset. Returns the first
+        chunk's cut (see 'get_adaptive_cut').
+        """
+        train_batches = self.batch_buffer[section_id][train_event_min_index:
+                                                      train_event_min_index + self.estimation_batches]
+        self.estimate_capture_batches(section_id, train_batches, train_event_min_index, self.train_length)
+        return self.get_adaptive_cut(section_id)
+
+    def is_append_capture_complete(self, section_id, processed_batch, complete):
+        """Append mode: The ACTIVE capture's batches since the train's onset are collected for 'estimation-time'
+        (or until the static rule completes the capture) to estimate the train's speed. Once known, batches without
+        train do not complete the capture until the train's front has passed the whole section (detection gaps of slow
+        or sparse trains). After it, the end margin's rule applies, which already follows the train's tail.
+        :param complete: Completion by the static rule
+        """
+        speed_data = self.section_speed_data[section_id]
+        if speed_data is not None:
+            speed_data.append(processed_batch)
+            if len(speed_data) >= self.estimation_batches or complete:  # Or with the shorter data of a short capture
+                onset_batch = self.section_captured_batches[section_id] + 1 - len(speed_data)
+                self.estimate_capture_batches(section_id, speed_data, onset_batch, train_length=0)
+                self.section_speed_data[section_id] = None
+
+        capture_batches = self.section_capture_batches[section_id]
+        if capture_batches is not None and self.section_captured_batches[section_id] + 1 < capture_batches:
+            return False
+        return complete
+
+    def generate_append_chunks(self, section_id, processed_batch):
+        """
+        Append mode: While the section's capture is INACTIVE only the pre-trigger margin is buffered. Once ACTIVE,
+        each new batch is yielded immediately as a chunk, to be appended to the open capture file.
+        Chunk's "stream-state": "open" (new capture file) or "append" (append to the open capture file).
+        The capture is DE-ACTIVATED ("complete") after 'end_margin_batch_number' batches without train.
+        """
+        self.batch_buffer[section_id].append(processed_batch)
+
+        if self.batch_buffer_status_flags[section_id]:  # The section-id's train-capture is "ACTIVE"
+            self.section_idle_batches[section_id] = 0 if processed_batch['status'] else \
+                self.section_idle_batches[section_id] + 1
+            complete = self.section_idle_batches[section_id] >= self.end_margin_batch_number[section_id]
+            if self.speed_estimator is not None:
+                complete = self.is_append_capture_complete(section_id, processed_batch, complete)
+
+            if complete:
+                logger.debug(f"DE-ACTIVATING capture in section {section_id}")
+                self.batch_buffer_status_flags[section_id] = False
+
+            chunk = self.get_chunk(section_id, complete, trim_start=False)
+            chunk.update({"stream-state": "append"})
+            self.batch_buffer.update({section_id: []})
+
+            yield chunk
+
+        else:  # The section-id's train-capture is "INACTIVE": keep only the pre-trigger margin
+            if len(self.batch_buffer[section_id]) > self.to_active_state_index_ref[section_id] + 1:
+                self.batch_buffer[section_id].pop(0)
+
+            if processed_batch['status']:
+                logger.debug(f"ACTIVATING capture in section {section_id}")
+                self.section_initial_timestamp[section_id] = self.batch_buffer[section_id][0]['initial-timestamp']
+                self.section_uuid_chunk[section_id] = uuid4()
+                self.section_file_chunk[section_id] = 0
+                self.section_statistics[section_id] = self.get_capture_statistics()
+                self.section_idle_batches[section_id] = 0
+                self.section_captured_batches[section_id] = 0
+                self.section_capture_batches[section_id] = None
+                self.section_speed[section_id] = None
+                self.section_speed_data[section_id] = [processed_batch] if self.speed_estimator is not None else None
+                self.batch_buffer_status_flags[section_id] = True
+
+                chunk = self.get_chunk(section_id, complete=False, trim_start=True)
+                chunk.update({"stream-state": "open"})
+                self.batch_buffer.update({section_id: []})
+
+                # Debug ------------------------------------------------------------
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("INITIAL (OPEN) CHUNK GENERATED                   :: %s", self.get_chunk_info(chunk))
+                # ------------------------------------------------------------------
+
+                yield chunk
+
     def generate_chunks(self, section_id):
         # Get a list of the train-event status batches stored in the buffer for a particular section
         section_status = [batch['status'] for batch in self.batch_buffer[section_id]]
 
         # Debug
-        logger.debug(f"BATCH BUFFER STATE  (CHUNK-GENERATOR) :: section-id: {section_id},"
-                     f" section_status: {section_status}")
+        logger.debug("BATCH BUFFER STATE  (CHUNK-GENERATOR) :: section-id: %s, section_status: %s", section_id,
+                     section_status)
+
+        # ACTIVE capture of estimated length: chunks are cut at its estimated end, with or without trains in the buffer
+        if self.batch_buffer_status_flags[section_id] and self.section_capture_batches[section_id] is not None:
+            cut = self.get_adaptive_cut(section_id)
+            if cut is not None:
+                self.section_file_chunk[section_id] += 1
+                chunk = self.get_adaptive_chunk(section_id, cut, trim_start=False)
+
+                # Debug ---------------------------------------------------
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("OTHER (ADAPTIVE) CHUNK GENERATED                   :: %s", self.get_chunk_info(chunk))
+                # ---------------------------------------------------------
+
+                yield chunk
+                return
 
         if any(section_status):  # Not start any train capture if there isn't any train detected in the buffer
 
-            # Get batch data
-            batch_data = [batch['batch-data'] for batch in self.batch_buffer[section_id]]
+            buffer_size = len(self.batch_buffer[section_id])
 
             train_event_min_index = min([s for s, r in enumerate(section_status) if r])
             train_event_max_index = max([s for s, r in enumerate(section_status) if r])
@@ -193,40 +574,40 @@ class BufferManagerRT:
 
             if not self.batch_buffer_status_flags[section_id]:  # The section-id's train-capture is "INACTIVE"
 
-                if train_event_min_index == self.to_active_state_index_ref[section_id]:
+                if self.is_capture_start(section_id, train_event_min_index):
                     # Get initial timestamp
-                    self.initial_timestamp = self.batch_buffer[section_id][0]['initial-timestamp']
+                    self.section_initial_timestamp[section_id] = self.batch_buffer[section_id][0]['initial-timestamp']
 
-                    # Concat batch data to get a chunk (only when yielded)
-                    train_data = self.concat_matrix_list(batch_data)
+                    # Generate new section's chunk-uuid, restart file-chunk counter and concat batch data to get a chunk
+                    self.section_uuid_chunk[section_id] = uuid4()
+                    self.section_file_chunk[section_id] = 0
+                    self.section_statistics[section_id] = self.get_capture_statistics()
+                    self.section_captured_batches[section_id] = 0
+                    cut = self.start_adaptive_capture(section_id, train_event_min_index) if \
+                        self.speed_estimator is not None else None
 
-                    if not complete:  # Mark status as ACTIVE
-                        logger.debug(f"ACTIVATING capture in section {section_id}")
-                        self.batch_buffer_status_flags[section_id] = True
+                    if cut is not None:
+                        chunk = self.get_adaptive_chunk(section_id, cut, trim_start=True)
+                        if not chunk['complete']:
+                            logger.debug(f"ACTIVATING capture in section {section_id}")
 
-                    # Emptying the buffer
-                    self.batch_buffer.update({section_id: []})
-                    self.batch_buffer_rebase_flags[section_id] = False
+                    else:
+                        chunk = self.get_chunk(section_id, complete, trim_start=True)
 
-                    # Generate new section's chunk-uuid and restart file-chunk counter
-                    self.section_uuid_chunk[section_id] = uuid4()
-                    self.section_file_chunk[section_id] = 0
+                        if not complete:  # Mark status as ACTIVE
+                            logger.debug(f"ACTIVATING capture in section {section_id}")
+                            self.batch_buffer_status_flags[section_id] = True
 
-                    chunk = {
-                        "section-id": section_id,
-                        "uuid": self.section_uuid_chunk[section_id],
-                        "file-chunk": self.section_file_chunk[section_id],
-                        "initial-timestamp": self.initial_timestamp,
-                        "complete": complete,
-                        "train-data": train_data
-                    }
+                        # Emptying the buffer
+                        self.batch_buffer.update({section_id: []})
+                        self.batch_buffer_rebase_flags[section_id] = False
 
                     # Debug ------------------------------------------------------------
-                    logger.debug(
-                        f"INITIAL (NEW) CHUNK GENERATED                   :: {chunk}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("INITIAL (NEW) CHUNK GENERATED                   :: %s",
+                                     self.get_chunk_info(chunk))
                     # ------------------------------------------------------------------
-                    logger.debug(
-                        f"batch data len: {len(batch_data)} - buffer-size: {self.buffer_sizes[section_id]}")
+                    logger.debug("batch data len: %s - buffer-size: %s", buffer_size, self.buffer_sizes[section_id])
 
                     # if len(batch_data) == self.buffer_size:
                     yield chunk
@@ -235,35 +616,24 @@ class BufferManagerRT:
                 # If there isn't train in the last batch mark chunk as complete
                 complete = not section_status[-1]
 
-                # Concat batch data to get a chunk (only when yielded)
-                train_data = self.concat_matrix_list(batch_data)
-
                 if train_event_max_index <= self.to_inactive_state_index_ref[section_id]:
                     logger.debug(f"DE-ACTIVATING capture in section {section_id}")
                     self.batch_buffer_status_flags[section_id] = False
 
+                # Update file-chunk counter and concat batch data to get a chunk (only when yielded)
+                self.section_file_chunk[section_id] += 1
+                chunk = self.get_chunk(section_id, complete, trim_start=False)
+
                 # Emptying the buffer
                 self.batch_buffer.update({section_id: []})
                 self.batch_buffer_rebase_flags[section_id] = False
 
-                # Update file-chunk counter
-                self.section_file_chunk[section_id] += 1
-
-                chunk = {
-                    "section-id": section_id,
-                    "uuid": self.section_uuid_chunk[section_id],
-                    "file-chunk": self.section_file_chunk[section_id],
-                    "initial-timestamp": self.initial_timestamp,
-                    "complete": complete,
-                    "train-data": train_data
-                }
-
                 # Debug ---------------------------------------------------
-                logger.debug(
-                    f"OTHER CHUNK GENERATED                   :: {chunk}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("OTHER CHUNK GENERATED                   :: %s", self.get_chunk_info(chunk))
                 # ---------------------------------------------------------
 
-                logger.info(f"batch data len: {len(batch_data)} - buffer-size: {self.buffer_sizes[section_id]}")
+                logger.info(f"batch data len: {buffer_size} - buffer-size: {self.buffer_sizes[section_id]}")
                 # if len(batch_data) == self.buffer_size:
                 yield chunk
 
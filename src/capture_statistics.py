@@ -0,0 +1,141 @@
+import numpy as np
+
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class CaptureStatistics:
+    STATE_ATTRIBUTES = ("batches", "temporal_samples", "train_samples", "peak_rms", "peak_rms_channel",
+                        "peak_rms_timestamp", "first_active_channel", "last_active_channel", "envelope",
+                        "envelope_batches", "pending_energy", "pending_samples", "pending_batches", "speed")
+
+    def __init__(self, **config):
+        """
+        Summary statistics of a capture, accumulated incrementally from its processed batches (the per-channel RMS
+        computed by 'TrainDetector'), so the capture's data does not need to be decoded to get them:
+            peak_rms:           Highest channel RMS of any batch (and its section's channel and batch timestamp).
+            energy_envelope:    Mean energy (mean square) of the capture's samples every 'envelope_batches' batches.
+                                The number of batches of each point is doubled when the envelope exceeds
+                                'max-envelope-points' (adjacent points are merged).
+            active_channels:    First and last section's channels with RMS above the detection threshold in any train
+                                batch, or None.
+            duration:           Time [s] of the capture's written rows (after trimming, see 'add_samples').
+            train_duration:     Time [s] of the rows where a train has been detected.
+            speed:              Train's estimated speed [Km / h] (adaptive capture), or None.
+        """
+        self.detection_threshold = config['train-detector']['detection-threshold']
+        self.max_envelope_points = config['capture-statistics']['max-envelope-points']
+        self.dt = config['signal']['N'] * (1 / config['signal']['fs'])  # Time [s]
+
+        self.batches = 0
+        self.temporal_samples = 0
+        self.train_samples = 0
+        self.peak_rms = 0.0
+        self.peak_rms_channel = None
+        self.peak_rms_timestamp = None
+        self.first_active_channel = None
+        self.last_active_channel = None
+        self.speed = None  # Set by the buffer manager when the train's speed is estimated
+
+        # Energy envelope: [energy sum, temporal samples] of each point
+        self.envelope = []
+        self.envelope_batches = 1
+        self.pending_energy = 0.0
+        self.pending_samples = 0
+        self.pending_batches = 0
+
+    def update(self, processed_batch):
+        """Accumulates a processed batch of the capture (a 'TrainDetector' section with its "rms")."""
+        rms = processed_batch['rms']
+        temporal_samples = processed_batch['batch-data'].shape[0]
+        self.batches += 1
+
+        peak_channel = int(np.argmax(rms))
+        if rms[peak_channel] > self.peak_rms:
+            self.peak_rms = float(rms[peak_channel])
+            self.peak_rms_channel = peak_channel
+            self.peak_rms_timestamp = processed_batch['initial-timestamp']
+
+        if processed_batch['status']:
+            self.train_samples += processed_batch['offset-index'] - processed_batch['onset-index']
+            active_channels = np.flatnonzero(rms >= self.detection_threshold)
+            if active_channels.size > 0:
+                self.first_active_channel = int(active_channels[0]) if self.first_active_channel is None else \
+                    min(self.first_active_channel, int(active_channels[0]))
+                self.last_active_channel = int(active_channels[-1]) if self.last_active_channel is None else \
+                    max(self.last_active_channel, int(active_channels[-1]))
+
+        # Mean square of the batch's samples, weighted by its temporal samples
+        self.pending_energy += float(np.mean(np.square(rms))) * temporal_samples
+        self.pending_samples += temporal_samples
+        self.pending_batches += 1
+        if self.pending_batches == self.envelope_batches:
+            self.envelope.append([self.pending_energy, self.pending_samples])
+            self.pending_energy, self.pending_samples, self.pending_batches = 0.0, 0, 0
+            if len(self.envelope) >= self.max_envelope_points:
+                self.merge_envelope()
+
+    def merge_envelope(self):
+        """Halves the envelope's resolution (merges pairs of adjacent points)."""
+        merged_envelope = []
+        for i in range(0, len(self.envelope) - 1, 2):
+            merged_envelope.append([self.envelope[i][0] + self.envelope[i + 1][0],
+                                    self.envelope[i][1] + self.envelope[i + 1][1]])
+        if len(self.envelope) % 2:  # Last point is completed by the next batches
+            self.pending_energy += self.envelope[-1][0]
+            self.pending_samples += self.envelope[-1][1]
+            self.pending_batches += self.envelope_batches
+        self.envelope = merged_envelope
+        self.envelope_batches *= 2
+
+    def add_samples(self, temporal_samples):
+        """Accumulates the temporal samples of a written chunk."""
+        self.temporal_samples += temporal_samples
+
+    # Checkpoints
+    def get_state(self):
+        return {attribute: getattr(self, attribute) for attribute in self.STATE_ATTRIBUTES}
+
+    def restore_state(self, state):
+        for attribute in self.STATE_ATTRIBUTES:
+            setattr(self, attribute, state[attribute])
+        return self
+
+    # Getters
+    def get_energy_envelope(self):
+        envelope = self.envelope + ([[self.pending_energy, self.pending_samples]] if self.pending_samples else [])
+        return [energy / temporal_samples for energy, temporal_samples in envelope]
+
+    def get_statistics(self):
+        """Statistics of the header's "statistics" field (JSON types)."""
+        return {
+            "peak_rms": self.peak_rms,
+            "peak_rms_channel": self.peak_rms_channel,
+            "peak_rms_timestamp": self.peak_rms_timestamp,
+            "energy_envelope": self.get_energy_envelope(),
+            "envelope_batches": self.envelope_batches,
+            "active_channels": [self.first_active_channel, self.last_active_channel]
+            if self.first_active_channel is not None else None,
+            "duration": self.temporal_samples * self.dt,
+            "train_duration": self.train_samples * self.dt,
+            "speed": self.speed,
+            "batches": self.batches
+        }
+
+    @staticmethod
+    def get_reserved_statistics(max_envelope_points):
+        """Statistics with the longest JSON representation, to reserve a header's length."""
+        longest_float = -1.2345678901234567e-300
+        return {
+            "peak_rms": longest_float,
+            "peak_rms_channel": pow(10, 15),
+            "peak_rms_timestamp": longest_float,
+            "energy_envelope": [longest_float] * max_envelope_points,
+            "envelope_batches": pow(10, 15),
+            "active_channels": [pow(10, 15), pow(10, 15)],
+            "duration": longest_float,
+            "train_duration": longest_float,
+            "speed": longest_float,
+            "batches": pow(10, 15)
+        }
@@ -0,0 +1,62 @@
+import numpy as np
+
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class CaptureTrimmer:
+    def __init__(self, **config):
+        # Signal Config
+        self.N = config['signal']['N']
+        self.fs = config['signal']['fs']  # Frequency [Hz]
+        self.dt = self.N * (1 / self.fs)  # Time [s]
+
+        # Client's Margins
+        self.start_margin_length = int(round(config['client']['start-margin-time'] / self.dt))  # Samples
+        self.end_margin_length = int(round(config['client']['end-margin-time'] / self.dt))  # Samples
+
+        # Detection Parameters
+        self.validity_percentage = config['train-detector']['validity-percentage']
+        self.detection_threshold = config['train-detector']['detection-threshold']
+        self.window_length = max(1, int(round(config['train-detector']['trim-window-time'] / self.dt)))  # Samples
+
+        # A row is considered a train row if its smoothed mean energy is, at least, the energy of having the minimum
+        # percentage of valid channels exactly at the detection threshold.
+        self.energy_threshold = self.validity_percentage * self.detection_threshold ** 2
+
+    def get_row_energy(self, data):
+        """Mean energy of each row, smoothed with a centered moving average of 'trim-window-time' seconds."""
+        row_energy = np.mean(np.square(data), axis=1)
+        window_length = min(self.window_length, row_energy.size)
+
+        cumsum = np.concatenate([[0], np.cumsum(row_energy)])
+        half_window = window_length // 2
+        starts = np.clip(np.arange(row_energy.size) - half_window, 0, row_energy.size - window_length)
+        return (cumsum[starts + window_length] - cumsum[starts]) / window_length
+
+    def get_train_limits(self, data):
+        """Get the first and last rows (end excluded) where a train is located, or None if there isn't any."""
+        train_rows = np.flatnonzero(self.get_row_energy(data) >= self.energy_threshold)
+        if train_rows.size == 0:
+            return None
+        return int(train_rows[0]), int(train_rows[-1]) + 1
+
+    def trim(self, data, trim_start=True, trim_end=True):
+        """
+        Trims the rows of data before the train start and after the train end, keeping the client's margins.
+        :param data: Strain data matrix (time samples, spatial indexes)
+        :param trim_start: Trim background before the train start
+        :param trim_end: Trim background after the train end
+        :return: trimmed data (a view of data) and the index of its first row in the given data
+        """
+        train_limits = self.get_train_limits(data)
+        if train_limits is None:
+            logger.debug("Train limits not found. Skipping trimming.")
+            return data, 0
+
+        start_index = max(train_limits[0] - self.start_margin_length, 0) if trim_start else 0
+        end_index = min(train_limits[1] + self.end_margin_length, data.shape[0]) if trim_end else data.shape[0]
+
+        logger.debug(f"TRIMMING :: rows: ({start_index}, {end_index}) of {data.shape[0]}")
+        return data[start_index:end_index, :], start_index
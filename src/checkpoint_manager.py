@@ -0,0 +1,272 @@
+import os
+import json
+import time
+from uuid import UUID, uuid4
+
+import numpy as np
+
+from src.json_file_manager_rt import JsonFileManagerRT
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class CheckpointManager:
+    SECTION_STATE_ATTRIBUTES = ("batch_buffer_rebase_flags", "batch_buffer_status_flags", "section_file_chunk",
+                                "section_initial_timestamp", "section_idle_batches", "section_speed",
+                                "section_capture_batches", "section_captured_batches")
+
+    def __init__(self, **config):
+        """
+        Periodic checkpoints of the 'BufferManagerRT' state, to resume the processing after a restart without
+        splitting or losing the in-flight captures.
+        Each checkpoint is made of:
+            'checkpoint.json':          Metadata (sections' flags and counters, capture uuids and statistics, buffered
+                                        batches' metadata, open capture files and the timestamp of the last processed
+                                        batch).
+            'buffer_{section-id}_{id}.dat': Preallocated memory-mapped file of each section (float64), with a slot per
+                                        buffered batch (or batch of an in-progress speed estimate). Each batch is
+                                        written once, to a slot which the last checkpoint does not reference.
+        The metadata file is replaced atomically once the data files have been flushed, so the last complete checkpoint
+        is always consistent.
+        """
+        self.checkpoint_path = config['checkpoint']['path']
+        self.interval = config['checkpoint']['interval']  # Batches
+        self.save_hdf5 = config['client']['save-hdf5']
+
+        self.metadata_fullpath = os.path.join(self.checkpoint_path, "checkpoint.json")
+        self.processed_batches = 0
+
+        # Data files of each section: {"filename", "slots", "slot-size", "data" (memory map)}
+        self.data_files = {}
+        self.written_batches = {}  # Slot of each section's written batch: {id(batch): (slot, batch)}
+        self.committed_slots = {}  # Slots referenced by the last checkpoint, by section
+
+    # Checkpoint
+    def update(self, buffer_manager_rt, last_timestamp, stream_file_manager=None):
+        """Call once per processed batch (after its chunks have been written). Saves a checkpoint every 'interval'
+        batches.
+        """
+        self.processed_batches += 1
+        if self.processed_batches % self.interval == 0:
+            self.save(buffer_manager_rt, last_timestamp, stream_file_manager)
+
+    def save(self, buffer_manager_rt, last_timestamp, stream_file_manager=None):
+        if not os.path.isdir(self.checkpoint_path):
+            os.makedirs(self.checkpoint_path)
+
+        buffer_metadata, written_batches = self.write_buffer_data(buffer_manager_rt)
+
+        metadata = {
+            "last-timestamp": last_timestamp,
+            "saved-at": time.time(),
+            "data-files": {key: {"filename": value["filename"], "slots": value["slots"],
+                                 "slot-size": value["slot-size"]} for key, value in self.data_files.items()},
+            "section-uuid-chunk": {key: str(value) if value is not None else None for key, value in
+                                   buffer_manager_rt.section_uuid_chunk.items()},
+            "section-statistics": {key: value.get_state() if value is not None else None for key, value in
+                                   buffer_manager_rt.section_statistics.items()},
+            "buffer": buffer_metadata,
+            "stream-captures": stream_file_manager.get_state() if stream_file_manager is not None else []
+        }
+        metadata.update({attribute: getattr(buffer_manager_rt, attribute) for attribute in
+                         self.SECTION_STATE_ATTRIBUTES})
+
+        temporal_fullpath = f"{self.metadata_fullpath}.tmp"
+        with open(temporal_fullpath, "w") as file:
+            json.dump(metadata, file, default=self.to_json_type)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporal_fullpath, self.metadata_fullpath)
+
+        # Committed: the slots of this checkpoint must not be overwritten until the next one
+        self.written_batches = written_batches
+        self.committed_slots = {key: {slot for slot, _ in value.values()} for key, value in written_batches.items()}
+        self.remove_unused_data_files()
+
+        logger.debug(f"Checkpoint saved (last-timestamp: {last_timestamp}, "
+                     f"buffered batches: {len(buffer_metadata)})")
+
+    def write_buffer_data(self, buffer_manager_rt):
+        """
+        Write the data of the buffered batches, and of the batches of the in-progress speed estimates (append mode),
+        which were not written by a previous checkpoint.
+        :return: Batches' metadata, and the slot of each section's batch
+        """
+        buffer_metadata = []
+        written_batches = {}
+        for section_id in buffer_manager_rt.section_ids:
+            batches = [(batch, False) for batch in buffer_manager_rt.batch_buffer[section_id]]
+            batches += [(batch, True) for batch in buffer_manager_rt.section_speed_data[section_id] or []]
+            if not batches:
+                continue
+
+            section_written_batches = self.write_section_data(section_id, [batch for batch, _ in batches])
+            for batch, speed_data in batches:
+                batch_metadata = {key: value for key, value in batch.items() if key != 'batch-data'}
+                batch_metadata.update({"slot": section_written_batches[id(batch)][0],
+                                       "shape": batch['batch-data'].shape, "speed-data": speed_data})
+                buffer_metadata.append(batch_metadata)
+            written_batches[section_id] = section_written_batches
+
+        return buffer_metadata, written_batches
+
+    def write_section_data(self, section_id, batches):
+        """Write the section's batches which are not in its data file yet, to free slots. Returns the slot of each
+        batch.
+        """
+        previous_written_batches = self.written_batches.get(section_id, {})
+        section_written_batches = {}
+        new_batches = []
+        for batch in batches:
+            if id(batch) in section_written_batches:
+                continue  # Buffered and in the speed estimate
+            written_batch = previous_written_batches.get(id(batch))
+            if written_batch is not None and written_batch[1] is batch:
+                section_written_batches[id(batch)] = written_batch
+            else:
+                new_batches.append(batch)
+                section_written_batches[id(batch)] = (None, batch)
+
+        if not new_batches:
+            return section_written_batches
+
+        # A new data file when the batches do not fit in its slots (the previous one is removed once not referenced)
+        data_file = self.data_files.get(section_id)
+        batch_size = max([batch['batch-data'].size for batch in batches])
+        if data_file is None or batch_size > data_file["slot-size"]:
+            new_batches = batches
+            section_written_batches = {id(batch): (None, batch) for batch in batches}
+            data_file = self.create_data_file(section_id, 2 * len(batches) + self.interval, batch_size)
+            used_slots = set()
+        else:
+            used_slots = {slot for slot, _ in section_written_batches.values() if slot is not None} | \
+                self.committed_slots.get(section_id, set())
+
+        free_slots = [slot for slot in range(data_file["slots"]) if slot not in used_slots]
+        if len(free_slots) < len(new_batches):
+            self.grow_data_file(section_id, data_file["slots"] + len(new_batches) - len(free_slots))
+            free_slots = [slot for slot in range(data_file["slots"]) if slot not in used_slots]
+
+        for batch, slot in zip(new_batches, free_slots):
+            data_file["data"][slot, :batch['batch-data'].size] = batch['batch-data'].ravel()
+            section_written_batches[id(batch)] = (slot, batch)
+        data_file["data"].flush()
+        return section_written_batches
+
+    def create_data_file(self, section_id, slots, slot_size):
+        filename = f"buffer_{section_id}_{uuid4().hex[:8]}.dat"
+        data = np.memmap(os.path.join(self.checkpoint_path, filename), dtype="float64", mode="w+",
+                         shape=(slots, slot_size))
+        self.data_files[section_id] = {"filename": filename, "slots": slots, "slot-size": slot_size, "data": data}
+        self.committed_slots[section_id] = set()
+        return self.data_files[section_id]
+
+    def grow_data_file(self, section_id, slots):
+        """Double the data file's slots (at least 'slots'). Written slots are kept."""
+        data_file = self.data_files[section_id]
+        slots = max(slots, 2 * data_file["slots"])
+        fullpath = os.path.join(self.checkpoint_path, data_file["filename"])
+        data_file["data"].flush()
+        del data_file["data"]
+        with open(fullpath, "r+b") as file:
+            file.truncate(slots * data_file["slot-size"] * 8)
+        data_file.update({"slots": slots, "data": self.open_data_file(fullpath, slots, data_file["slot-size"])})
+
+    @staticmethod
+    def open_data_file(fullpath, slots, slot_size):
+        return np.memmap(fullpath, dtype="float64", mode="r+", shape=(slots, slot_size))
+
+    def remove_unused_data_files(self):
+        """Remove the data files which the last checkpoint does not reference."""
+        filenames = {data_file["filename"] for data_file in self.data_files.values()}
+        for filename in os.listdir(self.checkpoint_path):
+            if filename.startswith("buffer_") and filename.endswith(".dat") and filename not in filenames:
+                os.remove(os.path.join(self.checkpoint_path, filename))
+
+    @staticmethod
+    def to_json_type(value):
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+        raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+    # Resume
+    def exists(self):
+        return os.path.exists(self.metadata_fullpath)
+
+    def load(self):
+        with open(self.metadata_fullpath, "r") as file:
+            return json.load(file)
+
+    def restore(self, buffer_manager_rt, stream_file_manager=None, output_path=None):
+        """Restore the last checkpoint's state into a new 'BufferManagerRT' (and 'StreamFileManagerRT').
+        :param output_path: Output path of the HDF5 containers ('save-hdf5'), which are rewound to the checkpoint
+        :return: Timestamp of the last processed batch. Batches up to it must be skipped.
+        """
+        metadata = self.load()
+
+        for attribute in self.SECTION_STATE_ATTRIBUTES:
+            getattr(buffer_manager_rt, attribute).update(metadata.get(attribute, {}))
+        buffer_manager_rt.section_uuid_chunk.update(
+            {key: UUID(value) if value is not None else None for key, value in metadata["section-uuid-chunk"].items()})
+        for section_id, statistics_state in metadata.get("section-statistics", {}).items():
+            statistics = buffer_manager_rt.get_capture_statistics()
+            if statistics is not None and statistics_state is not None:
+                buffer_manager_rt.section_statistics[section_id] = statistics.restore_state(statistics_state)
+
+        # Data files are reopened, so the restored batches are not written again by the next checkpoint
+        self.data_files = {}
+        for section_id, data_file in metadata.get("data-files", {}).items():
+            fullpath = os.path.join(self.checkpoint_path, data_file["filename"])
+            self.data_files[section_id] = dict(data_file, data=self.open_data_file(fullpath, data_file["slots"],
+                                                                                   data_file["slot-size"]))
+        self.written_batches = {}
+
+        buffer_manager_rt.batch_buffer.update({key: [] for key in buffer_manager_rt.section_ids})
+        for batch_metadata in metadata["buffer"]:
+            section_id, slot, shape = batch_metadata["section-id"], batch_metadata.pop("slot"), \
+                batch_metadata.pop("shape")
+            data = self.data_files[section_id]["data"]
+            batch_metadata["batch-data"] = np.array(data[slot, :int(np.prod(shape))]).reshape(shape)
+            if "window-status" in batch_metadata:
+                batch_metadata["window-status"] = np.array(batch_metadata["window-status"], dtype=bool)
+            if "rms" in batch_metadata:
+                batch_metadata["rms"] = np.array(batch_metadata["rms"])
+            self.written_batches.setdefault(section_id, {})[id(batch_metadata)] = (slot, batch_metadata)
+
+            if batch_metadata.pop("speed-data", False):
+                section_speed_data = buffer_manager_rt.section_speed_data
+                if section_speed_data[section_id] is None:
+                    section_speed_data[section_id] = []
+                section_speed_data[section_id].append(batch_metadata)
+            else:
+                buffer_manager_rt.batch_buffer[section_id].append(batch_metadata)
+        self.committed_slots = {key: {slot for slot, _ in value.values()} for key, value in
+                                self.written_batches.items()}
+
+        if stream_file_manager is not None:
+            stream_file_manager.restore_state(metadata["stream-captures"])
+
+        if self.save_hdf5 and output_path is not None:
+            JsonFileManagerRT.rewind_hdf5(output_path, buffer_manager_rt.section_ids,
+                                          self.get_window_timestamp(metadata), metadata["saved-at"],
+                                          buffer_manager_rt.section_uuid_chunk, buffer_manager_rt.section_file_chunk)
+
+        active_section_ids = [key for key, value in metadata['batch_buffer_status_flags'].items() if value]
+        logger.info(f"Checkpoint restored (last-timestamp: {metadata['last-timestamp']}, "
+                    f"buffered batches: {len(metadata['buffer'])}, ACTIVE sections: {active_section_ids})")
+        return metadata["last-timestamp"]
+
+    # Getters
+    @staticmethod
+    def get_window_timestamp(metadata):
+        """Earliest timestamp of the checkpoint's captures: in-flight captures, and the buffered batches which
+        captures started after the checkpoint may include.
+        """
+        timestamps = [batch_metadata["initial-timestamp"] for batch_metadata in metadata["buffer"]]
+        timestamps += [value for value in metadata["section_initial_timestamp"].values() if value is not None]
+        if metadata["last-timestamp"] is not None:
+            timestamps.append(metadata["last-timestamp"])
+        return min(timestamps) if timestamps else None
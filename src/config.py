@@ -17,9 +17,12 @@ config = {
     "client": {
         "file-size-mb-list": [2, 2, 2],
         "save-binary": True,
+        "save-hdf5": False,  # If True, captures are appended to a '{section-id}.h5' file per day (overrides binary)
         "start-margin-time": 0,  # Time [s]
         "end-margin-time": 0,  # Time [s]
-        "total-time-max": 60  # Time [s]
+        "total-time-max": 60,  # Time [s]
+        "append-capture": False,  # If True, each capture is a single file where ACTIVE batches are appended
+        "trim-capture": False,  # If True, only the train rows (plus margins) of each capture's buffered data are kept
     },
 
     # TODO: Application's Parameters
@@ -28,10 +31,17 @@ config = {
     # Paths
     "path": {
         "data-dev": "../data/ETS",  # For debugging purposes
+        "data-prod": "../data",  # Interrogator's drop directory ('{year}/{month}/{day}' tree)
         "output-dev": "./test/output",
         "output-prod": "../output"
     },
 
+    # HDF5 Output Backend
+    "hdf5": {
+        "compression": "lzf",  # Dataset compression: None, "lzf" or "gzip"
+        "chunk-shape": (1024, 64),  # HDF5 chunk shape (temporal, spatial samples)
+    },
+
     # Signal Processor
     "signal": {
         "N": 1,  # int: Downsampling-Factor: Number of Samples to be downsampled
@@ -39,6 +49,7 @@ config = {
         "Wn": 0.8,  # int or list: Cutoff frequencies of Butterworth filter
         "btype": "hp",  # str: Butterworth filter type. {‘lowpass’, ‘highpass’, ‘bandpass’, ‘bandstop’}, optional
         "fs": 1000,  # int: The sampling frequency of the digital system in Hz.
+        "filter-mode": "filtfilt",  # str: "filtfilt" (zero-phase) or "lfilter" (single-pass, cheaper)
     },
 
     # Train Detector
@@ -46,6 +57,10 @@ config = {
         "spatial-window": 2,  # Number of adjacent samples to be considered as valid (mode 0)
         "validity-percentage": 0.05,  # Percentage of valid samples, expressed in decimal (from 0 to 1) (mode 1)
         "detection-threshold": 2,  # RMS Threshold value which marks a samples as valid (mode 0 or 1)
+        "sliding-window": False,  # If True, evaluate mode 1 on overlapping windows instead of the whole batch
+        "window-time": 1,  # Time [s] of each sliding window
+        "hop-time": 0.25,  # Time [s] between the start of consecutive sliding windows
+        "trim-window-time": 0.5,  # Time [s] of the moving average applied to rows' energy when trimming captures
     },
 
     # Params
@@ -59,7 +74,9 @@ config = {
         "section-limit": 10,  # Maximum number of sections
         "section-index-limit": 1000,  # Maximum upper index limit
         "total-time-max-limit": 300,  # Maximum time of the Maximum time established by the client [s]
-        "buffer-size-lower-limit": 4
+        "buffer-size-lower-limit": 4,
+        "write-block-size": pow(2, 20),  # Bytes of strain data encoded and written at once
+        "copy-section-batches": False,  # If True, buffers keep a copy of each section's data instead of a view
     },
 
     # TODO: Debugging Purpose Parameters
@@ -78,39 +95,173 @@ config = {
         "extent": None
     },
 
+    # Capture Statistics (header's "statistics" field)
+    "capture-statistics": {
+        "enabled": True,  # Accumulate each capture's summary statistics (peak RMS, energy envelope, channels...)
+        "max-envelope-points": 64,  # Maximum number of points of the energy envelope
+    },
+
+    # Adaptive Capture (capture length from the train's estimated speed, instead of the buffer's size)
+    "adaptive-capture": {
+        "enabled": False,  # If True, each capture ends when its train has passed the section (plus the end margin)
+        "train-length": 400,  # Space [m]. Assumed train length (longest expected)
+        "estimation-time": 20,  # Time [s] since the train's onset used to estimate its speed
+    },
+
+    # Speed Estimator (cross-correlation of the energy envelopes of adjacent channel groups)
+    "speed-estimator": {
+        "channel-groups": 8,  # Number of groups of adjacent channels of each section
+        "window-time": 0.05,  # Time [s] of each point of the energy envelopes
+        "edge-time": 0.5,  # Time [s] over which the envelopes' changes are measured
+        "speed-limits": (10, 400),  # Speed [Km / h]. Minimum and maximum speed estimated
+        "min-correlation": 0.3,  # Minimum mean correlation of a valid estimate
+    },
+
+    # Preview Pyramid (multi-resolution previews stored alongside captures)
+    "preview-pyramid": {
+        "save-preview": False,  # If True, save a '{filename}_preview.npz' file with each capture's file-chunk
+        "levels": [4, 16, 64],  # Decimation factors in time and space of each level
+        "reduction": "rms"  # Block reduction: "rms" or "peak" (min/max value with the highest magnitude)
+    },
+
+    # Decode Cache (decoded file-chunks of 'OutputDataLoader')
+    "decode-cache": {
+        "max-bytes": 512 * pow(2, 20),  # Maximum size [Bytes] of the decoded arrays kept in memory
+        "disk-cache-path": None  # If given, decoded arrays are also stored in this path as '.npy' files
+    },
+
+    # Plot Renderer (background PNG rendering)
+    "plot-renderer": {
+        "output-path": "./test/plots",
+        "queue-size": 4,  # Maximum number of chunks waiting to be rendered. Newer chunks are dropped when full
+        "dpi": 100,  # Dots per inch. Screen resolution is 'figsize' * 'dpi' [pixels]
+        "max-percentile-samples": 100000  # Number of samples used to approximate the colorbar limits
+    },
+
+    # Shared Memory Ingestion
+    "shared-memory": {
+        "slots": 8,  # Number of batch slots of the shared-memory ring
+    },
+
+    # Memory Governor
+    "memory-governor": {
+        "enabled": False,  # Account the buffered bytes and enforce a global memory ceiling
+        "max-bytes": 2 * pow(2, 30),  # Global ceiling [Bytes] (batch buffers + pending writes + prefetched data)
+        "policies": ["reduce-margins", "spill", "drop-oldest"],  # Degradation policies, applied in order
+        "spill-path": "./spill",  # Directory of the spilled batches (memory-mapped files)
+    },
+
+    # Kernels
+    "kernels": {
+        "backend": "auto",  # "numpy" (reference), "numba" (fused, parallel) or "auto" (numba when installed)
+    },
+
+    # Load Shedding
+    "load-shedding": {
+        "enabled": False,  # Track the lag and shed load when the pipeline falls behind
+        "policies": ["skip-plot", "cheap-filter", "reduce-resolution", "drop-idle"],  # Activated in order
+        "lag-threshold": 5,  # Time [s]. Lag above it increases the shedding level
+        "recovery-threshold": 1,  # Time [s]. Lag below it decreases the shedding level
+        "escalation-batches": 2,  # Consecutive batches above 'lag-threshold' to increase the level
+        "recovery-batches": 5,  # Consecutive batches below 'recovery-threshold' to decrease the level
+        "relative-lag": False,  # If True, lag is measured relative to the first batch's lag
+        "spatial-decimation": 2,  # Spatial decimation factor of 'reduce-resolution'
+    },
+
+    # Checkpoints
+    "checkpoint": {
+        "enabled": False,  # Save the buffer manager's state periodically, to resume after a restart
+        "path": "./checkpoint",  # Directory of the checkpoint files
+        "interval": 10,  # Number of batches between checkpoints
+        "resume": True,  # Production hooks ('get_buffer_manager') restore the last checkpoint at start ('-c' in dev)
+    },
+
+    # Profiling (off by default)
+    "profiling": {
+        "cprofile": False,  # Profile each stage with cProfile
+        "stages": ["loader", "filter", "detector", "buffer-manager", "writer"],  # Profiled stages
+        "tracemalloc-interval": 0,  # Number of batches between tracemalloc snapshots. 0: Disabled
+        "tracemalloc-frames": 1,  # Number of frames of each allocation's traceback
+        "top": 20,  # Number of functions and allocation sites in the report
+        "sort": "cumulative",  # cProfile's sort key ("cumulative", "tottime", "calls"...)
+        "path": "./profile",  # Directory of the summary report and the stages' '.prof' files
+    },
+
+    # ZMQ Capture Service
+    "zmq": {
+        "ingest-endpoint": "tcp://*:5555",  # PULL socket receiving the strain batches
+        "publish-endpoint": "tcp://*:5556",  # PUB socket publishing the generated chunks
+        "rcv-hwm": 10,  # Maximum number of batches queued in the ingest socket (backpressure)
+        "snd-hwm": 100,  # Maximum number of chunks queued per subscriber. Newer chunks are dropped when full
+        "publish": True,  # Publish the generated chunks
+        "save": True,  # Save the generated chunks
+        "lag-report-interval": 10,  # Number of batches between lag reports
+    },
+
+    # Multi-Stream Mode (several fibers / interrogators in one process)
+    "multi-stream": {
+        "workers": 4,  # Threads processing the streams' batches (detection and buffering)
+        "writer-workers": 2,  # Threads writing the streams' chunks
+        "queue-size": 4,  # Maximum number of batches (and chunks awaiting write) queued per stream
+        "streams": {  # Each stream's data path (None: the environment's data path), section map and file sizes
+            "F01": {
+                "data-path": None,
+                "section-map": {"S01": (0, 110), "S02": (100, 200)},
+                "file-size-mb-list": [2, 2],
+            },
+            "F02": {
+                "data-path": None,
+                "section-map": {"S01": (200, 300)},
+                "file-size-mb-list": [2],
+            },
+        },
+    },
+
     # Batch Data Generator
     "batch-data-generator": {
         "max-files": 3,
-        "waiting-time": 0.05
+        "waiting-time": 0.05,  # Time [s] between batches (real-time simulation)
+        "replay": False,  # If True, skip 'waiting-time' and process batches as fast as possible
+        "filename-timestamp-format": None,  # e.g. "%Y%m%d_%H%M%S". If None, file's modification time is used
+        "fixed-batch-shape": False,  # If True, re-batch files into batches of exactly 'batch-shape' rows
+        "follow": False,  # If True, walk the '{year}/{month}/{day}' data tree and keep watching for new files
+        "poll-interval": 0.5,  # Time [s] between scans of the watched day directories (follow mode)
+        "settle-time": 2,  # Time [s] without modifications for a file to be considered complete (follow mode)
     }
 }
 
 
 # -----------------------------------------------------------------------------------------------------------------
 
-def validate_section_limit():
+def validate_section_limit(config=config):
     section_ids = list(config['section-map'].keys())
     section_limit = config['params']['section-limit']
     if len(section_ids) > section_limit:
         raise ValueError(f"The number of sections defined should not be higher than {section_limit}")
 
 
-def validate_section_index_limit():
+def validate_section_index_limit(config=config):
     section_index_limit = config['params']['section-index-limit']
     section_upper_limits = [value[1] for key, value in config['section-map'].items()]
     if len(list(filter(lambda x: x >= section_index_limit, section_upper_limits))) > 0:
         raise ValueError(f"The upper limit of any section index, should not be higher than {section_index_limit}")
 
 
-def validate_total_time_max():
+def validate_total_time_max(config=config):
     total_time_max = config['client']['total-time-max']
     total_time_max_limit = config['params']['total-time-max-limit']
     if total_time_max > total_time_max_limit:
         raise ValueError(f"Total time max should not be higher than {total_time_max_limit}")
 
 
-def get_config():
-    validate_section_limit()
-    validate_section_index_limit()
-    validate_total_time_max()
+def validate_config(config=config):
+    """Validates the global configuration, or a copy of it (e.g. each stream's configuration in multi-stream mode)."""
+    validate_section_limit(config)
+    validate_section_index_limit(config)
+    validate_total_time_max(config)
+
+
+def get_config(validate=True):
+    if validate:
+        validate_config()
     return config
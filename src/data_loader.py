@@ -1,11 +1,9 @@
 import os
 import json
 import numpy as np
-from dotenv import load_dotenv
 
 from src.logger import load_logger
 
-load_dotenv()
 logger = load_logger(__name__)
 
 
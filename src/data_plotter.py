@@ -1,10 +1,7 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from dotenv import load_dotenv
 
 from src.logger import load_logger
 
-load_dotenv()
 logger = load_logger(__name__)
 
 
@@ -23,21 +20,47 @@ class DataPlotter:
 
         # self.plot_matrix()
 
-    def plot_matrix(self):
+    @staticmethod
+    def get_color_limits(data, max_samples=None):
+        """vmin and vmax corresponds to the 2nd and 98th percentile of the data.
+        If max_samples is given, percentiles are approximated with an evenly strided subsample of the data.
+        """
+        samples = data.ravel()
+        if max_samples is not None and samples.size > max_samples:
+            samples = samples[::int(np.ceil(samples.size / max_samples))]
+        vmin, vmax = np.percentile(samples, [2, 98])
+        return vmin, vmax
+
+    @staticmethod
+    def minmax_decimate(data, target_length, axis=0):
+        """Reduce data along axis to about target_length samples, keeping the minimum and maximum of each block so
+        that peaks are preserved. Trailing samples which do not fill a complete block are discarded.
+        """
+        data = np.moveaxis(data, axis, 0)
+        block_length = int(np.ceil(2 * data.shape[0] / target_length))
+        if block_length <= 2:
+            return np.moveaxis(data, 0, axis)
+
+        number_of_blocks = data.shape[0] // block_length
+        blocks = data[:number_of_blocks * block_length].reshape((number_of_blocks, block_length) + data.shape[1:])
+
+        decimated_data = np.empty((2 * number_of_blocks,) + data.shape[1:], dtype=data.dtype)
+        decimated_data[0::2] = blocks.min(axis=1)
+        decimated_data[1::2] = blocks.max(axis=1)
+        return np.moveaxis(decimated_data, 0, axis)
+
+    def set_defaults(self):
         # ---- Set default colorbar limits:
-        # vmin and vmax corresponds to the 2nd and 98th percentile of the data:
-        if self.vmin is None:
-            self.vmin = np.percentile(self.data, 2)
-        if self.vmax is None:
-            self.vmax = np.percentile(self.data, 98)
+        if self.vmin is None or self.vmax is None:
+            vmin, vmax = self.get_color_limits(self.data)
+            self.vmin = vmin if self.vmin is None else self.vmin
+            self.vmax = vmax if self.vmax is None else self.vmax
 
         # ---- Set default figure size:
         if self.figsize is None:
             self.figsize = (19.2, 9.83)
 
-        # ---- Plot figure:
-        fig, ax = plt.subplots(1, 1, figsize=self.figsize)
-
+    def draw_matrix(self, fig, ax):
         img = ax.imshow(
             self.data,
             aspect="auto",
@@ -54,10 +77,34 @@ class DataPlotter:
         ax.set_title(self.title)
         fig.colorbar(img)
         fig.tight_layout()
+
+    def plot_matrix(self):
+        import matplotlib.pyplot as plt  # Imported only when plotting (slow import)
+
+        self.set_defaults()
+
+        # ---- Plot figure:
+        fig, ax = plt.subplots(1, 1, figsize=self.figsize)
+        self.draw_matrix(fig, ax)
         plt.show()
 
         self.fig = fig
 
+    def save_matrix(self, fullpath, dpi=100):
+        """Render the figure off-screen (Agg) and save it as an image, without using pyplot's global state, so it
+        can be called from a background thread.
+        """
+        from matplotlib.figure import Figure
+
+        self.set_defaults()
+
+        fig = Figure(figsize=self.figsize)
+        ax = fig.add_subplot(1, 1, 1)
+        self.draw_matrix(fig, ax)
+        fig.savefig(fullpath, dpi=dpi)
+
+        self.fig = fig
+
     # Getters & Setters
     def get_title(self):
         return self.title
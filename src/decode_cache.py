@@ -0,0 +1,127 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class DecodeCache:
+    def __init__(self, **config):
+        """
+        Bounded in-process LRU cache of decoded arrays, keyed by file path and modification time, so a file which is
+        rewritten is decoded again. Least recently used arrays are evicted when 'max-bytes' is exceeded.
+        Optionally, decoded arrays are also stored as '.npy' files in 'disk-cache-path', which survives the process.
+        Cached arrays are read-only.
+        """
+        self.max_bytes = config['decode-cache']['max-bytes']
+        self.disk_cache_path = config['decode-cache']['disk-cache-path']
+
+        self.entries = OrderedDict()
+        self.current_bytes = 0
+        self.lock = threading.Lock()
+
+        # Statistics
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def get_key(fullpath, variant=""):
+        return os.path.abspath(fullpath), os.stat(fullpath).st_mtime_ns, variant
+
+    def get_disk_cache_fullpath(self, key):
+        key_hash = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_cache_path, f"{key_hash}.npy")
+
+    def get(self, fullpath, decoder, variant=""):
+        """
+        Get the decoded array of a file, calling 'decoder()' only when it is not cached.
+        :param fullpath: Path of the encoded file
+        :param decoder: Function without arguments which returns the decoded array
+        :param variant: Distinguishes different decoded arrays of the same file (e.g. a preview level)
+        """
+        key = self.get_key(fullpath, variant)
+
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        array = self.load_from_disk(key)
+        if array is None:
+            with self.lock:
+                self.misses += 1
+            array = decoder()
+            self.save_to_disk(key, array)
+
+        array.flags.writeable = False
+        self.put(key, array)
+        return array
+
+    def put(self, key, array):
+        if array.nbytes > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = array
+            self.current_bytes += array.nbytes
+
+            while self.current_bytes > self.max_bytes:
+                _, evicted_array = self.entries.popitem(last=False)
+                self.current_bytes -= evicted_array.nbytes
+                self.evictions += 1
+
+    def load_from_disk(self, key):
+        if self.disk_cache_path is None:
+            return None
+
+        disk_cache_fullpath = self.get_disk_cache_fullpath(key)
+        if not os.path.exists(disk_cache_fullpath):
+            return None
+
+        with self.lock:
+            self.disk_hits += 1
+        return np.load(disk_cache_fullpath)
+
+    def save_to_disk(self, key, array):
+        if self.disk_cache_path is None:
+            return
+
+        if not os.path.isdir(self.disk_cache_path):
+            os.makedirs(self.disk_cache_path)
+
+        # Write and rename, so a partially written file is never loaded
+        disk_cache_fullpath = self.get_disk_cache_fullpath(key)
+        temporal_fullpath = f"{disk_cache_fullpath}.{os.getpid()}.tmp"
+        with open(temporal_fullpath, "wb") as file:
+            np.save(file, array)
+        os.replace(temporal_fullpath, disk_cache_fullpath)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.current_bytes = 0
+
+    # Getters
+    def get_stats(self):
+        with self.lock:
+            requests = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk-hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit-ratio": (self.hits + self.disk_hits) / requests if requests else 0,
+                "entries": len(self.entries),
+                "current-bytes": self.current_bytes,
+                "max-bytes": self.max_bytes
+            }
@@ -3,17 +3,14 @@ import json
 import base64
 import struct
 import asyncio
-import traceback
 import numpy as np
 from datetime import datetime
 
 from uuid import uuid4
-from dotenv import load_dotenv
 
 from src.schema import json_schema
 from src.logger import load_logger
 
-load_dotenv()
 logger = load_logger(__name__)
 
 
@@ -201,5 +198,4 @@ class JsonFileManager:
                     await self.serialize()
 
             except Exception as e:
-                logger.error(f"JSON SERIALIZATION ERROR: {e}")
-                print(traceback.format_exc())
+                logger.error(f"JSON SERIALIZATION ERROR: {e}", exc_info=True)
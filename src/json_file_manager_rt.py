@@ -1,17 +1,17 @@
 import os
 import json
+import time
 import base64
 import struct
 import asyncio
-import traceback
 import numpy as np
 from datetime import datetime
-from dotenv import load_dotenv
 
-from src.schema import json_schema
+from src.schema import get_json_schema
+from src.preview_pyramid import PreviewPyramid
+from src.kernels import NumpyKernels, get_kernels
 from src.logger import load_logger
 
-load_dotenv()
 logger = load_logger(__name__)
 
 
@@ -21,6 +21,8 @@ class JsonFileManagerRT:
         self.output_path = output_path
         self.json_fullpath = None
         self.binary_fullpath = None
+        self.hdf5_fullpath = None
+        self.preview_fullpath = None
         self.output_day_path = None
         self.filename = None
 
@@ -28,22 +30,30 @@ class JsonFileManagerRT:
         self.section_id = chunk["section-id"]
         self.uuid = chunk["uuid"]
         self.initial_timestamp = chunk["initial-timestamp"]
+        self.sample_offset = chunk["sample-offset"]
         self.file_chunk = chunk["file-chunk"]
         self.train_data = chunk["train-data"]
+        self.statistics = chunk.get("statistics")  # Capture's statistics up to this chunk ('CaptureStatistics')
         self.temporal_samples = self.train_data.shape[0]
         self.spatial_samples = self.train_data.shape[1]
 
         # Config
         self.config = config
-        self.spatial_resolution = config["params"]["spatial-resolution"]
+        self.spatial_resolution = chunk.get("spatial-resolution", config["params"]["spatial-resolution"])
         self.save_binary = config["client"]["save-binary"]
+        self.save_hdf5 = config["client"]["save-hdf5"]
+        self.hdf5_compression = config["hdf5"]["compression"]
+        self.hdf5_chunk_shape = config["hdf5"]["chunk-shape"]
         self.fs = config["signal"]["fs"]
+        self.save_preview = config["preview-pyramid"]["save-preview"]
+        self.write_block_size = config["params"]["write-block-size"]  # Bytes
+        self.kernels = get_kernels(**config)
 
         # Signal
         self.dt = 1 / self.fs
 
-        # JSON schema
-        self.json_schema = json_schema
+        # JSON schema (header of this capture's file-chunk)
+        self.json_schema = get_json_schema()
 
         # Run File Handler
         if not os.environ['ENVIRONMENT'] == 'dev':
@@ -55,16 +65,119 @@ class JsonFileManagerRT:
             asyncio.run(self.file_handler())
 
     # SERIALIZE JSON
-    async def serialize(self):
-        with open(self.json_fullpath, "w", encoding="utf-8") as file:
-            json.dump(self.json_schema, file, indent=4)
+    async def serialize(self, matrix):
+        """Writes the JSON header and streams the base64 strain data in blocks, so the whole base64 string is never
+        materialized in memory.
+        """
+        with open(self.json_fullpath, "w", encoding="ascii") as file:
+            file.write('{"info": ')
+            json.dump(self.json_schema['info'], file)
+            file.write(', "strain": "')
+            for base64_block in self.iter_base64_blocks(matrix, self.write_block_size, kernels=self.kernels):
+                file.write(base64_block)
+            file.write('"}')
 
     async def serialize_bytes(self, matrix):
         with open(self.binary_fullpath, "wb") as file:
             json_bytearray = json.dumps(self.json_schema).encode('ascii')
             file.write(struct.pack('<H', len(json_bytearray)))
             file.write(json_bytearray)
-            np.save(file, matrix.astype(np.float16))
+            np.lib.format.write_array_header_1_0(
+                file, {'descr': '<f2', 'fortran_order': False, 'shape': matrix.shape})
+            for float16_block in self.iter_float16_blocks(matrix, self.write_block_size, kernels=self.kernels):
+                file.write(float16_block)
+
+    async def serialize_hdf5(self, matrix):
+        """
+        Appends the file-chunk to its capture in the day's HDF5 container of the section ('{section-id}.h5').
+        Layout of each capture (group named by uuid):
+            "/{uuid}/strain": Chunked (and optionally compressed) dataset of float16 (temporal, spatial samples).
+                              Successive file-chunks are appended along the temporal axis.
+            "/{uuid}/parts":  Index of the appended file-chunks. Rows: (file_chunk, first_row, temporal_samples,
+                              sample_offset).
+            "/{uuid}" attributes: JSON schema's "info" fields ("temporal_samples" is the total of the capture, and
+                                  "statistics" is stored as a JSON string), and "created_at" (time of the capture's
+                                  first write, see 'rewind_hdf5').
+        """
+        import h5py
+
+        with h5py.File(self.hdf5_fullpath, "a") as file:
+            group = file.require_group(str(self.uuid))
+
+            if "strain" not in group:
+                chunk_shape = (self.hdf5_chunk_shape[0], min(self.hdf5_chunk_shape[1], self.spatial_samples))
+                group.create_dataset("strain", shape=(0, self.spatial_samples), maxshape=(None, self.spatial_samples),
+                                     dtype='<f2', chunks=chunk_shape, compression=self.hdf5_compression)
+                group.create_dataset("parts", shape=(0, 4), maxshape=(None, 4), dtype='<i8', chunks=True)
+                group.attrs["created_at"] = time.time()
+
+            # Append strain data
+            strain = group["strain"]
+            first_row = strain.shape[0]
+            strain.resize(first_row + matrix.shape[0], axis=0)
+            block_rows = max(1, self.write_block_size // (2 * matrix.shape[1]))
+            for i_row in range(0, matrix.shape[0], block_rows):
+                block = matrix[i_row: i_row + block_rows, :]
+                strain[first_row + i_row: first_row + i_row + block.shape[0], :] = block.astype('<f2')
+
+            # Update parts index
+            parts = group["parts"]
+            parts.resize(parts.shape[0] + 1, axis=0)
+            parts[-1] = (self.file_chunk, first_row, matrix.shape[0], self.sample_offset)
+
+            # Update header attributes
+            info = dict(self.json_schema['info'], temporal_samples=strain.shape[0])
+            if info['statistics'] is not None:
+                info['statistics'] = json.dumps(info['statistics'])
+            group.attrs.update({key: value for key, value in info.items() if value is not None})
+
+    @staticmethod
+    def rewind_hdf5(output_path, section_ids, window_timestamp, saved_at, section_uuid_chunk, section_file_chunk):
+        """
+        Rewind the sections' HDF5 containers to a checkpoint (see 'CheckpointManager'), since the data written after
+        it is written again when the following batches are processed: the file-chunks of the in-flight captures
+        written after it are removed, and so are the captures created after it.
+        Only the day directories from 'window_timestamp' (the checkpoint's earliest capture timestamp) are scanned.
+        :param saved_at: Time of the checkpoint
+        :param section_uuid_chunk: uuid of each section's in-flight capture (or None)
+        :param section_file_chunk: Last file-chunk of each section's in-flight capture
+        """
+        import h5py
+
+        if window_timestamp is None or not os.path.isdir(output_path):
+            return
+
+        window_day_path = JsonFileManagerRT.get_output_day_path(output_path, window_timestamp)
+        day_paths = [root for root, _, _ in os.walk(output_path) if
+                     len(os.path.relpath(root, output_path).split(os.sep)) == 3 and root >= window_day_path]
+        for day_path in sorted(day_paths):
+            for section_id in section_ids:
+                fullpath = os.path.join(day_path, f"{section_id}.h5")
+                if not os.path.isfile(fullpath):
+                    continue
+
+                with h5py.File(fullpath, "a") as file:
+                    for uuid in list(file.keys()):
+                        group = file[uuid]
+                        if group.attrs.get("created_at", 0) > saved_at:
+                            del file[uuid]
+                            logger.info(f"Capture {uuid} written after the checkpoint removed from '{fullpath}'")
+                        elif uuid == str(section_uuid_chunk.get(section_id)):
+                            JsonFileManagerRT.truncate_hdf5_capture(group, section_file_chunk[section_id])
+
+    @staticmethod
+    def truncate_hdf5_capture(group, file_chunk):
+        """Remove the capture's file-chunks after 'file_chunk'."""
+        parts = group["parts"]
+        kept_parts = int(np.count_nonzero(parts[:, 0] <= file_chunk))
+        if kept_parts == parts.shape[0]:
+            return
+
+        first_row = int(parts[kept_parts, 1])
+        group["strain"].resize(first_row, axis=0)
+        parts.resize(kept_parts, axis=0)
+        group.attrs["temporal_samples"] = first_row
+        logger.info(f"Capture {group.name} rewound to file-chunk {file_chunk} ({first_row} temporal samples)")
 
     async def update_json_schema(self):
         """
@@ -78,9 +191,11 @@ class JsonFileManagerRT:
                 "temporal_samples",
                 "spatial_samples",
                 "initial_timestamp",
+                "sample_offset",
                 "zone_ID",
                 "file_chunk",
-                "total_chunks"
+                "total_chunks",
+                "statistics"
             }
             "strain": ""
 
@@ -94,24 +209,50 @@ class JsonFileManagerRT:
                 "temporal_samples": self.temporal_samples,
                 "spatial_samples": self.spatial_samples,
                 "initial_timestamp": self.initial_timestamp,
+                "sample_offset": self.sample_offset,
                 "zone_ID": self.section_id,
-                "file_chunk": self.file_chunk
+                "file_chunk": self.file_chunk,
+                "statistics": self.statistics
             }
         )
 
     # STRING DATA CONVERSION
     @staticmethod
-    async def matrix_to_base64_string(my_matrix):
+    def iter_float16_blocks(matrix, block_size, rows_multiple=1, kernels=NumpyKernels):
+        """Yields the matrix as little-endian float16 bytes (row-major), in blocks of about 'block_size' bytes.
+        Each block contains a number of rows multiple of 'rows_multiple'.
+        """
+        row_size = 2 * matrix.shape[1]
+        block_rows = max(rows_multiple, (block_size // row_size) // rows_multiple * rows_multiple)
 
-        float_encoding = 'e'
-        my_bytearray = bytearray()
+        for i_row in range(0, matrix.shape[0], block_rows):
+            yield kernels.float16_bytes(matrix[i_row: i_row + block_rows, :])
 
-        for i_row in range(my_matrix.shape[0]):
-            for i_col in range(my_matrix.shape[1]):
-                my_bytearray += bytearray(struct.pack("<%s" % float_encoding, my_matrix[i_row, i_col]))
-        my_bytearray_base64_encoded = base64.b64encode(my_bytearray)
+    @staticmethod
+    def iter_base64_blocks(matrix, block_size, kernels=NumpyKernels):
+        """Yields the base64 encoding of the matrix as little-endian float16, in blocks of about 'block_size' bytes.
+        Blocks contain a multiple of 3 rows (a multiple of 3 bytes), so they can be encoded independently and
+        concatenated without padding characters in between.
+        """
+        for float16_block in JsonFileManagerRT.iter_float16_blocks(matrix, block_size, rows_multiple=3,
+                                                                   kernels=kernels):
+            yield base64.b64encode(float16_block).decode('ascii')
+
+    @staticmethod
+    async def matrix_to_base64_string(my_matrix):
+        return "".join(JsonFileManagerRT.iter_base64_blocks(my_matrix, pow(2, 20)))
+
+    @staticmethod
+    def get_output_day_path(output_path, initial_timestamp):
+        initial_datetime = datetime.fromtimestamp(initial_timestamp)
+        return os.path.join(output_path, str(initial_datetime.year), f"{initial_datetime.month:02d}",
+                            f"{initial_datetime.day:02d}")
 
-        return my_bytearray_base64_encoded.decode('ascii')
+    @staticmethod
+    def get_filename(initial_timestamp, section_id, file_chunk):
+        initial_datetime = datetime.fromtimestamp(initial_timestamp)
+        return (f"{initial_datetime.hour:02d}_{initial_datetime.minute:02d}_{initial_datetime.second:02d}_{section_id}"
+                f"_part_{file_chunk:02d}")
 
     def make_output_dirs(self):
         # Exterior Data Path
@@ -119,11 +260,7 @@ class JsonFileManagerRT:
             os.makedirs(self.output_path)
 
         # Get actual year, month and day
-        initial_datetime = datetime.fromtimestamp(self.initial_timestamp)
-
-        self.output_day_path = os.path.join(self.output_path, str(initial_datetime.year),
-                                            f"{initial_datetime.month:02d}",
-                                            f"{initial_datetime.day:02d}")
+        self.output_day_path = self.get_output_day_path(self.output_path, self.initial_timestamp)
 
         logger.debug(f"Saving data in path: {self.output_day_path}")
 
@@ -131,40 +268,41 @@ class JsonFileManagerRT:
             os.makedirs(self.output_day_path)
 
     def get_fullpath(self):
-        initial_datetime = datetime.fromtimestamp(self.initial_timestamp)
-
-        filename = (
-            f"{initial_datetime.hour:02d}_{initial_datetime.minute:02d}_{initial_datetime.second:02d}_{self.section_id}"
-            f"_part_{self.file_chunk:02d}")
+        filename = self.get_filename(self.initial_timestamp, self.section_id, self.file_chunk)
 
         logger.info(f"Saving data as filename: {filename}")
         self.json_fullpath = os.path.join(self.output_day_path, f"{filename}.json")
         self.binary_fullpath = os.path.join(self.output_day_path, f"{filename}.bin")
+        self.hdf5_fullpath = os.path.join(self.output_day_path, f"{self.section_id}.h5")
+        self.preview_fullpath = os.path.join(self.output_day_path, f"{filename}_preview.npz")
 
     async def file_handler(self):
         try:
             # Update JSON
             await self.update_json_schema()
 
-            # Convert data to base64
-            train_data_base64 = await self.matrix_to_base64_string(self.train_data)
-
             # Make output dirs and get full paths
             self.make_output_dirs()
             self.get_fullpath()
 
             # Save JSON schema
-            if self.save_binary:
+            if self.save_hdf5:
+                logger.debug(f"Appending file-chunk {self.file_chunk} to HDF5 (.h5) file '{self.hdf5_fullpath}'")
+                await self.serialize_hdf5(self.train_data)
+            elif self.save_binary:
                 logger.debug(f"Saving binary (.bin) file {self.filename} in path '{self.binary_fullpath}'")
                 await self.serialize_bytes(self.train_data)
             else:
                 logger.debug(f"Saving JSON (.json) file {self.filename} in path '{self.json_fullpath}'")
-                self.json_schema.update({"strain": train_data_base64})
-                await self.serialize()
+                await self.serialize(self.train_data)
+
+            # Save multi-resolution previews
+            if self.save_preview:
+                logger.debug(f"Saving previews (.npz) file in path '{self.preview_fullpath}'")
+                PreviewPyramid(self.train_data, **self.config).save(self.preview_fullpath)
 
             return True
 
         except Exception as e:
-            logger.error(f"SERIALIZATION ERROR: {e}")
-            print(traceback.format_exc())
+            logger.error(f"SERIALIZATION ERROR: {e}", exc_info=True)
             return False
@@ -0,0 +1,79 @@
+import numpy as np
+
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class NumpyKernels:
+    """Reference implementation of the per-batch kernels."""
+    name = "numpy"
+
+    @staticmethod
+    def movmean_downsample(data, N):
+        """Mean of each block of N temporal samples (the last block may be shorter)."""
+        temporal_length, spatial_length = data.shape
+        new_temporal_length = len(np.arange(0, temporal_length, N))
+        reduced_data = np.empty([new_temporal_length, spatial_length])
+
+        count = 0
+        for i in range(0, temporal_length, N):
+            start = i
+            end = min(i + N, temporal_length)
+            reduced_data[count, :] = np.mean(data[start:end, :], axis=0)
+            count = count + 1
+
+        return reduced_data
+
+    @staticmethod
+    def rms(section):
+        """RMS of each channel (column)."""
+        return np.sqrt(np.mean(section ** 2, axis=0))
+
+    @staticmethod
+    def count_above(values, threshold):
+        """Number of values greater or equal than the threshold."""
+        return int(np.count_nonzero(values >= threshold))
+
+    @staticmethod
+    def float16_bytes(matrix):
+        """Little-endian float16 bytes of the matrix (row-major)."""
+        return matrix.astype('<f2').tobytes()
+
+
+# Kernels selected for each backend
+kernels_cache = {}
+
+
+def get_kernels(**config):
+    """
+    Kernels of the configured backend ('kernels' config):
+        "numpy": Reference kernels.
+        "numba": Fused, parallel kernels ('src.numba_kernels'). Falls back to "numpy" if Numba is not installed.
+        "auto":  "numba" when Numba is importable, "numpy" otherwise.
+    Numba kernels are verified against the reference by 'tests/test_kernels.py', and warmed up by the thread which
+    loads them ('NumbaKernels.warm_up').
+    """
+    backend = config['kernels']['backend']
+    if backend not in kernels_cache:
+        kernels_cache[backend] = load_kernels(backend)
+    return kernels_cache[backend]
+
+
+def load_kernels(backend):
+    if backend not in ("numpy", "numba", "auto"):
+        raise ValueError(f"Unknown kernels backend '{backend}'. Valid backends: 'numpy', 'numba' or 'auto'")
+
+    if backend == "numpy":
+        return NumpyKernels
+
+    try:
+        from src.numba_kernels import NumbaKernels
+    except ImportError:
+        if backend == "numba":
+            logger.warning("Numba is not installed. Using NumPy kernels.")
+        return NumpyKernels
+
+    NumbaKernels.warm_up()
+    logger.info("Using Numba kernels.")
+    return NumbaKernels
@@ -0,0 +1,136 @@
+import time
+
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class LoadShedder:
+    POLICIES = ("skip-plot", "cheap-filter", "reduce-resolution", "drop-idle")
+
+    def __init__(self, **config):
+        """
+        Tracks the pipeline's lag (time between the end of a batch's acquisition and the end of its processing), and
+        sheds load when the pipeline falls behind. Shedding 'level' is the number of active 'policies' (in order):
+            skip-plot:         Chunks are not plotted nor rendered.
+            cheap-filter:      'SignalProcessor' uses a single-pass filter ('lfilter') instead of 'filtfilt'.
+            reduce-resolution: New captures are written with 1 of each 'spatial-decimation' spatial samples.
+            drop-idle:         INACTIVE sections without trains only buffer the start margin's batches.
+        The level is increased after 'escalation-batches' consecutive batches with lag above 'lag-threshold', and
+        decreased after 'recovery-batches' consecutive batches with lag below 'recovery-threshold' (hysteresis).
+        'cheap-filter' updates the shared "signal" config section, which is read by each new 'SignalProcessor'.
+        """
+        self.config = config
+        self.policies = config['load-shedding']['policies']
+        self.lag_threshold = config['load-shedding']['lag-threshold']  # Time [s]
+        self.recovery_threshold = config['load-shedding']['recovery-threshold']  # Time [s]
+        self.escalation_batches = config['load-shedding']['escalation-batches']
+        self.recovery_batches = config['load-shedding']['recovery-batches']
+        self.relative_lag = config['load-shedding']['relative-lag']
+        self.spatial_decimation = config['load-shedding']['spatial-decimation']
+        self.spatial_resolution = config['params']['spatial-resolution']
+        self.default_filter_mode = config['signal']['filter-mode']
+        self.validate_policies()
+
+        # Signal Config
+        self.dt = config['signal']['N'] * (1 / config['signal']['fs'])  # Time [s]
+
+        # State
+        self.level = 0
+        self.escalation_count = 0
+        self.recovery_count = 0
+        self.baseline_lag = None
+        self.reduced_captures = {}  # Whether each open capture (section-id, uuid) is written at reduced resolution
+
+        # Metrics
+        self.lag = 0
+        self.max_lag = 0
+        self.processed_batches = 0
+        self.shed_batches = 0  # Batches processed with any policy active
+
+    def validate_policies(self):
+        unknown_policies = [policy for policy in self.policies if policy not in self.POLICIES]
+        if unknown_policies:
+            raise ValueError(f"Unknown load-shedding policies {unknown_policies}. Valid policies: {self.POLICIES}")
+
+    def update(self, batch_length, initial_timestamp, buffer_manager_rt=None):
+        """Call once per batch, when its processing has been completed. Returns the shedding level.
+        :param batch_length: Number of temporal samples of the batch
+        :param initial_timestamp: Acquisition timestamp of the batch's first row
+        :param buffer_manager_rt: 'BufferManagerRT' where 'drop-idle' is applied
+        """
+        lag = time.time() - (initial_timestamp + batch_length * self.dt)
+        if self.relative_lag:
+            # Lag growth since the first batch (ignores constant offsets, e.g. clocks or historical data)
+            self.baseline_lag = lag if self.baseline_lag is None else self.baseline_lag
+            lag -= self.baseline_lag
+
+        self.lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self.processed_batches += 1
+        self.shed_batches += 1 if self.level else 0
+
+        if lag > self.lag_threshold:
+            self.recovery_count = 0
+            self.escalation_count += 1
+            if self.escalation_count >= self.escalation_batches and self.level < len(self.policies):
+                self.level += 1
+                self.escalation_count = 0
+                logger.warning(f"LOAD SHEDDING :: lag: {round(lag, 3)} s. Activating '{self.policies[self.level - 1]}' "
+                               f"(level {self.level}/{len(self.policies)})")
+        elif lag < self.recovery_threshold:
+            self.escalation_count = 0
+            self.recovery_count += 1
+            if self.recovery_count >= self.recovery_batches and self.level > 0:
+                self.level -= 1
+                self.recovery_count = 0
+                logger.info(f"LOAD SHEDDING :: lag: {round(lag, 3)} s. Deactivating '{self.policies[self.level]}' "
+                            f"(level {self.level}/{len(self.policies)})")
+        else:
+            self.escalation_count = 0
+            self.recovery_count = 0
+
+        self.apply(buffer_manager_rt)
+        return self.level
+
+    def is_active(self, policy):
+        return policy in self.policies[:self.level]
+
+    def apply(self, buffer_manager_rt=None):
+        self.config['signal']['filter-mode'] = 'lfilter' if self.is_active('cheap-filter') else \
+            self.default_filter_mode
+        if buffer_manager_rt is not None:
+            buffer_manager_rt.drop_idle_batches = self.is_active('drop-idle')
+
+    def reduce_chunk(self, chunk):
+        """
+        Decimates the chunk's spatial samples when 'reduce-resolution' was active at the capture's first chunk.
+        The decision is kept for the whole capture, so every chunk of a capture has the same spatial samples.
+        """
+        key = (chunk['section-id'], chunk['uuid'])
+        if chunk['file-chunk'] == 0 and chunk.get('stream-state') in (None, 'open'):
+            self.reduced_captures[key] = self.is_active('reduce-resolution')
+
+        reduced = self.reduced_captures.get(key, False)
+        if chunk['complete']:
+            self.reduced_captures.pop(key, None)
+
+        if reduced:
+            chunk.update(
+                {
+                    "train-data": chunk['train-data'][:, ::self.spatial_decimation],
+                    "spatial-resolution": self.spatial_resolution * self.spatial_decimation
+                }
+            )
+        return chunk
+
+    # Getters
+    def get_metrics(self):
+        return {
+            "lag": self.lag,
+            "max-lag": self.max_lag,
+            "level": self.level,
+            "active-policies": self.policies[:self.level],
+            "processed-batches": self.processed_batches,
+            "shed-batches": self.shed_batches
+        }
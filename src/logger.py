@@ -1,15 +1,127 @@
 import os
+import time
+import queue
+import atexit
 import logging
+import threading
+import logging.handlers
+from dotenv import load_dotenv
 
+# Environment variables ('.env') are loaded once, by the first module which imports the logger
+load_dotenv()
 
-def load_logger(name, filelog=False):
-    logger = logging.getLogger(name)
-    logger.propagate = False
+# Queue logging ('LOG_QUEUE'): records are formatted and written by a background thread
+queue_listeners = {}
+queue_handlers = []
+queue_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, interval):
+        """
+        Emits at most one DEBUG/INFO record every 'interval' seconds per call site (file and line), so repetitive
+        per-batch messages do not flood the log. Warnings and errors are never filtered.
+        The next emitted record of a call site reports how many records were suppressed.
+        """
+        super().__init__()
+        self.interval = interval
+        self.last_emitted = {}
+        self.suppressed = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            last_emitted = self.last_emitted.get(key)
+            if last_emitted is not None and now - last_emitted < self.interval:
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                return False
+
+            self.last_emitted[key] = now
+            suppressed = self.suppressed.pop(key, 0)
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+        return True
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        """Only the message is resolved on the calling thread. Formatting is done by the listener's handlers."""
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+def get_handler(filelog=False):
     handler = logging.StreamHandler() if not filelog else logging.FileHandler('main.log')
-    logger.setLevel(logging.DEBUG) if os.environ['LEVEL'] == 'debug' else logger.setLevel(logging.INFO)
     formatter = logging.Formatter(fmt='%(asctime)s - %(name)s - %(levelname)s: %(message)s',
                                   datefmt="%Y-%m-%d %H:%M:%S")
     handler.setFormatter(formatter)
+    return handler
+
+
+def start_queue_listener(filelog=False):
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, get_handler(filelog))
+    listener.start()
+    queue_listeners[filelog] = (log_queue, listener)
+
+
+def get_queue_handler(filelog=False):
+    """Queue handler of the background listener which writes to the stream (or the log file)."""
+    with queue_lock:
+        if not queue_listeners:
+            atexit.register(shutdown_logging)
+        if filelog not in queue_listeners:
+            start_queue_listener(filelog)
+
+        handler = DeferredQueueHandler(queue_listeners[filelog][0])
+        queue_handlers.append((filelog, handler))
+        return handler
+
+
+def restart_queue_listeners():
+    """Listeners' threads do not exist in a forked child process: new queues and listeners are started."""
+    global queue_lock
+    queue_lock = threading.Lock()
+    queue_listeners.clear()
+    for filelog, handler in queue_handlers:
+        if filelog not in queue_listeners:
+            start_queue_listener(filelog)
+        handler.queue = queue_listeners[filelog][0]
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=restart_queue_listeners)
+
+
+def shutdown_logging():
+    """Write the queued records and stop the background listeners. Called at exit, and by processes which do not
+    run exit handlers (e.g. 'multiprocessing' children).
+    """
+    with queue_lock:
+        for _, listener in queue_listeners.values():
+            listener.stop()
+        queue_listeners.clear()
+
+
+def load_logger(name, filelog=False):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    handler = get_queue_handler(filelog) if os.environ.get('LOG_QUEUE') == 'true' else get_handler(filelog)
+    logger.setLevel(logging.DEBUG) if os.environ['LEVEL'] == 'debug' else logger.setLevel(logging.INFO)
+
+    rate_limit = float(os.environ.get('LOG_RATE_LIMIT', 0))  # Time [s]
+    if rate_limit > 0:
+        handler.addFilter(RateLimitFilter(rate_limit))
+
     logger.addHandler(handler)
 
     return logger
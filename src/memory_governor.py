@@ -0,0 +1,127 @@
+import os
+import weakref
+import threading
+from uuid import uuid4
+
+import numpy as np
+
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class MemoryGovernor:
+    CATEGORIES = ("batch-buffer", "pending-write", "prefetch")
+    POLICIES = ("reduce-margins", "spill", "drop-oldest")
+
+    def __init__(self, **config):
+        """
+        Accounts the bytes held by the pipeline in every category, and keeps the total under a global ceiling:
+            batch-buffer:  Batches buffered by 'BufferManagerRT' (by section).
+            pending-write: Chunks generated but not written yet (by chunk).
+            prefetch:      Loaded data which has not been yielded as batches yet ('BatchDataGenerator').
+        When the ceiling is exceeded, 'BufferManagerRT' applies the configured degradation 'policies' in order, until
+        the total is under the ceiling:
+            reduce-margins: INACTIVE sections without trains only keep the batches needed by the start margin.
+            spill:          Buffered batches are moved to files in 'spill-path' and read back as memory maps.
+            drop-oldest:    The oldest buffered batches are dropped (INACTIVE sections first).
+        Buffered batches are copies of the sections' data ('copy-section-batches' is forced), so the accounted bytes are
+        owned by the buffers and spilling them frees memory.
+        """
+        self.max_bytes = config['memory-governor']['max-bytes']
+        self.policies = config['memory-governor']['policies']
+        self.spill_path = config['memory-governor']['spill-path']
+        self.validate_policies()
+
+        self.usage = {category: {} for category in self.CATEGORIES}
+        self.lock = threading.Lock()
+
+        # Statistics
+        self.peak_bytes = 0
+        self.spilled_bytes = 0
+        self.dropped_batches = 0
+        self.reduced_batches = 0
+
+    def validate_policies(self):
+        unknown_policies = [policy for policy in self.policies if policy not in self.POLICIES]
+        if unknown_policies:
+            raise ValueError(f"Unknown memory-governor policies {unknown_policies}. Valid policies: {self.POLICIES}")
+
+    # Accounting
+    def update(self, category, key, nbytes):
+        """Set the bytes held by 'key' in a category."""
+        with self.lock:
+            self.usage[category][key] = nbytes
+            self.peak_bytes = max(self.peak_bytes, self.get_total_bytes(lock=False))
+
+    def release(self, category, key):
+        with self.lock:
+            self.usage[category].pop(key, None)
+
+    @staticmethod
+    def get_chunk_key(chunk):
+        return chunk['section-id'], str(chunk['uuid']), chunk['file-chunk']
+
+    def add_pending_write(self, chunk):
+        """Account a chunk from its creation until it is written ('release_pending_write')."""
+        self.update('pending-write', self.get_chunk_key(chunk), chunk['train-data'].nbytes)
+
+    def release_pending_write(self, chunk):
+        self.release('pending-write', self.get_chunk_key(chunk))
+
+    def get_total_bytes(self, lock=True):
+        if not lock:
+            return sum([sum(values.values()) for values in self.usage.values()])
+        with self.lock:
+            return self.get_total_bytes(lock=False)
+
+    def get_excess_bytes(self):
+        return self.get_total_bytes() - self.max_bytes
+
+    def is_over_budget(self):
+        return self.get_excess_bytes() > 0
+
+    @staticmethod
+    def get_in_memory_bytes(matrix):
+        """Memory-mapped (spilled) matrices are not accounted."""
+        return 0 if isinstance(matrix, np.memmap) else matrix.nbytes
+
+    # Spill
+    def spill(self, matrix):
+        """Move a matrix to a spill file. Returns a read-only memory map of it.
+        The file is removed once the memory map is not referenced anymore.
+        """
+        if not os.path.isdir(self.spill_path):
+            os.makedirs(self.spill_path)
+
+        fullpath = os.path.join(self.spill_path, f"{uuid4()}.npy")
+        np.save(fullpath, matrix)
+        spilled_matrix = np.load(fullpath, mmap_mode='r')
+        weakref.finalize(spilled_matrix, self.remove_spill_file, fullpath)
+
+        with self.lock:
+            self.spilled_bytes += matrix.nbytes
+        return spilled_matrix
+
+    @staticmethod
+    def remove_spill_file(fullpath):
+        try:
+            os.remove(fullpath)
+        except OSError as e:
+            logger.warning(f"Spill file '{fullpath}' could not be removed: {e}")
+
+    # Getters
+    def get_accounting(self):
+        with self.lock:
+            accounting = {category: sum(values.values()) for category, values in self.usage.items()}
+            accounting.update(
+                {
+                    "total-bytes": self.get_total_bytes(lock=False),
+                    "max-bytes": self.max_bytes,
+                    "peak-bytes": self.peak_bytes,
+                    "spilled-bytes": self.spilled_bytes,
+                    "dropped-batches": self.dropped_batches,
+                    "reduced-batches": self.reduced_batches
+                }
+            )
+            return accounting
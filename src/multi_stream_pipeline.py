@@ -0,0 +1,268 @@
+import os
+import copy
+import time
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from src.buffer_manager_rt import BufferManagerRT
+from src.json_file_manager_rt import JsonFileManagerRT
+from src.stream_file_manager_rt import StreamFileManagerRT
+from src.kernels import get_kernels
+from src.config import validate_config
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+def get_stream_config(stream, **config):
+    """Configuration of a stream: a copy of the configuration with the stream's section map and file sizes."""
+    stream_config = copy.deepcopy(config)
+    stream_config['section-map'] = dict(stream['section-map'])
+    stream_config['client']['file-size-mb-list'] = list(stream['file-size-mb-list'])
+    validate_config(stream_config)
+    return stream_config
+
+
+def set_thread_event_loop():
+    """File managers run their handlers in the thread's event loop (production), which worker threads do not have."""
+    try:
+        asyncio.get_event_loop()
+    except RuntimeError:
+        asyncio.set_event_loop(asyncio.new_event_loop())
+
+
+class PipelineStream:
+    def __init__(self, stream_id, output_path, queue_size, **config):
+        """
+        One stream's pipeline: its own configuration, buffer manager and output directory. Its batches and chunks are
+        queued here, and handled in order by the shared pools ('MultiStreamPipeline').
+        """
+        self.stream_id = stream_id
+        self.config = config
+        self.output_path = output_path
+        self.buffer_manager_rt = BufferManagerRT(**config)
+        self.stream_file_manager = StreamFileManagerRT(output_path, **config) if \
+            config['client']['append-capture'] else None
+
+        # Queues
+        self.batches = deque()  # (batch, initial timestamp, queued time)
+        self.chunks = deque()
+        self.batch_slots = threading.Semaphore(queue_size)  # Backpressure on the stream's source
+        self.processing = False
+        self.writing = False
+
+        # Metrics
+        self.metrics = {
+            "batches": 0,
+            "chunks": 0,
+            "chunk-bytes": 0,  # In-memory size of the chunks' data (float64, before float16 conversion)
+            "process-time": 0.0,  # Time [s]
+            "write-time": 0.0,  # Time [s]
+            "queue-time": 0.0,  # Time [s] of the batches in the queue
+            "max-queue-time": 0.0,  # Time [s]
+            "errors": 0
+        }
+
+    def process(self, batch, initial_timestamp):
+        return list(self.buffer_manager_rt.generate_train_capture(batch, initial_timestamp))
+
+    def write(self, chunk):
+        if self.stream_file_manager is not None:
+            self.stream_file_manager.write(chunk)
+        else:
+            JsonFileManagerRT(self.output_path, chunk, **self.config)
+        self.buffer_manager_rt.release_pending_write(chunk)
+
+    def close(self):
+        if self.stream_file_manager is not None:
+            self.stream_file_manager.close()
+
+    # Getters
+    def get_metrics(self):
+        metrics = dict(self.metrics)
+        metrics.update({
+            "mean-queue-time": self.metrics['queue-time'] / self.metrics['batches'] if self.metrics['batches'] else 0,
+            "queued-batches": len(self.batches),
+            "pending-chunks": len(self.chunks)
+        })
+        return metrics
+
+
+class MultiStreamPipeline:
+    def __init__(self, output_path, **config):
+        """
+        Several independent pipelines ("streams": fibers or interrogators, see 'multi-stream' configuration) in one
+        process. Each stream has its own section map, buffer manager and output directory ('{output_path}/{stream-id}'),
+        while the batches' processing (detection and buffering) and the chunks' writing share two thread pools of
+        'workers' and 'writer-workers' threads.
+        Scheduling is fair: a stream has at most one batch in process and one chunk being written at a time (its batches
+        and chunks are handled in order), and free threads take the next stream with pending work in round-robin order.
+        Each stream queues at most 'queue-size' batches, and its batches are not processed while 'queue-size' chunks
+        await writing, so 'put' only blocks the sources of the streams which fall behind.
+        """
+        self.workers = config['multi-stream']['workers']
+        self.writer_workers = config['multi-stream']['writer-workers']
+        self.queue_size = config['multi-stream']['queue-size']
+
+        # Kernels are loaded (and warmed up) in this thread, instead of the first worker thread
+        get_kernels(**config)
+
+        self.streams = {stream_id: PipelineStream(stream_id, os.path.join(output_path, stream_id), self.queue_size,
+                                                  **get_stream_config(stream, **config))
+                        for stream_id, stream in config['multi-stream']['streams'].items()}
+        self.stream_ids = list(self.streams.keys())
+
+        # Shared Pools
+        self.worker_pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="stream-worker")
+        self.writer_pool = ThreadPoolExecutor(max_workers=self.writer_workers, thread_name_prefix="stream-writer")
+
+        # Scheduling (round-robin cursors and tasks in progress)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.process_cursor = 0
+        self.write_cursor = 0
+        self.processing_tasks = 0
+        self.writing_tasks = 0
+        self.started = time.perf_counter()
+
+    def put(self, stream_id, batch, initial_timestamp):
+        """Queues a stream's batch. Blocks while the stream has 'queue-size' queued batches."""
+        stream = self.streams[stream_id]
+        stream.batch_slots.acquire()
+        with self.lock:
+            stream.batches.append((batch, initial_timestamp, time.perf_counter()))
+            self.dispatch()
+
+    # Scheduling
+    def dispatch(self):
+        """Submits the next streams' pending work to the free threads. Call with the lock held."""
+        while self.processing_tasks < self.workers:
+            stream, self.process_cursor = self.get_next_stream(self.process_cursor, self.is_process_ready)
+            if stream is None:
+                break
+            stream.processing = True
+            self.processing_tasks += 1
+            self.worker_pool.submit(self.process_batch, stream, *stream.batches.popleft())
+
+        while self.writing_tasks < self.writer_workers:
+            stream, self.write_cursor = self.get_next_stream(self.write_cursor, self.is_write_ready)
+            if stream is None:
+                break
+            stream.writing = True
+            self.writing_tasks += 1
+            self.writer_pool.submit(self.write_chunk, stream, stream.chunks.popleft())
+
+    def get_next_stream(self, cursor, is_ready):
+        """First ready stream from the cursor (round-robin). Returns the stream (or None) and the next cursor."""
+        for i in range(len(self.stream_ids)):
+            stream = self.streams[self.stream_ids[(cursor + i) % len(self.stream_ids)]]
+            if is_ready(stream):
+                return stream, (cursor + i + 1) % len(self.stream_ids)
+        return None, cursor
+
+    def is_process_ready(self, stream):
+        return stream.batches and not stream.processing and len(stream.chunks) < self.queue_size
+
+    @staticmethod
+    def is_write_ready(stream):
+        return stream.chunks and not stream.writing
+
+    def is_idle(self):
+        return not self.processing_tasks and not self.writing_tasks and \
+            not any([stream.batches or stream.chunks for stream in self.streams.values()])
+
+    # Tasks
+    def process_batch(self, stream, batch, initial_timestamp, queued_time):
+        started = time.perf_counter()
+        chunks, failed = [], False
+        try:
+            chunks = stream.process(batch, initial_timestamp)
+        except Exception:
+            logger.error(f"MULTI-STREAM :: Batch of stream {stream.stream_id} could not be processed", exc_info=True)
+            failed = True
+        finally:
+            with self.lock:
+                stream.metrics['errors'] += int(failed)
+                stream.metrics['batches'] += 1
+                stream.metrics['process-time'] += time.perf_counter() - started
+                stream.metrics['queue-time'] += started - queued_time
+                stream.metrics['max-queue-time'] = max(stream.metrics['max-queue-time'], started - queued_time)
+                stream.chunks.extend(chunks)
+                stream.processing = False
+                self.processing_tasks -= 1
+                self.dispatch()
+                self.idle.notify_all()
+            stream.batch_slots.release()
+
+    def write_chunk(self, stream, chunk):
+        started = time.perf_counter()
+        failed = False
+        try:
+            set_thread_event_loop()
+            stream.write(chunk)
+        except Exception:
+            logger.error(f"MULTI-STREAM :: Chunk of stream {stream.stream_id} could not be written", exc_info=True)
+            failed = True
+        finally:
+            with self.lock:
+                stream.metrics['errors'] += int(failed)
+                stream.metrics['chunks'] += 1
+                stream.metrics['chunk-bytes'] += chunk['train-data'].nbytes
+                stream.metrics['write-time'] += time.perf_counter() - started
+                stream.writing = False
+                self.writing_tasks -= 1
+                self.dispatch()
+                self.idle.notify_all()
+
+    # Run
+    def run(self, sources):
+        """
+        Feeds each stream's batches from its source (one thread per source) until every source is exhausted, and
+        closes the pipeline.
+        :param sources: Iterable of (batch, initial_timestamp) of each stream-id, e.g. 'BatchDataGenerator'. A source
+        which raises is logged and counted in its stream's 'errors' metric
+        :return: Per-stream metrics
+        """
+        def feed(stream_id, source):
+            try:
+                for batch, initial_timestamp in source:
+                    self.put(stream_id, batch, initial_timestamp)
+            except Exception:
+                logger.error(f"MULTI-STREAM :: Source of stream {stream_id} failed", exc_info=True)
+                with self.lock:
+                    self.streams[stream_id].metrics['errors'] += 1
+
+        feeders = [threading.Thread(target=feed, args=(stream_id, source), name=f"stream-source-{stream_id}")
+                   for stream_id, source in sources.items()]
+        for feeder in feeders:
+            feeder.start()
+        for feeder in feeders:
+            feeder.join()
+
+        self.close()
+        return self.get_metrics()
+
+    def join(self):
+        """Waits until every queued batch has been processed and every chunk has been written."""
+        with self.idle:
+            self.idle.wait_for(self.is_idle)
+
+    def close(self):
+        self.join()
+        for stream in self.streams.values():
+            stream.close()
+        self.worker_pool.shutdown()
+        self.writer_pool.shutdown()
+
+        metrics = self.get_metrics()
+        for stream_id, stream_metrics in metrics['streams'].items():
+            logger.info(f"MULTI-STREAM :: {stream_id}: {stream_metrics}")
+        logger.info(f"MULTI-STREAM :: {len(self.streams)} streams in {round(metrics['elapsed-time'], 3)} s")
+
+    # Getters
+    def get_metrics(self):
+        with self.lock:
+            stream_metrics = {stream_id: stream.get_metrics() for stream_id, stream in self.streams.items()}
+        return {"elapsed-time": time.perf_counter() - self.started, "streams": stream_metrics}
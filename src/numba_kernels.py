@@ -0,0 +1,161 @@
+import threading
+
+import numpy as np
+from numba import config as numba_config, njit, prange, get_num_threads
+
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+# float64 -> float16 bit conversion constants (round to nearest even, as NumPy)
+SIGN_MASK = np.uint64(0x8000000000000000)
+EXPONENT_MASK = np.uint64(0x7ff0000000000000)
+SIGNIFICAND_MASK = np.uint64(0x000fffffffffffff)
+INF_EXPONENT = np.uint64(0x7ff0000000000000)
+OVERFLOW_EXPONENT = np.uint64(0x40f0000000000000)
+SUBNORMAL_EXPONENT = np.uint64(0x3f00000000000000)
+UNDERFLOW_EXPONENT = np.uint64(0x3e60000000000000)
+SUBNORMAL_HIDDEN_BIT = np.uint64(0x0010000000000000)
+SUBNORMAL_ROUND_MASK = np.uint64(0x003fffffffffffff)
+NORMAL_ROUND_MASK = np.uint64(0x000007ffffffffff)
+NORMAL_ROUND_BIT = np.uint64(0x0000020000000000)
+
+
+@njit(cache=True)
+def double_bits_to_half_bits(d):
+    h_sgn = np.uint16((d & SIGN_MASK) >> np.uint64(48))
+    d_exp = d & EXPONENT_MASK
+
+    # Exponent overflow or NaN converts to signed inf or NaN
+    if d_exp >= OVERFLOW_EXPONENT:
+        if d_exp == INF_EXPONENT:
+            d_sig = d & SIGNIFICAND_MASK
+            if d_sig != np.uint64(0):
+                ret = np.uint16(np.uint64(0x7c00) + (d_sig >> np.uint64(42)))
+                if ret == np.uint16(0x7c00):
+                    ret += np.uint16(1)
+                return np.uint16(h_sgn + ret)
+        return np.uint16(h_sgn + np.uint16(0x7c00))
+
+    # Exponent underflow converts to subnormal half or signed zero
+    if d_exp <= SUBNORMAL_EXPONENT:
+        if d_exp < UNDERFLOW_EXPONENT:
+            return h_sgn
+        d_exp = d_exp >> np.uint64(52)
+        d_sig = SUBNORMAL_HIDDEN_BIT + (d & SIGNIFICAND_MASK)
+        d_sig = d_sig << (d_exp - np.uint64(998))
+        if (d_sig & SUBNORMAL_ROUND_MASK) != SUBNORMAL_HIDDEN_BIT:
+            d_sig += SUBNORMAL_HIDDEN_BIT
+        return np.uint16(h_sgn + np.uint16(d_sig >> np.uint64(53)))
+
+    # Regular case (rounding may carry into the exponent, which gives the right result)
+    h_exp = np.uint16((d_exp - SUBNORMAL_EXPONENT) >> np.uint64(42))
+    d_sig = d & SIGNIFICAND_MASK
+    if (d_sig & NORMAL_ROUND_MASK) != NORMAL_ROUND_BIT:
+        d_sig += NORMAL_ROUND_BIT
+    h_sig = np.uint16(d_sig >> np.uint64(42))
+    return np.uint16(h_sgn + np.uint16(h_sig + h_exp))
+
+
+@njit(parallel=True, cache=True)
+def float64_bits_to_float16_bits(bits):
+    rows, columns = bits.shape
+    half_bits = np.empty((rows, columns), dtype=np.uint16)
+    for i in prange(rows):
+        for j in range(columns):
+            half_bits[i, j] = double_bits_to_half_bits(bits[i, j])
+    return half_bits
+
+
+@njit(parallel=True, cache=True)
+def movmean_downsample_kernel(data, N):
+    temporal_length, spatial_length = data.shape
+    new_temporal_length = (temporal_length + N - 1) // N
+    reduced_data = np.zeros((new_temporal_length, spatial_length))
+    for block in prange(new_temporal_length):
+        start = block * N
+        end = min(start + N, temporal_length)
+        for i in range(start, end):
+            for j in range(spatial_length):
+                reduced_data[block, j] += data[i, j]
+        for j in range(spatial_length):
+            reduced_data[block, j] /= end - start
+    return reduced_data
+
+
+@njit(parallel=True, cache=True)
+def rms_kernel(section, n_threads):
+    temporal_length, spatial_length = section.shape
+    # Rows are split among threads (row-major access), and each thread accumulates its own partial sums. The number of
+    # threads is an argument ('get_num_threads' would prevent caching)
+    n_parts = max(1, min(temporal_length, n_threads))
+    partial_energy = np.zeros((n_parts, spatial_length))
+    for part in prange(n_parts):
+        start = part * temporal_length // n_parts
+        end = (part + 1) * temporal_length // n_parts
+        for i in range(start, end):
+            for j in range(spatial_length):
+                partial_energy[part, j] += section[i, j] * section[i, j]
+
+    rms = np.empty(spatial_length)
+    for j in range(spatial_length):
+        energy = 0.0
+        for part in range(n_parts):
+            energy += partial_energy[part, j]
+        rms[j] = np.sqrt(energy / temporal_length)
+    return rms
+
+
+@njit(parallel=True, cache=True)
+def count_above_kernel(values, threshold):
+    count = 0
+    for i in prange(values.shape[0]):
+        if values[i] >= threshold:
+            count += 1
+    return count
+
+
+class NumbaKernels:
+    """Fused, single-pass and parallel ('prange') kernels. See 'src.kernels.NumpyKernels' for the reference.
+    Kernels are not launched concurrently from several threads (e.g. multi-stream workers): Numba's default
+    'workqueue' threading layer does not support it, and each launch already uses every thread.
+    """
+    name = "numba"
+    lock = threading.Lock()
+
+    @staticmethod
+    def warm_up():
+        """
+        Launch a kernel, which starts Numba's threading layer. TBB's layer does not shut down at exit when it is started
+        by a thread other than the main thread (the interpreter hangs), so the 'workqueue' layer is selected when the
+        kernels are loaded by another thread (unless 'NUMBA_THREADING_LAYER' is set). Launches are serialized by
+        'lock', so 'workqueue' is safe here.
+        """
+        if threading.current_thread() is not threading.main_thread() and numba_config.THREADING_LAYER == "default":
+            numba_config.THREADING_LAYER = "workqueue"
+        NumbaKernels.rms(np.zeros((1, 1)))
+
+    @staticmethod
+    def movmean_downsample(data, N):
+        data = np.asarray(data, dtype=np.float64)
+        with NumbaKernels.lock:
+            return movmean_downsample_kernel(data, N)
+
+    @staticmethod
+    def rms(section):
+        section = np.asarray(section, dtype=np.float64)
+        with NumbaKernels.lock:
+            return rms_kernel(section, get_num_threads())
+
+    @staticmethod
+    def count_above(values, threshold):
+        values = np.asarray(values, dtype=np.float64)
+        with NumbaKernels.lock:
+            return int(count_above_kernel(values, threshold))
+
+    @staticmethod
+    def float16_bytes(matrix):
+        bits = np.ascontiguousarray(matrix, dtype=np.float64).view(np.uint64)
+        with NumbaKernels.lock:
+            half_bits = float64_bits_to_float16_bits(bits)
+        return half_bits.astype('<u2', copy=False).tobytes()
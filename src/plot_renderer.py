@@ -0,0 +1,96 @@
+import os
+import logging
+import queue
+import threading
+from datetime import datetime
+
+from src.data_plotter import DataPlotter
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class PlotRenderer:
+    def __init__(self, **config):
+        """
+        Renders chunks' waterfalls as PNG files in a background thread, so plotting doesn't block the capture loop.
+        Chunks are dropped (not rendered) when the rendering queue is full.
+        """
+        self.plot_config = config['plot-matrix']
+        self.output_path = config['plot-renderer']['output-path']
+        self.queue_size = config['plot-renderer']['queue-size']
+        self.dpi = config['plot-renderer']['dpi']
+        self.max_percentile_samples = config['plot-renderer']['max-percentile-samples']
+
+        # Screen resolution [pixels]
+        figsize = self.plot_config['figsize'] if self.plot_config['figsize'] is not None else (19.2, 9.83)
+        self.screen_size = (int(figsize[0] * self.dpi), int(figsize[1] * self.dpi))
+
+        # Rendering Thread
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.rendered_chunks = 0
+        self.dropped_chunks = 0
+        self.worker = threading.Thread(target=self.render_worker, name="plot-renderer", daemon=True)
+        self.worker.start()
+
+    def submit(self, chunk):
+        """Hand a chunk to the rendering thread without blocking. Returns False if the chunk has been dropped."""
+        try:
+            self.queue.put_nowait(chunk)
+            return True
+        except queue.Full:
+            self.dropped_chunks += 1
+            logger.warning(f"Rendering queue is full. Dropping chunk {chunk['uuid']} part {chunk['file-chunk']} "
+                           f"({self.dropped_chunks} dropped).")
+            return False
+
+    def close(self):
+        """Wait until all queued chunks have been rendered and stop the rendering thread."""
+        self.queue.put(None)
+        self.worker.join()
+        logger.info(f"Plot renderer closed. Rendered chunks: {self.rendered_chunks}, "
+                    f"dropped chunks: {self.dropped_chunks}")
+
+    def render_worker(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                break
+
+            try:
+                self.render_chunk(chunk)
+                self.rendered_chunks += 1
+            except Exception as e:
+                logger.error(f"RENDERING ERROR: {e}", exc_info=logger.isEnabledFor(logging.DEBUG))
+
+    def render_chunk(self, chunk):
+        train_data = chunk['train-data']
+        temporal_samples, spatial_samples = train_data.shape
+
+        # Reduce data to screen resolution (rows are displayed along the y-axis)
+        data = DataPlotter.minmax_decimate(train_data, self.screen_size[1], axis=0)
+        data = DataPlotter.minmax_decimate(data, self.screen_size[0], axis=1)
+        vmin, vmax = DataPlotter.get_color_limits(data, max_samples=self.max_percentile_samples)
+
+        plot_config = dict(self.plot_config)
+        plot_config.update({
+            "vmin": vmin if plot_config['vmin'] is None else plot_config['vmin'],
+            "vmax": vmax if plot_config['vmax'] is None else plot_config['vmax'],
+            "extent": (0, spatial_samples, 0, temporal_samples) if plot_config['extent'] is None
+            else plot_config['extent']
+        })
+
+        data_plotter = DataPlotter(data, **plot_config)
+        data_plotter.set_title(f"New Train: section {chunk['section-id']}. Chunk num: {chunk['file-chunk']}."
+                               f"\nchunk-id: {chunk['uuid']}")
+        data_plotter.save_matrix(self.get_fullpath(chunk), dpi=self.dpi)
+
+    def get_fullpath(self, chunk):
+        if not os.path.isdir(self.output_path):
+            os.makedirs(self.output_path)
+
+        initial_datetime = datetime.fromtimestamp(chunk['initial-timestamp'])
+        filename = (f"{initial_datetime.year}_{initial_datetime.month:02d}_{initial_datetime.day:02d}_"
+                    f"{initial_datetime.hour:02d}_{initial_datetime.minute:02d}_{initial_datetime.second:02d}_"
+                    f"{chunk['section-id']}_part_{chunk['file-chunk']:02d}")
+        return os.path.join(self.output_path, f"{filename}.png")
@@ -0,0 +1,98 @@
+import numpy as np
+
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class PreviewPyramid:
+    def __init__(self, data: np.ndarray, **config):
+        """
+        Multi-resolution previews of a strain matrix. Each level is decimated by its factor in time and space.
+        Reductions:
+            "rms": Root-mean-square of each block.
+            "peak": Value with the maximum absolute value of each block (min/max reduction keeping the sign).
+        Each level is computed from the previous one, which is exact for both reductions when blocks are complete.
+        """
+        self.data = data
+        self.levels = config['preview-pyramid']['levels']
+        self.reduction = config['preview-pyramid']['reduction']
+
+        if self.reduction not in ('rms', 'peak'):
+            raise ValueError(f"Preview reduction '{self.reduction}' is not implemented. Use 'rms' or 'peak'.")
+
+        self.factors = []
+        self.previews = self.compute_previews()
+
+    @staticmethod
+    def block_reduce(data, factors, reduction):
+        """Reduce data by blocks of factors[0] rows and factors[1] columns. Incomplete blocks are discarded."""
+        rows, cols = data.shape[0] // factors[0], data.shape[1] // factors[1]
+        blocks = data[:rows * factors[0], :cols * factors[1]].reshape(rows, factors[0], cols, factors[1])
+
+        if reduction == 'rms':
+            return np.sqrt(np.mean(np.square(blocks, dtype=np.float64), axis=(1, 3)))
+
+        block_min, block_max = blocks.min(axis=(1, 3)), blocks.max(axis=(1, 3))
+        return np.where(np.abs(block_max) >= np.abs(block_min), block_max, block_min)
+
+    def compute_previews(self):
+        previews = {}
+        level_data = self.data
+        total_factors = (1, 1)
+
+        for level in self.levels:
+            # Factors relative to the previous level (never reduce an axis below one sample)
+            factors = (max(1, min(level // total_factors[0], level_data.shape[0])),
+                       max(1, min(level // total_factors[1], level_data.shape[1])))
+            level_data = self.block_reduce(level_data, factors, self.reduction)
+            total_factors = (total_factors[0] * factors[0], total_factors[1] * factors[1])
+
+            self.factors.append(total_factors)
+            previews.update({f"level_{level}": level_data})
+
+        return previews
+
+    def save(self, fullpath):
+        """Save the previews as an uncompressed '.npz' file, so each level can be read independently."""
+        np.savez(fullpath,
+                 shape=np.array(self.data.shape),
+                 levels=np.array(self.levels),
+                 factors=np.array(self.factors),
+                 **{key: value.astype(np.float16) for key, value in self.previews.items()})
+
+    @staticmethod
+    def select_level(fullpaths, display_size):
+        """
+        Selects the coarsest level that still fills a display of display_size (width, height) pixels with the parts
+        given in fullpaths concatenated in time (rows are displayed along the y-axis).
+        :return: level, or None if the full resolution data is needed
+        """
+        with np.load(fullpaths[0]) as previews:
+            levels, factors = list(previews['levels']), list(previews['factors'])
+            spatial_samples = int(previews['shape'][1])
+
+        temporal_samples = 0
+        for fullpath in fullpaths:
+            with np.load(fullpath) as previews:
+                temporal_samples += int(previews['shape'][0])
+
+        selected_level = None
+        for level, factor in zip(levels, factors):
+            if temporal_samples / factor[0] >= display_size[1] and spatial_samples / factor[1] >= display_size[0]:
+                selected_level = int(level)
+
+        return selected_level
+
+    @staticmethod
+    def load_level(fullpath, level):
+        """Read only the requested level of a preview file."""
+        with np.load(fullpath) as previews:
+            return previews[f"level_{level}"]
+
+    # Getters
+    def get_previews(self):
+        return self.previews
+
+    def get_factors(self):
+        return self.factors
@@ -0,0 +1,202 @@
+import os
+import io
+import time
+import atexit
+from datetime import datetime
+from contextlib import contextmanager, nullcontext
+
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+# No-op stage (profiling disabled or stage not profiled)
+NULL_STAGE = nullcontext()
+
+
+def profile_stage(profiler, name):
+    """Context manager of the profiler's stage, or a no-op one when there isn't a profiler."""
+    return NULL_STAGE if profiler is None else profiler.stage(name)
+
+
+def profile_iterator(profiler, iterable, name):
+    """Profiles the work done to produce each item (e.g. generators) as the stage."""
+    return iterable if profiler is None else profiler.iter_stage(iterable, name)
+
+
+class PipelineProfiler:
+    STAGES = ("loader", "filter", "detector", "buffer-manager", "writer")
+
+    def __init__(self, **config):
+        """
+        Profiles the pipeline's stages:
+            loader:         Batches' loading (files' reading, filtering and batching).
+            filter:         'SignalProcessor' (downsampling and Butterworth filter).
+            detector:       'TrainDetector'.
+            buffer-manager: 'BufferManagerRT' (buffering and chunks' generation, without the detector).
+            writer:         Chunks' serialization.
+        Time of nested stages (e.g. 'filter' within 'loader') is only accounted to the inner stage. With 'cprofile',
+        each stage has its own 'cProfile' profiler. With 'tracemalloc-interval', a 'tracemalloc' snapshot is taken
+        every N batches, and the top allocation sites (and their growth since the previous snapshot) are reported.
+        The summary report ('.txt') and each stage's '.prof' file are written to 'path' by 'report', which is also
+        called at exit.
+        """
+        self.stages = config['profiling']['stages']
+        self.cprofile = config['profiling']['cprofile']
+        self.tracemalloc_interval = config['profiling']['tracemalloc-interval']  # Number of batches
+        self.tracemalloc_frames = config['profiling']['tracemalloc-frames']
+        self.top = config['profiling']['top']
+        self.sort = config['profiling']['sort']
+        self.output_path = config['profiling']['path']
+        self.validate_stages()
+
+        # Stages
+        self.profiles = {}
+        if self.cprofile:
+            import cProfile
+            self.profiles = {stage: cProfile.Profile() for stage in self.stages}
+        self.stage_times = {stage: 0.0 for stage in self.stages}  # Time [s]
+        self.stage_calls = {stage: 0 for stage in self.stages}
+        self.active_stages = []
+        self.stage_started = None
+
+        # Memory
+        self.snapshot = None
+        self.memory_reports = []
+        if self.tracemalloc_interval:
+            import tracemalloc
+            tracemalloc.start(self.tracemalloc_frames)
+
+        self.batches = 0
+        self.started = time.perf_counter()
+        self.reported = False
+        atexit.register(self.report)
+
+    def validate_stages(self):
+        unknown_stages = [stage for stage in self.stages if stage not in self.STAGES]
+        if unknown_stages:
+            raise ValueError(f"Unknown profiling stages {unknown_stages}. Valid stages: {self.STAGES}")
+
+    # Stages
+    def stage(self, name):
+        return self.profile(name) if name in self.stage_times else NULL_STAGE
+
+    @contextmanager
+    def profile(self, name):
+        outer_stage = self.active_stages[-1] if self.active_stages else None
+        self.switch(outer_stage, name)
+        self.active_stages.append(name)
+        self.stage_calls[name] += 1
+        try:
+            yield
+        finally:
+            self.active_stages.pop()
+            self.switch(name, self.active_stages[-1] if self.active_stages else None)
+
+    def switch(self, from_stage, to_stage):
+        """Only one stage is profiled at a time (a single 'cProfile' profiler can be active)."""
+        now = time.perf_counter()
+        if from_stage is not None:
+            self.stage_times[from_stage] += now - self.stage_started
+            if self.cprofile:
+                self.profiles[from_stage].disable()
+        if to_stage is not None and self.cprofile:
+            self.profiles[to_stage].enable()
+        self.stage_started = time.perf_counter()
+
+    def iter_stage(self, iterable, name):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                item = next(iterator, StopIteration)
+            if item is StopIteration:
+                return
+            yield item
+
+    # Memory
+    def update(self):
+        """Call once per batch, when its processing has been completed."""
+        self.batches += 1
+        if self.tracemalloc_interval and self.batches % self.tracemalloc_interval == 0:
+            self.take_snapshot()
+
+    def take_snapshot(self):
+        import tracemalloc
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>")
+        ])
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        statistics = snapshot.compare_to(self.snapshot, 'lineno') if self.snapshot is not None else \
+            snapshot.statistics('lineno')
+        self.snapshot = snapshot
+
+        lines = [f"{statistic}" for statistic in statistics[:self.top]]
+        self.memory_reports.append({"batches": self.batches, "current-bytes": current_bytes,
+                                    "peak-bytes": peak_bytes, "top": lines})
+
+        logger.info(f"PROFILER :: batch {self.batches}. Traced memory: {round(current_bytes / pow(2, 20), 3)} MB "
+                    f"(peak: {round(peak_bytes / pow(2, 20), 3)} MB)")
+        for line in lines[:5]:
+            logger.debug(f"PROFILER ::    {line}")
+
+    # Report
+    def report(self):
+        """Writes the summary report (and each stage's '.prof' file). Only the first call writes it."""
+        if self.reported:
+            return None
+        self.reported = True
+
+        for stage in reversed(self.active_stages):
+            self.switch(stage, None)
+        self.active_stages = []
+
+        os.makedirs(self.output_path, exist_ok=True)
+        name = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        fullpath = os.path.join(self.output_path, f"{name}.txt")
+
+        with open(fullpath, 'w') as f:
+            f.write(self.get_summary())
+            for stage, profile in self.profiles.items():
+                if not self.stage_calls[stage]:
+                    continue
+                profile.dump_stats(os.path.join(self.output_path, f"{name}_{stage}.prof"))
+                f.write(f"\n\n===== cProfile :: {stage} (sorted by '{self.sort}') =====\n")
+                f.write(self.get_stage_stats(profile))
+            for memory_report in self.memory_reports:
+                f.write(f"\n\n===== tracemalloc :: batch {memory_report['batches']}. "
+                        f"Traced memory: {memory_report['current-bytes']} Bytes "
+                        f"(peak: {memory_report['peak-bytes']} Bytes) =====\n")
+                f.write("\n".join(memory_report['top']))
+
+        logger.info(f"PROFILER :: Summary report saved in '{fullpath}'")
+        return fullpath
+
+    def get_stage_stats(self, profile):
+        import pstats
+
+        stream = io.StringIO()
+        pstats.Stats(profile, stream=stream).sort_stats(self.sort).print_stats(self.top)
+        return stream.getvalue()
+
+    # Getters
+    def get_summary(self):
+        elapsed_time = time.perf_counter() - self.started
+        lines = [f"Pipeline profile: {self.batches} batches in {round(elapsed_time, 3)} s",
+                 f"{'stage':<16}{'calls':>10}{'time [s]':>12}{'mean [ms]':>12}{'share':>9}"]
+        for stage in self.stages:
+            calls = self.stage_calls[stage]
+            stage_time = self.stage_times[stage]
+            mean_time = 1000 * stage_time / calls if calls else 0
+            share = 100 * stage_time / elapsed_time if elapsed_time else 0
+            lines.append(f"{stage:<16}{calls:>10}{stage_time:>12.3f}{mean_time:>12.3f}{share:>8.1f}%")
+        return "\n".join(lines)
+
+    def get_metrics(self):
+        return {
+            "batches": self.batches,
+            "stage-times": self.stage_times,
+            "stage-calls": self.stage_calls
+        }
@@ -1,3 +1,5 @@
+import copy
+
 # ---------------------------------------------------------------------------------------------------------------------
 #                                                   JSON SCHEMA
 # ---------------------------------------------------------------------------------------------------------------------
@@ -11,11 +13,18 @@ json_schema = dict(
         temporal_samples=None,
         spatial_samples=None,
         initial_timestamp=None,
+        sample_offset=0,
         zone_ID=None,
         file_chunk=None,
-        total_chunks=None
+        total_chunks=None,
+        statistics=None
     ),
     strain=None
 )
 
 # ---------------------------------------------------------------------------------------------------------------------
+
+
+def get_json_schema():
+    """Returns a new copy of the JSON schema, to be used as the header of a single file-chunk."""
+    return copy.deepcopy(json_schema)
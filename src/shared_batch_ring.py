@@ -0,0 +1,102 @@
+import queue
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class SharedBatchRing:
+    def __init__(self, slot_shape, slots, dtype="float64", handle=None):
+        """
+        Ring of fixed-size batch slots in shared memory, to hand batches from an acquisition (producer) process to
+        a pipeline (consumer) process without serializing them.
+        Control channel:
+            free-queue:   Indexes of the slots which can be written by the producer (producer blocks when empty).
+            filled-queue: (slot, rows, columns, initial_timestamp) of the written slots, or None to stop.
+        Use 'get_handle' to pass the ring to another process, and 'SharedBatchRing.attach(handle)' there.
+        Python >= 3.8 is required.
+        """
+        self.slot_shape = tuple(slot_shape)
+        self.slots = slots
+        self.dtype = np.dtype(dtype)
+        self.slot_size = int(np.prod(self.slot_shape)) * self.dtype.itemsize  # Bytes
+
+        if handle is None:
+            # Creator (producer side)
+            self.shm = shared_memory.SharedMemory(create=True, size=self.slot_size * self.slots)
+            self.free_queue = multiprocessing.Queue()
+            self.filled_queue = multiprocessing.Queue()
+            for slot in range(self.slots):
+                self.free_queue.put(slot)
+            self.creator = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=handle['name'])
+            self.free_queue = handle['free-queue']
+            self.filled_queue = handle['filled-queue']
+            self.creator = False
+
+    @classmethod
+    def attach(cls, handle):
+        return cls(handle['slot-shape'], handle['slots'], handle['dtype'], handle=handle)
+
+    def get_handle(self):
+        return {
+            "name": self.shm.name,
+            "slot-shape": self.slot_shape,
+            "slots": self.slots,
+            "dtype": self.dtype.str,
+            "free-queue": self.free_queue,
+            "filled-queue": self.filled_queue
+        }
+
+    def get_slot(self, slot):
+        """Zero-copy view of a slot."""
+        return np.ndarray(self.slot_shape, dtype=self.dtype, buffer=self.shm.buf, offset=slot * self.slot_size)
+
+    # Producer
+    def put(self, batch, initial_timestamp=None, timeout=None):
+        """Copy a batch into a free slot. Blocks while all the slots are in use (backpressure).
+        Returns False if no slot has been released within 'timeout' seconds.
+        """
+        rows, columns = batch.shape
+        if rows > self.slot_shape[0] or columns > self.slot_shape[1]:
+            raise ValueError(f"Batch shape {batch.shape} exceeds the slot shape {self.slot_shape}")
+
+        try:
+            slot = self.free_queue.get(timeout=timeout)
+        except queue.Empty:
+            logger.warning(f"No free slot available after {timeout} seconds. Batch dropped.")
+            return False
+
+        self.get_slot(slot)[:rows, :columns] = batch
+        self.filled_queue.put((slot, rows, columns, initial_timestamp))
+        return True
+
+    def close_producer(self):
+        """Notify the consumer that there aren't more batches."""
+        self.filled_queue.put(None)
+
+    # Consumer
+    def get(self, timeout=None):
+        """Get the next batch as a zero-copy view of its slot.
+        :return: (slot, batch, initial_timestamp), or None when the producer has finished.
+        The slot must be released with 'release' once the batch is not referenced anymore.
+        """
+        item = self.filled_queue.get(timeout=timeout)
+        if item is None:
+            return None
+
+        slot, rows, columns, initial_timestamp = item
+        return slot, self.get_slot(slot)[:rows, :columns], initial_timestamp
+
+    def release(self, slot):
+        self.free_queue.put(slot)
+
+    def close(self):
+        self.shm.close()
+        if self.creator:
+            self.shm.unlink()
@@ -1,10 +1,8 @@
 import numpy as np
-from scipy import signal
-from dotenv import load_dotenv
 
+from src.kernels import get_kernels
 from src.logger import load_logger
 
-load_dotenv()
 logger = load_logger(__name__)
 
 
@@ -16,6 +14,8 @@ class SignalProcessor:
         self.Wn = config['signal']['Wn']
         self.btype = config['signal']['btype']
         self.fs = config['signal']['fs']
+        self.filter_mode = config['signal']['filter-mode']
+        self.kernels = get_kernels(**config)
         self.dt = (1 / self.fs) * self.N
         self.temporal_length = self.data.shape[0]
         self.spatial_length = self.data.shape[1]
@@ -44,19 +44,10 @@ class SignalProcessor:
         -----
         - It is assumed the matrix `data` has a structur of (time samples, spatio indeces).
         - Each signal is assumed to be in a column of the matrix s. 
+        - It is computed by the configured kernels backend (see 'src.kernels').
         """
 
-        new_temporal_length = len(np.arange(0, self.temporal_length, self.N))
-        reduced_data = np.empty([new_temporal_length, self.spatial_length])
-
-        count = 0
-        for i in range(0, self.temporal_length, self.N):
-            start = i
-            end = min(i + self.N, self.temporal_length)
-            reduced_data[count, :] = np.mean(self.data[start:end, :], axis=0)
-            count = count + 1
-
-        return reduced_data
+        return self.kernels.movmean_downsample(self.data, self.N)
 
     def butterworth_filter(self):
         """
@@ -79,6 +70,8 @@ class SignalProcessor:
         :return:
         """
 
+        from scipy import signal  # Imported only when filtering is requested (slow import)
+
         fs = 1 / self.dt
 
         # Calculate filter coefficients:
@@ -86,8 +79,11 @@ class SignalProcessor:
             N=self.f_order, Wn=self.Wn, btype=self.btype, fs=fs
         )  # TODO: In signal.butter, N parameter is filter's order!
 
-        # Apply filter to signal:
-        filtered_data = signal.filtfilt(b, a, self.reduced_data, axis=0)
+        # Apply filter to signal (zero-phase, or single-pass when a cheaper filter is needed):
+        if self.filter_mode == 'lfilter':
+            filtered_data = signal.lfilter(b, a, self.reduced_data, axis=0)
+        else:
+            filtered_data = signal.filtfilt(b, a, self.reduced_data, axis=0)
 
         return filtered_data
 
@@ -0,0 +1,95 @@
+import numpy as np
+
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class SpeedEstimator:
+    def __init__(self, **config):
+        """
+        Estimates a train's speed from a section's data: the section's channels are split in 'channel-groups'
+        adjacent groups, and the change of each group's energy envelope (logarithm of the mean energy every
+        'window-time' seconds, differenced over 'edge-time' seconds) is cross-correlated with the next group's one (FFT,
+        every pair at once). The delay of the highest (weighted) mean correlation, within the delays allowed by
+        'speed-limits', is the time the train's front (or tail) takes to travel between groups.
+        """
+        self.spatial_resolution = config['params']['spatial-resolution']  # Space [m]
+        self.dt = config['signal']['N'] * (1 / config['signal']['fs'])  # Time [s]
+        self.channel_groups = config['speed-estimator']['channel-groups']
+        self.window_time = config['speed-estimator']['window-time']  # Time [s]
+        self.edge_time = config['speed-estimator']['edge-time']  # Time [s]
+        self.speed_limits = config['speed-estimator']['speed-limits']  # Speed [Km / h]
+        self.min_correlation = config['speed-estimator']['min-correlation']
+        self.window_length = max(1, int(round(self.window_time / self.dt)))  # Samples
+        self.edge_windows = max(1, int(round(self.edge_time / (self.window_length * self.dt))))  # Number of windows
+
+        # Last estimate
+        self.speed = None  # Speed [Km / h]
+        self.direction = None  # 1: Towards higher channels, -1: Towards lower channels
+        self.correlation = None
+
+    def get_group_envelopes(self, data):
+        """Mean energy of each channel group every 'window-time' seconds. Shape: (groups, windows)."""
+        temporal_length, spatial_length = data.shape
+        group_length = spatial_length // self.channel_groups
+        windows = temporal_length // self.window_length
+        if group_length == 0 or windows <= self.edge_windows + 1:
+            return None
+
+        energy = np.square(data[:windows * self.window_length, :group_length * self.channel_groups])
+        return energy.reshape(windows, self.window_length, self.channel_groups, group_length).mean(axis=(1, 3)).T
+
+    def estimate(self, data):
+        """
+        :param data: Section's data (temporal, spatial samples) while the train passes
+        :return: Speed [Km / h], or None if the envelopes do not correlate enough (or the data is too short)
+        """
+        self.speed, self.direction, self.correlation = None, None, None
+        envelopes = self.get_group_envelopes(data)
+        if envelopes is None or self.channel_groups < 2:
+            return None
+
+        # Envelopes' changes (train's arrival and departure at each group), so the correlation does not depend on
+        # the part of the train within the data (logarithm: relative to the background's energy)
+        envelopes = np.log(np.maximum(envelopes, np.finfo(envelopes.dtype).tiny))
+        envelopes = envelopes[:, self.edge_windows:] - envelopes[:, :-self.edge_windows]
+        envelopes = envelopes - envelopes.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(envelopes, axis=1)
+        pair_norms = np.sum(norms[1:] * norms[:-1])
+        if pair_norms == 0:
+            return None
+
+        # Linear cross-correlation of each pair of adjacent groups (zero-padded FFT). Positive lags: the next group
+        # (higher channels) is delayed. Pairs' Pearson coefficients are weighted by their norms, so pairs the train
+        # has not reached yet (background only) do not dilute the peak.
+        windows = envelopes.shape[1]
+        spectra = np.fft.rfft(envelopes, n=2 * windows, axis=1)
+        correlation = np.fft.irfft(spectra[1:] * np.conj(spectra[:-1]), n=2 * windows, axis=1).sum(axis=0) / pair_norms
+        lags = np.concatenate([np.arange(windows), np.arange(-windows, 0)])
+
+        # Delays between groups' centers allowed by the speed limits
+        group_distance = (data.shape[1] // self.channel_groups) * self.spatial_resolution  # Space [m]
+        window_duration = self.window_length * self.dt  # Time [s] of the envelopes' windows (whole samples)
+        min_lag = group_distance / (self.speed_limits[1] / 3.6) / window_duration
+        max_lag = group_distance / (self.speed_limits[0] / 3.6) / window_duration
+        valid_indexes = np.flatnonzero((np.abs(lags) >= min_lag) & (np.abs(lags) <= max_lag))
+        if valid_indexes.size == 0:
+            return None
+
+        peak_index = valid_indexes[np.argmax(correlation[valid_indexes])]
+        if correlation[peak_index] < self.min_correlation:
+            return None
+
+        # Parabolic interpolation of the peak (sub-window delay)
+        lag = float(lags[peak_index])
+        previous_value, next_value = correlation[peak_index - 1], correlation[(peak_index + 1) % correlation.size]
+        curvature = previous_value - 2 * correlation[peak_index] + next_value
+        if curvature < 0:
+            lag += 0.5 * (previous_value - next_value) / curvature
+
+        speed = group_distance / (abs(lag) * window_duration) * 3.6
+        self.speed = float(np.clip(speed, *self.speed_limits))
+        self.direction = 1 if lag > 0 else -1
+        self.correlation = float(correlation[peak_index])
+        return self.speed
@@ -0,0 +1,222 @@
+import os
+import json
+import base64
+import struct
+from uuid import UUID
+
+from src.schema import get_json_schema
+from src.json_file_manager_rt import JsonFileManagerRT
+from src.capture_statistics import CaptureStatistics
+from src.kernels import get_kernels
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class StreamFileManagerRT:
+    def __init__(self, output_path: str, **config):
+        """
+        Writes the chunks generated by 'BufferManagerRT' in append mode ('append-capture'), where each capture is a
+        single file ('_part_00') which is kept open while the capture is ACTIVE:
+            "stream-state": "open"   -> Creates the capture file with a reserved header and writes the chunk's data.
+            "stream-state": "append" -> Appends the chunk's data to the open capture file.
+            "complete": True         -> Finalizes the header (total 'temporal_samples' and the capture's
+                                        'statistics') and closes the file.
+        Headers are written with a fixed reserved length (padded with whitespaces), so they can be rewritten in place.
+        """
+        self.output_path = output_path
+        self.config = config
+        self.spatial_resolution = config["params"]["spatial-resolution"]
+        self.write_block_size = config["params"]["write-block-size"]  # Bytes
+        self.kernels = get_kernels(**config)
+        self.save_binary = config["client"]["save-binary"]
+        self.save_hdf5 = config["client"]["save-hdf5"]
+        self.max_envelope_points = config["capture-statistics"]["max-envelope-points"]
+
+        # Open captures by (section-id, uuid)
+        self.captures = {}
+
+    # HEADERS
+    def get_json_header(self, info):
+        """Binary files' header is the whole JSON schema (without strain data), JSON files' header is "info"."""
+        return {"info": info, "strain": None} if self.save_binary else info
+
+    def get_padded_json_header(self, info, reserved_length):
+        json_header = json.dumps(self.get_json_header(info)).encode('ascii')
+        if len(json_header) > reserved_length:
+            raise ValueError(f"JSON header length ({len(json_header)}) exceeds the reserved length ({reserved_length})")
+        return json_header.ljust(reserved_length)
+
+    @staticmethod
+    def get_npy_header(shape, reserved_shape):
+        """npy (v1.0) header of a float16 matrix, padded to the header length of 'reserved_shape'."""
+        def get_header_dict(header_shape):
+            return "{'descr': '<f2', 'fortran_order': False, 'shape': %s, }" % repr(tuple(header_shape))
+
+        # Total header length (magic string + length + dict + newline) is aligned to 64 bytes
+        header_length = len(get_header_dict(reserved_shape)) + 1
+        header_length = ((10 + header_length + 63) // 64) * 64 - 10
+        header = get_header_dict(shape).ljust(header_length - 1) + "\n"
+        return b"\x93NUMPY\x01\x00" + struct.pack("<H", header_length) + header.encode('latin1')
+
+    def get_info(self, chunk, temporal_samples):
+        info = get_json_schema()['info']
+        info.update(
+            {
+                "uuid": str(chunk["uuid"]),
+                "spatial_resolution": chunk.get("spatial-resolution", self.spatial_resolution),
+                "temporal_samples": temporal_samples,
+                "spatial_samples": chunk["train-data"].shape[1],
+                "initial_timestamp": chunk["initial-timestamp"],
+                "sample_offset": chunk["sample-offset"],
+                "zone_ID": chunk["section-id"],
+                "file_chunk": chunk["file-chunk"],
+                "total_chunks": 1,
+                "statistics": chunk.get("statistics")
+            }
+        )
+        return info
+
+    # STREAM WRITERS
+    def open_capture(self, chunk):
+        output_day_path = JsonFileManagerRT.get_output_day_path(self.output_path, chunk["initial-timestamp"])
+        if not os.path.isdir(output_day_path):
+            os.makedirs(output_day_path)
+
+        filename = JsonFileManagerRT.get_filename(chunk["initial-timestamp"], chunk["section-id"], chunk["file-chunk"])
+        extension = ".bin" if self.save_binary else ".json"
+        fullpath = os.path.join(output_day_path, f"{filename}{extension}")
+        logger.info(f"Opening capture file: {fullpath}")
+
+        # Reserve the header length of the largest possible capture
+        info = self.get_info(chunk, temporal_samples=0)
+        reserved_info = dict(info, temporal_samples=pow(10, 15))
+        if info["statistics"] is not None:
+            reserved_info["statistics"] = CaptureStatistics.get_reserved_statistics(self.max_envelope_points)
+        reserved_length = len(json.dumps(self.get_json_header(reserved_info)))
+        reserved_shape = (pow(10, 15), chunk["train-data"].shape[1])
+
+        capture = {
+            "fullpath": fullpath,
+            "file": open(fullpath, "wb"),
+            "info": info,
+            "reserved-length": reserved_length,
+            "reserved-shape": reserved_shape,
+            "pending-bytes": b""
+        }
+        self.write_header(capture)
+        return capture
+
+    def write_header(self, capture):
+        file = capture["file"]
+        json_header = self.get_padded_json_header(capture["info"], capture["reserved-length"])
+
+        if self.save_binary:
+            file.write(struct.pack('<H', len(json_header)))
+            file.write(json_header)
+            file.write(self.get_npy_header((capture["info"]["temporal_samples"], capture["info"]["spatial_samples"]),
+                                           capture["reserved-shape"]))
+        else:
+            file.write(b'{"info": ')
+            file.write(json_header)
+            file.write(b', "strain": "')
+
+    def append_data(self, capture, matrix):
+        file = capture["file"]
+        for float16_block in JsonFileManagerRT.iter_float16_blocks(matrix, self.write_block_size,
+                                                                   kernels=self.kernels):
+            if self.save_binary:
+                file.write(float16_block)
+            else:
+                # Base64 is encoded in groups of 3 bytes. Remaining bytes are encoded with the next block.
+                float16_block = capture["pending-bytes"] + float16_block
+                encoded_length = len(float16_block) - len(float16_block) % 3
+                file.write(base64.b64encode(float16_block[:encoded_length]))
+                capture["pending-bytes"] = float16_block[encoded_length:]
+
+        capture["info"]["temporal_samples"] += matrix.shape[0]
+
+    def close_capture(self, capture):
+        file = capture["file"]
+        if not self.save_binary:
+            file.write(base64.b64encode(capture["pending-bytes"]))
+            file.write(b'"}')
+
+        # Rewrite the header with the final number of temporal samples
+        file.seek(0)
+        self.write_header(capture)
+        file.close()
+        logger.info(f"Capture file closed: {capture['fullpath']} "
+                    f"(temporal_samples: {capture['info']['temporal_samples']})")
+
+    def write(self, chunk):
+        """Write a chunk generated in append mode. Returns True if the chunk has been written."""
+        if self.save_hdf5:
+            # HDF5 datasets are appendable by themselves
+            JsonFileManagerRT(self.output_path, chunk, **self.config)
+            return True
+
+        key = (chunk["section-id"], chunk["uuid"])
+        try:
+            if chunk["stream-state"] == "open":
+                self.captures[key] = self.open_capture(chunk)
+
+            capture = self.captures[key]
+            self.append_data(capture, chunk["train-data"])
+            if chunk.get("statistics") is not None:
+                capture["info"]["statistics"] = chunk["statistics"]
+
+            if chunk["complete"]:
+                self.close_capture(self.captures.pop(key))
+
+            return True
+
+        except Exception as e:
+            logger.error(f"SERIALIZATION ERROR: {e}", exc_info=True)
+            return False
+
+    # CHECKPOINTS
+    def get_state(self):
+        """State of the open capture files (see 'CheckpointManager'). Written data is flushed to disk."""
+        state = []
+        for (section_id, uuid), capture in self.captures.items():
+            capture["file"].flush()
+            os.fsync(capture["file"].fileno())
+            state.append(
+                {
+                    "section-id": section_id,
+                    "uuid": str(uuid),
+                    "fullpath": capture["fullpath"],
+                    "info": capture["info"],
+                    "reserved-length": capture["reserved-length"],
+                    "reserved-shape": capture["reserved-shape"],
+                    "pending-bytes": base64.b64encode(capture["pending-bytes"]).decode('ascii'),
+                    "file-position": capture["file"].tell()
+                }
+            )
+        return state
+
+    def restore_state(self, state):
+        """Reopen the capture files of a checkpoint. Data written after the checkpoint is discarded, since it is
+        written again when the following batches are processed.
+        """
+        for capture_state in state:
+            file = open(capture_state["fullpath"], "r+b")
+            file.truncate(capture_state["file-position"])
+            file.seek(capture_state["file-position"])
+
+            key = (capture_state["section-id"], UUID(capture_state["uuid"]))
+            self.captures[key] = {
+                "fullpath": capture_state["fullpath"],
+                "file": file,
+                "info": capture_state["info"],
+                "reserved-length": capture_state["reserved-length"],
+                "reserved-shape": tuple(capture_state["reserved-shape"]),
+                "pending-bytes": base64.b64decode(capture_state["pending-bytes"])
+            }
+            logger.info(f"Capture file reopened: {capture_state['fullpath']}")
+
+    def close(self):
+        """Finalize every open capture file (e.g. at the end of the processing)."""
+        for key in list(self.captures.keys()):
+            self.close_capture(self.captures.pop(key))
@@ -1,38 +1,55 @@
 import numpy as np
 import time
 from uuid import uuid4
-from dotenv import load_dotenv
 
+from src.kernels import get_kernels
 from src.logger import load_logger
 
-load_dotenv()
 logger = load_logger(__name__)
 
 
 class TrainDetector:
-    def __init__(self, batch, **config):
+    def __init__(self, batch, initial_timestamp=None, **config):
         self.batch = batch
+        self.initial_timestamp = time.time() if initial_timestamp is None else initial_timestamp
         self.section_map = config['section-map']
+        self.kernels = get_kernels(**config)
 
         # Detection Parameters
         self.spatial_window = config['train-detector']['spatial-window']
         self.validity_percentage = config['train-detector']['validity-percentage']
         self.detection_threshold = config['train-detector']['detection-threshold']
 
+        # Sliding-window Detection Parameters
+        self.dt = config['signal']['N'] * (1 / config['signal']['fs'])  # Time [s]
+        self.sliding_window = config['train-detector']['sliding-window']
+        self.window_length = max(1, int(round(config['train-detector']['window-time'] / self.dt)))  # Samples
+        self.hop_length = max(1, int(round(config['train-detector']['hop-time'] / self.dt)))  # Samples
+
         # Train Detection
         self.section_batches = self.compute_section_batches()
         self.section_status = self.compute_section_status()
 
     @staticmethod
-    def get_rms(section, axis=0):
-        return np.sqrt(np.mean(section ** 2, axis=axis))
+    def get_sliding_rms(section, window_length, hop_length):
+        """RMS of each channel over overlapping temporal windows. Windows are computed from the cumulative sum of
+        squared samples, so each window costs O(1) regardless of its length.
+        :return: Matrix of shape (number of windows, spatial samples) and the first row index of each window
+        """
+        window_length = min(window_length, section.shape[0])
+        cumsum = np.zeros((section.shape[0] + 1, section.shape[1]))
+        np.cumsum(np.square(section), axis=0, out=cumsum[1:])
+
+        starts = np.arange(0, section.shape[0] - window_length + 1, hop_length)
+        window_energy = np.maximum(cumsum[starts + window_length] - cumsum[starts], 0)
+        return np.sqrt(window_energy / window_length), starts
 
     # Methods
     def compute_section_batches(self):
         return [{key: self.batch[:, value[0]:value[1]]} for key, value in self.section_map.items()]
 
     def train_detector_mode_0(self, section):
-        buff_rms = self.get_rms(section)
+        buff_rms = self.kernels.rms(section)
 
         # Debug -------------------------------------------------------
         logger.debug(f"[RMS MEAN]: {round(np.mean(buff_rms), 5)}")
@@ -45,8 +62,8 @@ class TrainDetector:
             return counts[0] >= self.spatial_window
         return False
 
-    def train_detector_mode_1(self, section):
-        buff_rms = self.get_rms(section)
+    def train_detector_mode_1(self, section, buff_rms=None):
+        buff_rms = self.kernels.rms(section) if buff_rms is None else buff_rms
         number_of_valid_samples = int(self.validity_percentage * len(buff_rms))
 
         # Debug -------------------------------------------------------
@@ -54,18 +71,66 @@ class TrainDetector:
         logger.debug(f"[VALID SAMPLES]: {number_of_valid_samples}")
         # -------------------------------------------------------------
 
-        if len(list(filter(lambda x: x >= self.detection_threshold, buff_rms))) > number_of_valid_samples:
+        if self.kernels.count_above(buff_rms, self.detection_threshold) > number_of_valid_samples:
             return True
         return False
 
+    def train_detector_sliding_window(self, section):
+        """Mode 1 detection evaluated on overlapping windows of 'window-time' seconds every 'hop-time' seconds.
+        :return: status of each window and the first row index of each window
+        """
+        window_rms, starts = self.get_sliding_rms(section, self.window_length, self.hop_length)
+        number_of_valid_samples = int(self.validity_percentage * window_rms.shape[1])
+        window_status = np.count_nonzero(window_rms >= self.detection_threshold, axis=1) > number_of_valid_samples
+
+        # Debug -------------------------------------------------------
+        logger.debug(f"[ACTIVE WINDOWS]: {np.count_nonzero(window_status)}/{window_status.size}")
+        # -------------------------------------------------------------
+
+        return window_status, starts
+
     def compute_section_status(self):
-        return [{"section-id": list(section.keys())[0],
-                 "status": self.train_detector_mode_1(list(section.values())[0]),
-                 "initial-timestamp": time.time(),
-                 "batch-data": list(section.values())[0]}
-                for section in self.section_batches]
+        """
+        Computes the train-event status of each section.
+        "onset-index" and "offset-index" are the first and last rows of the batch where a train has been detected
+        (the whole batch when not in sliding-window mode), or None if there is no train.
+        "rms" is the RMS of each channel of the section's batch (used by 'CaptureStatistics').
+        """
+        section_status = []
+        for section in self.section_batches:
+            section_id, section_data = list(section.items())[0]
+            buff_rms = self.kernels.rms(section_data)
+            processed_section = {"section-id": section_id,
+                                 "initial-timestamp": self.initial_timestamp,
+                                 "batch-data": section_data,
+                                 "rms": buff_rms}
+
+            if self.sliding_window:
+                window_status, starts = self.train_detector_sliding_window(section_data)
+                active_starts = starts[window_status]
+                status = active_starts.size > 0
+                processed_section.update({
+                    "window-status": window_status,
+                    "onset-index": int(active_starts[0]) if status else None,
+                    "offset-index": int(min(active_starts[-1] + self.window_length, section_data.shape[0]))
+                    if status else None
+                })
+            else:
+                status = self.train_detector_mode_1(section_data, buff_rms)
+                processed_section.update({
+                    "onset-index": 0 if status else None,
+                    "offset-index": section_data.shape[0] if status else None
+                })
+
+            processed_section.update({"status": status})
+            section_status.append(processed_section)
+
+        return section_status
 
     # Getters
+    def get_initial_timestamp(self):
+        return self.initial_timestamp
+
     def get_section_status(self):
         return self.section_status
 
@@ -0,0 +1,204 @@
+import json
+import time
+
+import zmq
+import numpy as np
+
+from src.buffer_manager_rt import BufferManagerRT
+from src.json_file_manager_rt import JsonFileManagerRT
+from src.stream_file_manager_rt import StreamFileManagerRT
+from src.memory_governor import MemoryGovernor
+from src.kernels import get_kernels
+from src.logger import load_logger
+
+logger = load_logger(__name__)
+
+
+class ZmqCaptureService:
+    def __init__(self, output_path, context=None, **config):
+        """
+        Network service mode of the pipeline.
+        Ingest (PULL socket): Multipart messages [header, data], where header is a JSON object with the batch's
+            "shape", "dtype" and "initial-timestamp", and data is the batch's raw buffer (received without copies).
+            A header with {"stop": true} stops the service. Malformed messages are rejected (logged and counted).
+        Publish (PUB socket): Multipart messages [section-id, header, data] for each generated chunk, where header
+            is a JSON object with the chunk's metadata, and data is the chunk's raw buffer.
+        Backpressure: The ingest socket queues at most 'rcv-hwm' messages, so producers block (or drop, depending
+        on their socket type) when the pipeline falls behind. PUB sockets drop messages for subscribers which are
+        more than 'snd-hwm' messages behind.
+        """
+        self.output_path = output_path
+        self.config = config
+        self.context = context if context is not None else zmq.Context.instance()
+
+        # ZMQ Config
+        self.ingest_endpoint = config['zmq']['ingest-endpoint']
+        self.publish_endpoint = config['zmq']['publish-endpoint']
+        self.rcv_hwm = config['zmq']['rcv-hwm']
+        self.snd_hwm = config['zmq']['snd-hwm']
+        self.publish = config['zmq']['publish']
+        self.save = config['zmq']['save']
+        self.lag_report_interval = config['zmq']['lag-report-interval']  # Batches
+
+        # Signal Config
+        self.dt = config['signal']['N'] * (1 / config['signal']['fs'])  # Time [s]
+
+        # Sockets
+        self.ingest_socket = self.context.socket(zmq.PULL)
+        self.ingest_socket.setsockopt(zmq.RCVHWM, self.rcv_hwm)
+        self.ingest_socket.bind(self.ingest_endpoint)
+
+        self.publish_socket = None
+        if self.publish:
+            self.publish_socket = self.context.socket(zmq.PUB)
+            self.publish_socket.setsockopt(zmq.SNDHWM, self.snd_hwm)
+            self.publish_socket.bind(self.publish_endpoint)
+
+        # Pipeline. Kernels are loaded (and warmed up) by the thread which builds the service, which may run it in
+        # another thread
+        get_kernels(**config)
+        self.memory_governor = MemoryGovernor(**config) if config['memory-governor']['enabled'] else None
+        self.buffer_manager_rt = BufferManagerRT(memory_governor=self.memory_governor, **config)
+        self.stream_file_manager = StreamFileManagerRT(output_path, **config) \
+            if config['client']['append-capture'] else None
+
+        # Metrics
+        self.received_batches = 0
+        self.rejected_messages = 0
+        self.published_chunks = 0
+        self.lag = 0  # Time [s] between the end of the last batch's acquisition and the end of its processing
+        self.max_lag = 0
+
+    # Producer helpers
+    @staticmethod
+    def connect_producer(endpoint, snd_hwm=10, context=None):
+        """PUSH socket to send batches to the service. 'send' blocks when 'snd-hwm' batches are queued."""
+        context = context if context is not None else zmq.Context.instance()
+        socket = context.socket(zmq.PUSH)
+        socket.setsockopt(zmq.SNDHWM, snd_hwm)
+        socket.connect(endpoint)
+        return socket
+
+    @staticmethod
+    def send_batch(socket, batch, initial_timestamp=None):
+        batch = np.ascontiguousarray(batch)
+        header = {"shape": batch.shape, "dtype": batch.dtype.str, "initial-timestamp": initial_timestamp}
+        socket.send_multipart([json.dumps(header).encode('utf-8'), batch], copy=False)
+
+    @staticmethod
+    def send_stop(socket):
+        socket.send_multipart([json.dumps({"stop": True}).encode('utf-8'), b""])
+
+    # Service
+    def receive_batch(self):
+        """
+        Malformed messages are logged, counted ('rejected-messages' metric) and skipped.
+        :return: (batch, initial_timestamp), or None when a stop message is received
+        """
+        while True:
+            frames = self.ingest_socket.recv_multipart(copy=False)
+            try:
+                return self.parse_message(frames)
+            except (ValueError, TypeError, KeyError) as e:
+                self.rejected_messages += 1
+                logger.error(f"ZMQ SERVICE :: Malformed message rejected ({len(frames)} frames): {e!r}")
+
+    @staticmethod
+    def parse_message(frames):
+        """:return: (batch, initial_timestamp), or None for a stop message. Raises ValueError, TypeError or KeyError
+        when the message is malformed.
+        """
+        if len(frames) != 2:
+            raise ValueError(f"Expected 2 frames [header, data], got {len(frames)}")
+
+        header_frame, data_frame = frames
+        header = json.loads(header_frame.bytes.decode('utf-8'))
+        if not isinstance(header, dict):
+            raise ValueError("The header is not a JSON object")
+        if header.get("stop"):
+            return None
+
+        batch = np.frombuffer(data_frame.buffer, dtype=header["dtype"]).reshape(header["shape"])
+        if batch.ndim != 2:
+            raise ValueError(f"Expected a 2-D batch, got shape {batch.shape}")
+
+        initial_timestamp = header["initial-timestamp"]
+        if initial_timestamp is not None and not isinstance(initial_timestamp, (int, float)):
+            raise TypeError(f"Invalid initial-timestamp: {initial_timestamp!r}")
+        return batch, initial_timestamp
+
+    def publish_chunk(self, chunk):
+        train_data = np.ascontiguousarray(chunk["train-data"])
+        header = {
+            "section-id": chunk["section-id"],
+            "uuid": str(chunk["uuid"]),
+            "file-chunk": chunk["file-chunk"],
+            "initial-timestamp": chunk["initial-timestamp"],
+            "sample-offset": chunk["sample-offset"],
+            "complete": chunk["complete"],
+            "stream-state": chunk.get("stream-state"),
+            "statistics": chunk.get("statistics"),
+            "shape": train_data.shape,
+            "dtype": train_data.dtype.str
+        }
+        self.publish_socket.send_multipart(
+            [chunk["section-id"].encode('utf-8'), json.dumps(header).encode('utf-8'), train_data], copy=False)
+        self.published_chunks += 1
+
+    def save_chunk(self, chunk):
+        if self.stream_file_manager is not None:
+            self.stream_file_manager.write(chunk)
+        else:
+            JsonFileManagerRT(self.output_path, chunk, **self.config)
+
+    def update_lag(self, batch, initial_timestamp):
+        if initial_timestamp is None:
+            return
+
+        self.lag = time.time() - (initial_timestamp + batch.shape[0] * self.dt)
+        self.max_lag = max(self.max_lag, self.lag)
+
+        if self.received_batches % self.lag_report_interval == 0:
+            logger.info(f"ZMQ SERVICE :: batches: {self.received_batches}, chunks published: "
+                        f"{self.published_chunks}, lag: {round(self.lag, 3)} s, max lag: {round(self.max_lag, 3)} s")
+
+    def run(self):
+        logger.info(f"ZMQ service listening on '{self.ingest_endpoint}'"
+                    + (f", publishing on '{self.publish_endpoint}'" if self.publish else ""))
+
+        while True:
+            received = self.receive_batch()
+            if received is None:
+                logger.info("ZMQ service stop message received.")
+                break
+
+            batch, initial_timestamp = received
+            self.received_batches += 1
+
+            for chunk in self.buffer_manager_rt.generate_train_capture(batch, initial_timestamp):
+                if self.publish:
+                    self.publish_chunk(chunk)
+                if self.save:
+                    self.save_chunk(chunk)
+                self.buffer_manager_rt.release_pending_write(chunk)
+
+            self.update_lag(batch, initial_timestamp)
+
+        self.close()
+
+    def close(self):
+        if self.stream_file_manager is not None:
+            self.stream_file_manager.close()
+        self.ingest_socket.close()
+        if self.publish_socket is not None:
+            self.publish_socket.close()
+
+    # Getters
+    def get_metrics(self):
+        return {
+            "received-batches": self.received_batches,
+            "rejected-messages": self.rejected_messages,
+            "published-chunks": self.published_chunks,
+            "lag": self.lag,
+            "max-lag": self.max_lag
+        }
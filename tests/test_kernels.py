@@ -0,0 +1,53 @@
+import os
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("ENVIRONMENT", "dev")
+os.environ.setdefault("LEVEL", "INFO")
+
+from src.kernels import NumpyKernels  # noqa: E402
+
+
+def get_numba_kernels():
+    pytest.importorskip("numba")
+    from src.numba_kernels import NumbaKernels
+    return NumbaKernels
+
+
+@pytest.fixture(params=["numpy", "numba"])
+def kernels(request):
+    return NumpyKernels if request.param == "numpy" else get_numba_kernels()
+
+
+@pytest.fixture
+def data():
+    return np.random.default_rng(0).normal(scale=10, size=(257, 33))
+
+
+@pytest.mark.parametrize("N", [1, 4, 7])
+def test_movmean_downsample(kernels, data, N):
+    np.testing.assert_allclose(kernels.movmean_downsample(data, N), NumpyKernels.movmean_downsample(data, N),
+                               rtol=1e-12, atol=1e-12)
+
+
+def test_rms(kernels, data):
+    np.testing.assert_allclose(kernels.rms(data), NumpyKernels.rms(data), rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(kernels.rms(data[:1]), NumpyKernels.rms(data[:1]), rtol=1e-12, atol=1e-12)
+
+
+@pytest.mark.parametrize("threshold", [0, 5, 10])
+def test_count_above(kernels, data, threshold):
+    assert kernels.count_above(np.abs(data[0]), threshold) == NumpyKernels.count_above(np.abs(data[0]), threshold)
+
+
+def test_float16_bytes(kernels, data):
+    # float16 edge cases: zeros, subnormals, rounding ties, overflow, infinities and NaN
+    edge_values = np.array([0., -0., 1e-8, -3e-8, 6e-5, 6.1e-5, 2049., 2051., 0.1, 1 / 3, 65504., 65519., 65520.,
+                            1e6, -1e6, np.inf, -np.inf, np.nan])
+    rng = np.random.default_rng(1)
+    float16_data = np.concatenate([data.ravel(), edge_values, rng.normal(scale=1e-5, size=64)]).reshape(-1, 1)
+
+    with np.errstate(over='ignore'):
+        assert kernels.float16_bytes(float16_data) == NumpyKernels.float16_bytes(float16_data)
+        assert kernels.float16_bytes(data[::2, 1:]) == NumpyKernels.float16_bytes(data[::2, 1:])
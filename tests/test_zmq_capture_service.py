@@ -0,0 +1,101 @@
+import os
+import copy
+import json
+import threading
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("ENVIRONMENT", "dev")
+os.environ.setdefault("LEVEL", "INFO")
+
+zmq = pytest.importorskip("zmq")
+
+from src.config import get_config  # noqa: E402
+from src.zmq_capture_service import ZmqCaptureService  # noqa: E402
+
+
+@pytest.fixture
+def service_config():
+    config = copy.deepcopy(get_config())
+    config['zmq'].update({"ingest-endpoint": "inproc://test-ingest", "publish-endpoint": "inproc://test-publish",
+                          "publish": True, "save": False})
+    return config
+
+
+def generate_batches(config, n_batches=120, train_batches=range(30, 50)):
+    """Noise batches with a train (high-energy batches) over every section."""
+    rng = np.random.default_rng(0)
+    batch_shape = (config['params']['dev-batch-shape'][0], 300)
+    dt = batch_shape[0] * config['signal']['N'] / config['signal']['fs']
+    for i in range(n_batches):
+        batch = rng.normal(scale=0.01, size=batch_shape)
+        if i in train_batches:
+            batch *= 1000
+        yield batch, 1000.0 + i * dt
+
+
+def test_round_trip(service_config, tmp_path):
+    context = zmq.Context()
+    # The service is built (and its kernels warmed up) in the main thread, and run in another thread
+    service = ZmqCaptureService(str(tmp_path), context=context, **service_config)
+    service_thread = threading.Thread(target=service.run)
+
+    subscriber = context.socket(zmq.SUB)
+    subscriber.setsockopt(zmq.SUBSCRIBE, b"")
+    subscriber.setsockopt(zmq.RCVTIMEO, 10000)
+    subscriber.connect(service_config['zmq']['publish-endpoint'])
+    producer = ZmqCaptureService.connect_producer(service_config['zmq']['ingest-endpoint'], context=context)
+    producer.setsockopt(zmq.SNDTIMEO, 10000)  # Fail instead of blocking if the service stops receiving
+
+    try:
+        service_thread.start()
+
+        # Malformed messages are rejected, and the service keeps running
+        producer.send_multipart([b"not a header"])
+        producer.send_multipart([b"{not json", b""])
+        producer.send_multipart([json.dumps({"shape": [2, 2], "initial-timestamp": None}).encode(), b"\x00" * 32])
+        producer.send_multipart([json.dumps({"shape": [3, 3], "dtype": "<f8", "initial-timestamp": None}).encode(),
+                                 b"\x00" * 32])
+
+        sent_batches = 0
+        for batch, initial_timestamp in generate_batches(service_config):
+            ZmqCaptureService.send_batch(producer, batch, initial_timestamp)
+            sent_batches += 1
+
+        section_id, header_frame, data_frame = subscriber.recv_multipart()
+        header = json.loads(header_frame)
+        train_data = np.frombuffer(data_frame, dtype=header["dtype"]).reshape(header["shape"])
+        assert section_id.decode() in service_config['section-map']
+        assert header["section-id"] == section_id.decode()
+        assert header["file-chunk"] == 0
+        assert train_data.shape[1] == np.diff(service_config['section-map'][header["section-id"]])[0]
+
+        ZmqCaptureService.send_stop(producer)
+        service_thread.join(timeout=60)
+        assert not service_thread.is_alive()
+
+        metrics = service.get_metrics()
+        assert metrics["rejected-messages"] == 4
+        assert metrics["received-batches"] == sent_batches
+        assert metrics["published-chunks"] > 0
+    finally:
+        if service_thread.is_alive():
+            ZmqCaptureService.send_stop(producer)
+            service_thread.join(timeout=60)
+        context.destroy(linger=0)
+
+
+@pytest.mark.parametrize("frames", [
+    [b"{}"],
+    [b"[1, 2]", b""],
+    [json.dumps({"shape": [4], "dtype": "<f8", "initial-timestamp": None}).encode(), b"\x00" * 32],
+    [json.dumps({"shape": [2, 2], "dtype": "<f8", "initial-timestamp": "now"}).encode(), b"\x00" * 32],
+])
+def test_parse_malformed_message(frames):
+    with pytest.raises((ValueError, TypeError, KeyError)):
+        ZmqCaptureService.parse_message([zmq.Frame(frame) for frame in frames])
+
+
+def test_parse_stop_message():
+    assert ZmqCaptureService.parse_message([zmq.Frame(b'{"stop": true}'), zmq.Frame(b"")]) is None